@@ -0,0 +1,251 @@
+/*
+ * Annotations drawn over a slide, see presentation/annotations.py.
+ *
+ *   var annotations = new Annotations(canvas, {
+ *       deck: {path: ...} or {presentation: ...},
+ *       editable: true,          // the presenter draws, viewers only watch
+ *       batch_interval: 500,     // ms between posts of what was drawn
+ *       poll_interval: 2000,     // ms between polls, 0 to not poll
+ *       max_points: 200,         // ANNOTATION_MAX_POINTS
+ *       max_ops: 50              // ANNOTATION_BATCH_OPS
+ *   });
+ *   annotations.show(page);
+ *
+ * Strokes are kept as fractions of the page size, so they scale with the
+ * canvas. Only what came after the last seq seen is fetched, and the server
+ * sends a snapshot instead when it has compacted past that.
+ */
+'use strict';
+
+var Annotations = function(canvas, options) {
+    var self = this;
+    var context = canvas.getContext('2d');
+    var page = null;
+    var strokes = [];
+    var seq = -1;
+    // operations drawn but not posted yet, as {page: n, ops: [...]}
+    var batches = [];
+    var posting = false;
+    var drawing = null;
+    var color = '#e00';
+    var width = 4;
+    var max_points = options.max_points || 200;
+    var max_ops = options.max_ops || 50;
+
+    var params = function(extra) {
+        return $.extend({}, options.deck, extra);
+    };
+
+    // the same as annotations.fold on the server
+    var fold = function(ops) {
+        for (var i = 0; i < ops.length; i++) {
+            var op = ops[i];
+            if (op.op == 'clear') {
+                strokes = [];
+            } else if (op.op == 'erase') {
+                strokes = $.grep(strokes, function(stroke) { return stroke.id != op.id; });
+            } else {
+                strokes.push(op);
+            }
+        }
+    };
+
+    var draw = function(stroke) {
+        var points = stroke.points;
+        context.strokeStyle = stroke.color;
+        // widths are in thousandths of the page width
+        context.lineWidth = Math.max(stroke.width * canvas.width / 1000, 1);
+        context.lineCap = context.lineJoin = 'round';
+        context.beginPath();
+        context.moveTo(points[0][0] * canvas.width, points[0][1] * canvas.height);
+        for (var i = 1; i < points.length; i++) {
+            context.lineTo(points[i][0] * canvas.width, points[i][1] * canvas.height);
+        }
+        if (points.length == 1) {
+            context.lineTo(points[0][0] * canvas.width + 0.1, points[0][1] * canvas.height);
+        }
+        context.stroke();
+    };
+
+    var redraw = function() {
+        context.clearRect(0, 0, canvas.width, canvas.height);
+        for (var i = 0; i < strokes.length; i++) {
+            draw(strokes[i]);
+        }
+        if (drawing) {
+            draw(drawing);
+        }
+    };
+
+    var apply = function(changes) {
+        if (!changes) {
+            return;
+        }
+        if (changes.snapshot) {
+            strokes = changes.snapshot.slice();
+        } else if (changes.seq <= seq) {
+            return;
+        }
+        for (var i = 0; i < changes.deltas.length; i++) {
+            if (changes.snapshot || changes.deltas[i][0] > seq) {
+                fold(changes.deltas[i][1]);
+            }
+        }
+        seq = changes.seq;
+        redraw();
+    };
+
+    var fetch = function(done) {
+        var requested = page;
+        $.ajax({
+            url: '/annotations',
+            data: params({n: page, since: seq}),
+            dataType: 'json',
+            success: function(changes) {
+                if (requested == page) {
+                    apply(changes);
+                }
+            },
+            complete: done
+        });
+    };
+
+    var flush = function() {
+        if (posting || !batches.length) {
+            return;
+        }
+        posting = true;
+        var batch = batches.shift();
+        $.ajax({
+            url: '/annotations',
+            type: 'POST',
+            data: params({n: batch.page, ops: JSON.stringify(batch.ops)}),
+            dataType: 'json',
+            success: function(result) {
+                // what we drew ourselves is on screen already
+                if (batch.page == page && result.seq == seq + 1) {
+                    seq = result.seq;
+                }
+            },
+            complete: function() {
+                posting = false;
+            }
+        });
+    };
+
+    var send = function(op) {
+        var last = batches[batches.length - 1];
+        if (!last || last.page != page || last.ops.length >= max_ops) {
+            last = {page: page, ops: []};
+            batches.push(last);
+        }
+        last.ops.push(op);
+        fold([op]);
+        redraw();
+    };
+
+    // at most max_points, every n-th point of a long stroke
+    var thin = function(points) {
+        if (points.length <= max_points) {
+            return points;
+        }
+        var step = points.length / (max_points - 1);
+        var thinned = [];
+        for (var i = 0; i < max_points - 1; i++) {
+            thinned.push(points[Math.floor(i * step)]);
+        }
+        thinned.push(points[points.length - 1]);
+        return thinned;
+    };
+
+    var position = function(event) {
+        var offset = $(canvas).offset();
+        var x = (event.pageX - offset.left) / $(canvas).width();
+        var y = (event.pageY - offset.top) / $(canvas).height();
+        return [Math.round(Math.min(Math.max(x, 0), 1) * 1000) / 1000,
+                Math.round(Math.min(Math.max(y, 0), 1) * 1000) / 1000];
+    };
+
+    self.drawing_enabled = false;
+
+    // the canvas follows the size of the slide under it
+    self.resize = function(w, h) {
+        canvas.width = w;
+        canvas.height = h;
+        $(canvas).css({width: w + 'px', height: h + 'px'});
+        redraw();
+    };
+
+    self.show = function(n) {
+        if (n == page) {
+            return;
+        }
+        flush();
+        page = n;
+        strokes = [];
+        seq = -1;
+        redraw();
+        fetch();
+    };
+
+    self.toggle = function() {
+        self.drawing_enabled = !self.drawing_enabled;
+        $(canvas).css('pointer-events', self.drawing_enabled ? 'auto' : 'none');
+    };
+
+    self.undo = function() {
+        for (var i = strokes.length - 1; i >= 0; i--) {
+            if (strokes[i].mine) {
+                send({op: 'erase', id: strokes[i].id});
+                return;
+            }
+        }
+    };
+
+    self.clear = function() {
+        send({op: 'clear'});
+    };
+
+    if (options.editable) {
+        $(canvas).css('pointer-events', 'none');
+        $(canvas).mousedown(function(event) {
+            if (!self.drawing_enabled) {
+                return;
+            }
+            drawing = {op: 'stroke',
+                       id: (new Date().getTime()).toString(36) + Math.random().toString(36).slice(2, 8),
+                       color: color, width: width, points: [position(event)]};
+            event.preventDefault();
+        });
+        $(canvas).mousemove(function(event) {
+            if (drawing) {
+                drawing.points.push(position(event));
+                redraw();
+            }
+        });
+        $(document).mouseup(function() {
+            if (drawing) {
+                var stroke = drawing;
+                drawing = null;
+                stroke.points = thin(stroke.points);
+                send(stroke);
+                // for undo, the server drops what it does not know
+                strokes[strokes.length - 1].mine = true;
+            }
+        });
+        setInterval(flush, options.batch_interval || 500);
+    }
+
+    if (options.poll_interval) {
+        var poll = function() {
+            if (page === null) {
+                setTimeout(poll, options.poll_interval);
+                return;
+            }
+            fetch(function() {
+                setTimeout(poll, options.poll_interval);
+            });
+        };
+        poll();
+    }
+};
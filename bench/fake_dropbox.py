@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+A fake of the parts of the Dropbox API the app talks to, for load tests.
+
+    python bench/fake_dropbox.py --port 9100 --latency 50 --files 200 --file-size 2000000
+
+Implements oauth/request_token, oauth/access_token, account/info, delta,
+metadata/sandbox (with hash revalidation) and files/sandbox (with Range).
+Signatures are not checked. Every response is delayed by --latency
+milliseconds plus up to --jitter more. The app folder holds --files decks of
+--file-size bytes, named deck-0000.pdf and so on.
+"""
+
+import binascii
+import hashlib
+import optparse
+import os
+import random
+import re
+import sys
+import time
+import urlparse
+from SocketServer import ThreadingMixIn
+from wsgiref import simple_server
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from proxy import ranges
+
+MODIFIED = 'Tue, 19 Jul 2011 21:55:38 +0000'
+
+class FakeDropbox(object):
+
+    def __init__(self, files=50, file_size=1000000, latency=0, jitter=0):
+        self.latency = latency / 1000.0
+        self.jitter = jitter / 1000.0
+        self.file_size = file_size
+        self.files = {}
+        for i in xrange(files):
+            path = '/deck-%04d.pdf' % i
+            self.files[path] = {'path': path,
+                                'rev': '%x' % (i + 1),
+                                'bytes': file_size,
+                                'modified': MODIFIED,
+                                'is_dir': False,
+                                'mime_type': 'application/pdf'}
+        self.folder_hash = hashlib.md5(' '.join(sorted(self.files))).hexdigest()
+        self._body = self._make_body(file_size)
+
+    def _make_body(self, size):
+        header = '%PDF-1.4\n'
+        trailer = '\n%%EOF\n'
+        filler = ('% slidecollab load test filler ' * 64 + '\n')
+        body = header + filler * ((size - len(header) - len(trailer)) / len(filler) + 1)
+        return body[:max(size - len(trailer), 0)] + trailer
+
+    def __call__(self, environ, start_response):
+        delay = self.latency + random.random() * self.jitter
+        if delay:
+            time.sleep(delay)
+        path = environ.get('PATH_INFO', '')
+        params = dict(urlparse.parse_qsl(environ.get('QUERY_STRING', '')))
+        if path in ('/1/oauth/request_token', '/1/oauth/access_token'):
+            return self._token(start_response)
+        if path == '/1/account/info':
+            return self._json(start_response, {'uid': random.randint(1, 10 ** 6),
+                                               'display_name': 'Load Test',
+                                               'country': 'DE'})
+        if path == '/1/delta':
+            return self._delta(start_response, environ)
+        match = re.match(r'^/1/metadata/sandbox(/.*)?$', path)
+        if match:
+            return self._metadata(start_response, match.group(1), params)
+        match = re.match(r'^/1/files/sandbox(/.*)$', path)
+        if match:
+            return self._file(start_response, match.group(1), environ.get('HTTP_RANGE'))
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return ['not found']
+
+    def _token(self, start_response):
+        body = 'oauth_token_secret=%s&oauth_token=%s' % (binascii.hexlify(os.urandom(8)),
+                                                         binascii.hexlify(os.urandom(8)))
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    def _json(self, start_response, value, status='200 OK', headers=()):
+        body = json.dumps(value)
+        start_response(status, [('Content-Type', 'application/json'),
+                                ('Content-Length', str(len(body)))] + list(headers))
+        return [body]
+
+    def _metadata(self, start_response, path, params):
+        if not path or path == '/':
+            if params.get('hash') == self.folder_hash:
+                start_response('304 Not Modified', [])
+                return []
+            return self._json(start_response, {'path': '/',
+                                               'is_dir': True,
+                                               'hash': self.folder_hash,
+                                               'contents': [self.files[p] for p in sorted(self.files)]})
+        metadata = self.files.get(path)
+        if metadata is None:
+            return self._json(start_response, {'error': 'not found'}, '404 Not Found')
+        return self._json(start_response, metadata)
+
+    def _delta(self, start_response, environ):
+        # the folder never changes, so a cursor means there is nothing new
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        params = dict(urlparse.parse_qsl(environ['wsgi.input'].read(length)))
+        entries = []
+        if not params.get('cursor'):
+            entries = [[p.lower(), self.files[p]] for p in sorted(self.files)]
+        return self._json(start_response, {'entries': entries,
+                                           'reset': not params.get('cursor'),
+                                           'cursor': self.folder_hash,
+                                           'has_more': False})
+
+    def _file(self, start_response, path, range_header):
+        metadata = self.files.get(path)
+        if metadata is None:
+            return self._json(start_response, {'error': 'not found'}, '404 Not Found')
+        headers = [('Content-Type', metadata['mime_type']),
+                   ('x-dropbox-metadata', json.dumps(metadata))]
+        body = self._body
+        byte_range = ranges.parse_range_header(range_header)
+        if byte_range:
+            try:
+                start, end = ranges.resolve_range(byte_range, len(body))
+            except ranges.UnsatisfiableRangeException:
+                start_response('416 Requested Range Not Satisfiable',
+                               [('Content-Range', 'bytes */%d' % len(body))])
+                return []
+            headers.append(('Content-Range', ranges.content_range(start, end, len(body))))
+            body = body[start:end + 1]
+            status = '206 Partial Content'
+        else:
+            status = '200 OK'
+        headers.append(('Content-Length', str(len(body))))
+        start_response(status, headers)
+        return [body]
+
+class QuietHandler(simple_server.WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingServer(ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=9100)
+    parser.add_option('--latency', type='float', default=0, help='milliseconds per response')
+    parser.add_option('--jitter', type='float', default=0, help='up to this many more milliseconds')
+    parser.add_option('--files', type='int', default=50)
+    parser.add_option('--file-size', type='int', default=1000000)
+    options, args = parser.parse_args()
+    app = FakeDropbox(options.files, options.file_size, options.latency, options.jitter)
+    server = simple_server.make_server(options.host, options.port, app,
+                                       server_class=ThreadingServer,
+                                       handler_class=QuietHandler)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
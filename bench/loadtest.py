@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""
+Load test of the app on serve.py, against bench/fake_dropbox.py.
+
+    GAE_SDK=/path/to/google_appengine python bench/loadtest.py --workers 4 --users 32
+
+Starts the fake Dropbox and serve.py with UPSTREAM_HOSTS pointing the
+Dropbox API hosts at it, then replays the traffic of a session in phases:
+
+    login     /connect/login, then /connect/verify with the token it handed out
+    browse    /slides
+    present   /presenter and the deck through /file, first a range then all
+    audience  one presenter turning pages, everybody else on the deck through
+              /file?presentation= and polling /presentation/<id>/state
+
+Each of --users threads keeps its own connection and session cookie. For
+every endpoint the report has requests per second, error count and p50, p95
+and p99 latency, and for every phase the peak resident memory of the
+workers. Run it before and after a change with the same options to compare.
+Needs Linux for the memory figures.
+"""
+
+import httplib
+import optparse
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urlparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PHASES = ('login', 'browse', 'present', 'audience')
+
+class Recorder(object):
+    """
+    Latencies and errors per endpoint, shared by the user threads.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, ok):
+        self._lock.acquire()
+        try:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        finally:
+            self._lock.release()
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(int(len(ordered) * fraction), len(ordered) - 1)
+    return ordered[index]
+
+class User(object):
+    """
+    A browser: one keep-alive connection and a cookie jar.
+    """
+
+    def __init__(self, host, port, recorder):
+        self.host = host
+        self.port = port
+        self.recorder = recorder
+        self.cookies = {}
+        self._connection = None
+
+    def request(self, endpoint, method, path, body=None, headers=None, expect=(200,)):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(['%s=%s' % item for item in self.cookies.items()])
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        started = time.time()
+        try:
+            if self._connection is None:
+                self._connection = httplib.HTTPConnection(self.host, self.port, timeout=60)
+            self._connection.request(method, path, body, headers)
+            response = self._connection.getresponse()
+            content = response.read()
+        except (httplib.HTTPException, socket.error):
+            self.recorder.add(endpoint, time.time() - started, False)
+            self.close()
+            return None, None
+        self.recorder.add(endpoint, time.time() - started, response.status in expect)
+        if response.will_close:
+            self.close()
+        for header, value in response.msg.items():
+            if header.lower() == 'set-cookie':
+                for cookie in value.split(','):
+                    match = re.match(r'\s*([^=;\s]+)=([^;]*)', cookie)
+                    if match:
+                        self.cookies[match.group(1)] = match.group(2)
+        return response, content
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def login(self):
+        response, content = self.request('/connect/login', 'GET', '/connect/login', expect=(302,))
+        if response is None:
+            return False
+        location = response.getheader('location', '')
+        token = dict(urlparse.parse_qsl(urlparse.urlsplit(location)[3])).get('oauth_token')
+        if not token:
+            return False
+        response, content = self.request('/connect/verify', 'GET',
+                                         '/connect/verify?%s' % urllib.urlencode({'oauth_token': token,
+                                                                                  'oauth_verifier': 'loadtest'}),
+                                         expect=(302,))
+        return response is not None and response.status == 302
+
+    def browse(self, options):
+        self.request('/slides', 'GET', '/slides')
+
+    def present(self, options, deck):
+        query = urllib.urlencode({'path': deck})
+        self.request('/presenter', 'GET', '/presenter?%s' % query)
+        self.request('/file (range)', 'GET', '/file?%s' % query,
+                     headers={'Range': 'bytes=0-65535'}, expect=(206,))
+        self.request('/file', 'GET', '/file?%s' % query)
+
+    def watch(self, options, presentation_id, since):
+        query = urllib.urlencode({'presentation': presentation_id})
+        if since is None:
+            self.request('/file?presentation', 'GET', '/file?%s' % query)
+            since = 0
+        response, content = self.request('/presentation/state', 'GET',
+                                         '/presentation/%s/state?since=%d' % (presentation_id, since),
+                                         expect=(200, 204))
+        if response is not None and response.status == 200:
+            match = re.search(r'"seq":\s*(\d+)', content)
+            if match:
+                since = int(match.group(1))
+        return since
+
+class MemorySampler(threading.Thread):
+    """
+    Samples the summed resident set size of the children of `pid`.
+    """
+
+    def __init__(self, pid, interval=0.2):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.isSet():
+            self.peak = max(self.peak, self.sample())
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.peak
+
+    def sample(self):
+        total = 0
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                status = open('/proc/%s/status' % entry).read()
+            except IOError:
+                continue
+            ppid = re.search(r'^PPid:\s+(\d+)', status, re.M)
+            rss = re.search(r'^VmRSS:\s+(\d+) kB', status, re.M)
+            if ppid and rss and int(ppid.group(1)) == self.pid:
+                total += int(rss.group(1)) * 1024
+        return total
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.2)
+    raise RuntimeError('Nothing listening on port %d after %d seconds' % (port, timeout))
+
+def start_processes(options):
+    fake = subprocess.Popen([sys.executable, os.path.join(ROOT, 'bench', 'fake_dropbox.py'),
+                             '--port', str(options.dropbox_port),
+                             '--latency', str(options.latency),
+                             '--jitter', str(options.jitter),
+                             '--files', str(options.files),
+                             '--file-size', str(options.file_size)])
+    upstream = 'http://127.0.0.1:%d' % options.dropbox_port
+    environ = dict(os.environ)
+    environ['UPSTREAM_HOSTS'] = 'api.dropbox.com=%s,api-content.dropbox.com=%s' % (upstream, upstream)
+    environ['DATASTORE_PATH'] = os.path.join(tempfile.gettempdir(), 'slidecollab-loadtest.datastore')
+    command = [sys.executable, os.path.join(ROOT, 'serve.py'),
+               '--port', str(options.port),
+               '--workers', str(options.workers)]
+    if options.threads:
+        command.append('--threads')
+    if options.memcache:
+        command.extend(['--memcache', options.memcache])
+    server = subprocess.Popen(command, env=environ)
+    wait_for_port(options.dropbox_port)
+    wait_for_port(options.port)
+    return fake, server
+
+def run_phase(name, users, options, deck_names, state):
+    """
+    Runs every user in a thread of its own for --duration seconds.
+    """
+    stop_at = time.time() + options.duration
+    def loop(index, user):
+        since = None
+        while time.time() < stop_at:
+            deck = deck_names[index % len(deck_names)]
+            if name == 'login':
+                user.cookies.clear()
+                user.login()
+            elif name == 'browse':
+                user.browse(options)
+            elif name == 'present':
+                user.present(options, deck)
+            elif index == 0:
+                # the presenter
+                state['page'] += 1
+                user.request('/presentation/page', 'POST', '/presentation/%s/page' % state['presentation'],
+                             urllib.urlencode({'page': state['page']}))
+                time.sleep(1)
+            else:
+                since = user.watch(options, state['presentation'], since)
+                time.sleep(options.think)
+    threads = []
+    for index, user in enumerate(users):
+        thread = threading.Thread(target=loop, args=(index, user))
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+def report(name, recorder, seconds, peak_rss):
+    print
+    print '%s: %.1f s, peak worker RSS %.1f MB' % (name, seconds, peak_rss / 1048576.0)
+    print '  %-24s %8s %8s %8s %8s %8s' % ('endpoint', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms')
+    for endpoint in sorted(recorder.latencies):
+        latencies = recorder.latencies[endpoint]
+        print '  %-24s %8.1f %8d %8.1f %8.1f %8.1f' % (endpoint,
+                                                       len(latencies) / seconds,
+                                                       recorder.errors.get(endpoint, 0),
+                                                       percentile(latencies, 0.5) * 1000,
+                                                       percentile(latencies, 0.95) * 1000,
+                                                       percentile(latencies, 0.99) * 1000)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--port', type='int', default=8090)
+    parser.add_option('--dropbox-port', type='int', default=9100)
+    parser.add_option('--workers', type='int', default=2)
+    parser.add_option('--threads', action='store_true', default=False,
+                      help='serve requests on threads within each worker')
+    parser.add_option('--memcache', default=None, help='comma separated memcached servers')
+    parser.add_option('--users', type='int', default=16)
+    parser.add_option('--duration', type='float', default=20, help='seconds per phase')
+    parser.add_option('--think', type='float', default=0.5, help='seconds between audience polls')
+    parser.add_option('--phases', default=','.join(PHASES))
+    parser.add_option('--latency', type='float', default=30, help='fake Dropbox milliseconds per response')
+    parser.add_option('--jitter', type='float', default=20)
+    parser.add_option('--files', type='int', default=20)
+    parser.add_option('--file-size', type='int', default=2000000)
+    options, args = parser.parse_args()
+
+    fake, server = start_processes(options)
+    try:
+        users = [User('127.0.0.1', options.port, None) for i in xrange(options.users)]
+        deck_names = ['/deck-%04d.pdf' % i for i in xrange(options.files)]
+        state = {'page': 0, 'presentation': None}
+        for name in options.phases.split(','):
+            recorder = Recorder()
+            for user in users:
+                user.recorder = recorder
+                if name != 'login' and not user.cookies:
+                    user.login()
+            if name == 'audience' and state['presentation'] is None:
+                response, content = users[0].request('/presentation', 'POST', '/presentation',
+                                                     urllib.urlencode({'path': deck_names[0]}),
+                                                     expect=(302,))
+                location = response and response.getheader('location', '') or ''
+                state['presentation'] = dict(urlparse.parse_qsl(urlparse.urlsplit(location)[3])).get('presentation')
+                if not state['presentation']:
+                    print 'Could not start a presentation, skipping the audience phase'
+                    continue
+                recorder = Recorder()
+                for user in users:
+                    user.recorder = recorder
+            sampler = MemorySampler(server.pid)
+            sampler.start()
+            started = time.time()
+            run_phase(name, users, options, deck_names, state)
+            report(name, recorder, time.time() - started, sampler.stop())
+    finally:
+        for process in (server, fake):
+            try:
+                os.kill(process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            process.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Micro benchmark for OAuth request signing.
+
+Checks oauth.signer.Signer against golden signatures produced by the original
+OAuthClient.prepare_request (kept below as `legacy_prepare_request`), then
+reports signatures per second for both. Exits with status 1 if any signature
+or parameter differs, so it doubles as a regression check:
+
+    python bench/signing.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+from cgi import parse_qs
+from hashlib import sha1
+from hmac import new as hmac
+from random import getrandbits
+from time import time
+from urllib import urlencode
+from urllib import quote as urlquote
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from oauth import signer
+
+CONSUMER_KEY = "dpf43f3p2l4k3l03"
+CONSUMER_SECRET = "kd94hf93k423kf44"
+CALLBACK_URL = "http://presenter.example.com/connect/verify"
+TIMESTAMP = "1191242096"
+NONCE = "kllo9940pd9333jh"
+
+# (url, token, secret, additional params, method, expected signature)
+GOLDEN = [
+    ("https://api.dropbox.com/1/oauth/request_token", "", "", None, "GET",
+     "+GifeRksEjn2uypg4gGy/oFTBbg="),
+    ("https://api.dropbox.com/1/oauth/access_token", "hh5s93j4hdidpola", "hdhd0244k9j7ao03",
+     {"oauth_verifier": "a1b2c3"}, "GET",
+     "joGCPuPJGVSzf6AibdOGSmIFT4k="),
+    ("https://api.dropbox.com/1/metadata/sandbox", "nnch734d00sl2jdk", "pfkkdhi9sl3r4s00",
+     {}, "GET",
+     "gn+TGzOG6SkewSP72xM8xxphLdI="),
+    ("https://api.dropbox.com/1/metadata/sandbox", "nnch734d00sl2jdk", "pfkkdhi9sl3r4s00",
+     {"hash": "37eb1ba1849d4b0fb0b28caf7ef3af52"}, "GET",
+     "sG2IkX6lAhWD2AEUzCfQf1R8kDI="),
+    ("https://api-content.dropbox.com/1/files/sandbox/Talks/Q3 review.pdf", "nnch734d00sl2jdk", "pfkkdhi9sl3r4s00",
+     {}, "GET",
+     "t0ZQUlbUZM0FqCkZbjM3lbc8UlM="),
+    ("https://api.dropbox.com/1/metadata/sandbox/Vortr\xc3\xa4ge", "nnch734d00sl2jdk", "pfkkdhi9sl3r4s00",
+     {"list": "false", "query": u"gr\xfc\xdfe & more"}, "POST",
+     "7FXM+oJlbMjmi0mQf8dQwIvDTms="),
+]
+
+def legacy_prepare_request(consumer_key, consumer_secret, callback_url, url,
+                           token="", secret="", additional_params=None,
+                           method="GET", t=None, nonce=None):
+    """
+    OAuthClient.prepare_request as it was before oauth.signer existed.
+    """
+
+    def encode(text):
+        return urlquote(str(text), "~")
+
+    params = {
+        "oauth_consumer_key": consumer_key,
+        "oauth_signature_method": "HMAC-SHA1",
+        "oauth_timestamp": t if t else str(int(time())),
+        "oauth_nonce": nonce if nonce else str(getrandbits(64)),
+        "oauth_version": "1.0"
+    }
+
+    if token:
+        params["oauth_token"] = token
+    elif callback_url:
+        params["oauth_callback"] = callback_url
+
+    if additional_params:
+        params.update(additional_params)
+
+    for k,v in params.items():
+        if isinstance(v, unicode):
+            params[k] = v.encode('utf8')
+
+    params_str = "&".join(["%s=%s" % (encode(k), encode(params[k])) for k in sorted(params)])
+    message = "&".join([method, encode(url), encode(params_str)])
+    key = "%s&%s" % (consumer_secret, secret)
+    signature = hmac(key, message, sha1)
+    digest_base64 = signature.digest().encode("base64").strip()
+    params["oauth_signature"] = digest_base64
+    return urlencode(params)
+
+def check():
+    """
+    Returns the number of golden vectors either implementation got wrong.
+    """
+    current = signer.Signer(CONSUMER_KEY, CONSUMER_SECRET, CALLBACK_URL)
+    failures = 0
+    for url, token, secret, additional_params, method, expected in GOLDEN:
+        old = parse_qs(legacy_prepare_request(CONSUMER_KEY, CONSUMER_SECRET, CALLBACK_URL,
+                                              url, token, secret, additional_params,
+                                              method, TIMESTAMP, NONCE))
+        new = parse_qs(current.sign(url, token, secret, additional_params,
+                                    method, TIMESTAMP, NONCE))
+        if old["oauth_signature"] != [expected] or new["oauth_signature"] != [expected]:
+            print "FAIL signature %s: expected %s, legacy %s, signer %s" % (
+                url, expected, old["oauth_signature"][0], new["oauth_signature"][0])
+            failures += 1
+        elif old != new:
+            print "FAIL parameters %s: legacy %r, signer %r" % (url, old, new)
+            failures += 1
+    return failures
+
+def bench(iterations):
+    url, token, secret, additional_params, method, _ = GOLDEN[3]
+    current = signer.Signer(CONSUMER_KEY, CONSUMER_SECRET, CALLBACK_URL)
+    batch = [{'url': url, 'token': token, 'secret': secret,
+              'additional_params': additional_params}] * 100
+
+    def run_legacy():
+        legacy_prepare_request(CONSUMER_KEY, CONSUMER_SECRET, CALLBACK_URL,
+                               url, token, secret, additional_params, method)
+
+    def run_signer():
+        current.sign(url, token, secret, additional_params, method)
+
+    def run_batch():
+        current.sign_many(batch)
+
+    results = [('legacy prepare_request', min(timeit.repeat(run_legacy, number=iterations, repeat=3)), iterations),
+               ('Signer.sign', min(timeit.repeat(run_signer, number=iterations, repeat=3)), iterations),
+               ('Signer.sign_many (100)', min(timeit.repeat(run_batch, number=iterations / 100, repeat=3)), iterations / 100 * 100)]
+    baseline = results[0][2] / results[0][1]
+    for name, seconds, signatures in results:
+        rate = signatures / seconds
+        print "%-24s %10.0f signatures/s  %5.2fx" % (name, rate, rate / baseline)
+
+if __name__ == '__main__':
+    iterations = 20000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    failures = check()
+    if failures:
+        print "%d of %d golden signatures differ" % (failures, len(GOLDEN))
+        sys.exit(1)
+    print "%d golden signatures match" % len(GOLDEN)
+    bench(iterations)
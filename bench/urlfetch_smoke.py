@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Smoke test of runtime/urlfetch_stub.py against bench/fake_dropbox.py.
+
+    GAE_SDK=/path/to/google_appengine python bench/urlfetch_smoke.py
+
+Registers the portable backends with the Dropbox API hosts pointed at a fake
+Dropbox on a free port, then goes through the urlfetch API the way the app
+does: a fetch, a Range fetch, async fetches in flight together whose
+callbacks have to run, and a fetch from a port nobody listens on, which has
+to raise DownloadError. Exits with status 1 if any check fails.
+"""
+
+import os
+import socket
+import sys
+import threading
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from runtime import backends
+
+backends.setup_paths(os.environ.get('GAE_SDK'))
+
+import fake_dropbox
+
+FILE_URL = 'https://api-content.dropbox.com/1/files/sandbox/deck-%04d.pdf'
+FILE_SIZE = 100000
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def start_fake():
+    port = _free_port()
+    server = fake_dropbox.simple_server.make_server('127.0.0.1', port,
+                                                    fake_dropbox.FakeDropbox(files=10, file_size=FILE_SIZE),
+                                                    server_class=fake_dropbox.ThreadingServer,
+                                                    handler_class=fake_dropbox.QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return 'http://127.0.0.1:%d' % port
+
+def check():
+    """
+    Returns the descriptions of the checks that failed.
+    """
+    from google.appengine.api import urlfetch
+
+    failures = []
+
+    result = urlfetch.fetch(FILE_URL % 0)
+    if result.status_code != 200 or len(result.content) != FILE_SIZE:
+        failures.append('fetch: %d, %d bytes' % (result.status_code, len(result.content)))
+
+    result = urlfetch.fetch(FILE_URL % 1, headers={'Range': 'bytes=10-19'})
+    if result.status_code != 206 or len(result.content) != 10:
+        failures.append('range fetch: %d, %d bytes' % (result.status_code, len(result.content)))
+
+    called = []
+    rpcs = []
+    for i in xrange(5):
+        rpc = urlfetch.create_rpc(deadline=10)
+        rpc.callback = lambda i=i: called.append(i)
+        urlfetch.make_fetch_call(rpc, FILE_URL % i)
+        rpcs.append(rpc)
+    for i, rpc in enumerate(rpcs):
+        result = rpc.get_result()
+        if result.status_code != 200:
+            failures.append('async fetch %d: %d' % (i, result.status_code))
+    if sorted(called) != range(5):
+        failures.append('async callbacks: %r' % sorted(called))
+
+    try:
+        urlfetch.fetch('http://127.0.0.1:%d/' % _free_port(), deadline=5)
+    except urlfetch.DownloadError:
+        pass
+    else:
+        failures.append('fetch from a closed port did not raise DownloadError')
+
+    return failures
+
+if __name__ == '__main__':
+    upstream = start_fake()
+    backends.install(upstream_hosts={'api.dropbox.com': upstream,
+                                     'api-content.dropbox.com': upstream})
+    failures = check()
+    for failure in failures:
+        print failure
+    if failures:
+        sys.exit(1)
+    print "urlfetch through the portable runtime works"
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Builds the static assets for deployment.
+
+    python build_assets.py
+
+Copies every file below assets/ (except the test files) to assets/build/
+under a name that contains a hash of its content, e.g.
+scripts/pdf.3f2a9c01b6d4.js, so it can be cached forever. Text assets get
+gzip and, if the `brotli` module is installed, brotli variants next to them.
+assets/build/manifest.json maps the original names to the hashed ones,
+templates look them up through the `asset` filter. Run it before every
+deploy, a missing manifest just means unhashed URLs.
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import sys
+from StringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSET_DIR = os.path.join(ROOT, 'assets')
+BUILD_DIR = os.path.join(ASSET_DIR, 'build')
+
+SKIP_DIRS = ('build', 'test')
+COMPRESSIBLE = ('.js', '.css', '.svg', '.html', '.json', '.txt', '.ico')
+
+def hashed_name(name, data):
+    root, extension = os.path.splitext(name)
+    return '%s.%s%s' % (root, hashlib.sha1(data).hexdigest()[:12], extension)
+
+def gzipped(data):
+    output = StringIO()
+    # no file name or time in the header, so builds are reproducible
+    f = gzip.GzipFile('', 'wb', 9, output, mtime=0)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return output.getvalue()
+
+def write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    f = open(path, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+def build():
+    if os.path.isdir(BUILD_DIR):
+        shutil.rmtree(BUILD_DIR)
+    manifest = {}
+    for directory, subdirectories, names in os.walk(ASSET_DIR):
+        if directory == ASSET_DIR:
+            subdirectories[:] = [d for d in subdirectories if d not in SKIP_DIRS]
+        for name in names:
+            source = os.path.join(directory, name)
+            relative = os.path.relpath(source, ASSET_DIR).replace(os.sep, '/')
+            f = open(source, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            target = hashed_name(relative, data)
+            manifest[relative] = target
+            write(os.path.join(BUILD_DIR, target), data)
+            variants = []
+            if os.path.splitext(name)[1] in COMPRESSIBLE:
+                variants.append(('gz', gzipped(data)))
+                if brotli is not None:
+                    variants.append(('br', brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                # a variant only pays if it is smaller
+                if len(compressed) < len(data):
+                    write(os.path.join(BUILD_DIR, target + '.' + suffix), compressed)
+            print '%-40s %s %s' % (relative, target, ' '.join([suffix for suffix, compressed in variants]))
+    write(os.path.join(BUILD_DIR, 'manifest.json'), json.dumps(manifest, indent=1, sort_keys=True))
+    if brotli is None:
+        print >> sys.stderr, 'brotli is not installed, built gzip variants only'
+
+if __name__ == '__main__':
+    build()
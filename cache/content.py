@@ -0,0 +1,157 @@
+"""
+Revision keyed cache for file contents proxied from Dropbox.
+
+Dropbox never changes the bytes behind a (path, rev) pair, so cached entries
+never have to be invalidated, only evicted. Lookups go through two tiers:
+
+1. an in-process LRU bounded by CONTENT_CACHE_LOCAL_BYTES
+2. memcache, with the file split into chunks below the memcache item limit
+
+The current rev of a path is remembered for a short while as well, so repeat
+loads of a deck can be answered (or 304ed) without asking Dropbox at all.
+Past that it is only used while Dropbox is unavailable.
+"""
+
+import hashlib
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import memcache
+
+import config
+from cache import lru
+from metrics.registry import registry
+
+class ContentCache(object):
+
+    def __init__(self, namespace='content',
+                 local_bytes=config.CONTENT_CACHE_LOCAL_BYTES,
+                 max_item_bytes=config.CONTENT_CACHE_MAX_ITEM_BYTES,
+                 chunk_bytes=config.CONTENT_CACHE_CHUNK_BYTES,
+                 revision_ttl=config.CONTENT_CACHE_REVISION_TTL):
+        self.namespace = namespace
+        self.max_item_bytes = max_item_bytes
+        self.chunk_bytes = chunk_bytes
+        self.revision_ttl = revision_ttl
+        self.local = lru.LRUCache(local_bytes, sizeof=len)
+
+    def get(self, owner, path, rev):
+        """
+        Returns the cached content of `path` at `rev`, or None.
+        """
+        key = self._key(owner, path, rev)
+        data = self.local.get(key)
+        if data is not None:
+            return data
+        data = self._get_chunked(key)
+        if data is not None:
+            registry.incr('memcache', self.namespace + ' hit')
+            self.local.set(key, data)
+        else:
+            registry.incr('memcache', self.namespace + ' miss')
+        return data
+
+    def set(self, owner, path, rev, data):
+        """
+        Stores `data` in both tiers. Files larger than `max_item_bytes` are
+        not cached, they are served through range requests instead.
+        """
+        if len(data) > self.max_item_bytes:
+            return False
+        key = self._key(owner, path, rev)
+        self.local.set(key, data)
+        self._set_chunked(key, data)
+        return True
+
+    def missing(self, owner, entries):
+        """
+        Returns those of the metadata `entries` whose content is in neither
+        tier, with a single memcache round trip.
+        """
+        candidates = []
+        for entry in entries:
+            key = self._key(owner, entry['path'], entry.get('rev'))
+            if key not in self.local:
+                candidates.append((key, entry))
+        if not candidates:
+            return []
+        found = memcache.get_multi([key for key, entry in candidates], namespace=self.namespace)
+        return [entry for key, entry in candidates if key not in found]
+
+    def cacheable(self, size):
+        return size <= self.max_item_bytes
+
+    def get_revision(self, owner, path, stale=False):
+        """
+        Returns the Dropbox metadata last seen for `path`, or None once it is
+        older than `revision_ttl` seconds. With `stale` it is returned however
+        old it is, for when Dropbox cannot be asked.
+        """
+        seen = memcache.get(self._revision_key(owner, path), namespace=self.namespace)
+        if seen is None:
+            return None
+        metadata, seen_at = seen
+        if not stale and time.time() - seen_at > self.revision_ttl:
+            return None
+        return metadata
+
+    def set_revision(self, owner, path, metadata):
+        # kept until evicted, the age decides whether it is still trusted
+        memcache.set(self._revision_key(owner, path), (metadata, time.time()),
+                     namespace=self.namespace)
+
+    def _key(self, owner, path, rev):
+        # paths can be longer than the 250 bytes memcache allows for keys
+        return hashlib.sha1('%s:%s:%s' % (owner, _utf8(path), rev)).hexdigest()
+
+    def _revision_key(self, owner, path):
+        return 'revision:' + hashlib.sha1('%s:%s' % (owner, _utf8(path))).hexdigest()
+
+    def _get_chunked(self, key):
+        header = memcache.get(key, namespace=self.namespace)
+        if header is None:
+            return None
+        length, count = header
+        chunk_keys = ['%s:%d' % (key, i) for i in xrange(count)]
+        chunks = memcache.get_multi(chunk_keys, namespace=self.namespace)
+        if len(chunks) != count:
+            # some chunk got evicted, the rest is useless
+            return None
+        data = ''.join([chunks[k] for k in chunk_keys])
+        if len(data) != length:
+            return None
+        return data
+
+    def _set_chunked(self, key, data):
+        chunks = {}
+        count = 0
+        for offset in xrange(0, len(data), self.chunk_bytes):
+            chunks['%s:%d' % (key, count)] = data[offset:offset + self.chunk_bytes]
+            count += 1
+        failed = memcache.set_multi(chunks, namespace=self.namespace)
+        if failed:
+            _logger.info('Could not cache %d of %d chunks of %s' % (len(failed), count, key))
+            return
+        # the header goes in last so readers never see a partial entry
+        memcache.set(key, (len(data), count), namespace=self.namespace)
+
+def _utf8(text):
+    if isinstance(text, unicode):
+        return text.encode('utf8')
+    return text
+
+file_cache = ContentCache()
+
+def entity_tag(rev):
+    return '"%s"' % rev
+
+def none_match(if_none_match, etag):
+    """
+    Checks an `If-None-Match` header against `etag`.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or ('W/' + etag) in tags
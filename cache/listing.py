@@ -0,0 +1,44 @@
+"""
+Per user cache of rendered slides pages.
+
+The listing itself lives in the folder index (proxy/folders.py). Pages are
+keyed by the index version and the view (sort, filter and page number), so
+they never have to be invalidated, a changed folder simply gets new keys.
+"""
+
+import hashlib
+
+from google.appengine.api import memcache
+
+import config
+from cache import lru
+
+# the parts of a metadata entry the templates and the prefetcher look at
+LISTING_FIELDS = ('path', 'rev', 'bytes', 'modified', 'is_dir', 'mime_type')
+
+class ListingCache(object):
+
+    def __init__(self, namespace='listing', local_entries=config.LISTING_CACHE_LOCAL_ENTRIES):
+        self.namespace = namespace
+        self.local = lru.LRUCache(local_entries)
+
+    def get_page(self, owner, view, username):
+        key = self._page_key(owner, view, username)
+        page = self.local.get(key)
+        if page is None:
+            page = memcache.get(key, namespace=self.namespace)
+            if page is not None:
+                self.local.set(key, page)
+        return page
+
+    def set_page(self, owner, view, username, page):
+        key = self._page_key(owner, view, username)
+        self.local.set(key, page)
+        memcache.set(key, page, namespace=self.namespace)
+
+    def _page_key(self, owner, view, username):
+        if isinstance(username, unicode):
+            username = username.encode('utf8')
+        return 'page:' + hashlib.sha1('%s:%s:%s' % (owner, view, username)).hexdigest()
+
+listing_cache = ListingCache()
@@ -0,0 +1,119 @@
+"""
+A small in-process LRU cache with a size budget.
+
+Module level instances survive between requests on the same instance, so this
+is the first tier in front of memcache. Entries are weighed by `sizeof` (one
+unit per entry by default) and the least recently used ones are dropped once
+the budget is exceeded. `on_evict` is called with the key and value of every
+entry dropped that way.
+"""
+
+import threading
+
+_PREV, _NEXT, _KEY, _VALUE, _SIZE = 0, 1, 2, 3, 4
+
+def _one(value):
+    return 1
+
+class LRUCache(object):
+
+    def __init__(self, max_size, sizeof=_one, on_evict=None):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._map = {}
+        self._lock = threading.Lock()
+        # sentinel of a circular doubly linked list, most recent first
+        self._root = root = []
+        root[:] = [root, root, None, None, 0]
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._map.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(link)
+            self._push(link)
+            return link[_VALUE]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        """
+        Stores `value` and returns True, or returns False if the value alone
+        would not fit into the budget.
+        """
+        size = self.sizeof(value)
+        evicted = []
+        self._lock.acquire()
+        try:
+            link = self._map.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+                self.size -= link[_SIZE]
+            if size > self.max_size:
+                return False
+            link = [None, None, key, value, size]
+            self._map[key] = link
+            self._push(link)
+            self.size += size
+            while self.size > self.max_size:
+                evicted.append(self._evict())
+            return True
+        finally:
+            self._lock.release()
+            if self.on_evict:
+                for link in evicted:
+                    self.on_evict(link[_KEY], link[_VALUE])
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            link = self._map.pop(key, None)
+            if link is None:
+                return False
+            self._unlink(link)
+            self.size -= link[_SIZE]
+            return True
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._map.clear()
+            self._root[:] = [self._root, self._root, None, None, 0]
+            self.size = 0
+        finally:
+            self._lock.release()
+
+    def _push(self, link):
+        root = self._root
+        first = root[_NEXT]
+        link[_PREV] = root
+        link[_NEXT] = first
+        first[_PREV] = link
+        root[_NEXT] = link
+
+    def _unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+
+    def _evict(self):
+        last = self._root[_PREV]
+        self._unlink(last)
+        del self._map[last[_KEY]]
+        self.size -= last[_SIZE]
+        return last
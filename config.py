@@ -1,3 +1,163 @@
 APPLICATION_KEY = 'YOURDROPBOXAPPKEY'
 APPLICATION_SECRET = 'YOUDROPBOXAPPSECRET'
-APPLICATION_FOLDER = 'slidecollab-development'
\ No newline at end of file
+APPLICATION_FOLDER = 'slidecollab-development'
+
+# size of the pieces /file writes its response body in
+FILE_CHUNK_SIZE = 64 * 1024
+# App Engine refuses responses of 32 MB and more, /file sends bigger ranges
+# only in part and bigger decks only to clients that ask for ranges
+FILE_MAX_RESPONSE_BYTES = 30 * 1024 * 1024
+
+# file content cache, see cache/content.py
+CONTENT_CACHE_LOCAL_BYTES = 32 * 1024 * 1024
+CONTENT_CACHE_MAX_ITEM_BYTES = 16 * 1024 * 1024
+# memcache refuses items of 1 MB and more
+CONTENT_CACHE_CHUNK_BYTES = 1000 * 1000
+# how long the rev of a path is trusted without asking Dropbox
+CONTENT_CACHE_REVISION_TTL = 30
+
+# number of folder listings and rendered slide pages kept in process
+LISTING_CACHE_LOCAL_ENTRIES = 500
+
+# server side page rendering, see pdf/raster.py
+IMAGE_MODE = False
+RASTER_PDFTOPPM = 'pdftoppm'
+RASTER_WORKERS = 2
+RASTER_WIDTHS = (160, 480, 960, 1440, 1920)
+RASTER_TIMEOUT = 20
+RASTER_WEBP_QUALITY = 80
+RASTER_CACHE_BYTES = 64 * 1024 * 1024
+RASTER_SPOOL_BYTES = 256 * 1024 * 1024
+
+# presenter to audience sync, see presentation/sync.py
+SYNC_PUSH = True
+SYNC_BUCKETS = 16
+SYNC_BUCKET_SIZE = 200
+SYNC_JOIN_RETRIES = 5
+SYNC_CHANNEL_LIFETIME = 120
+SYNC_COALESCE_DELAY = 1
+SYNC_POLL_INTERVAL = 2
+
+# signs session cookies, set a long random value per deployment
+SESSION_SECRET = 'YOURSESSIONSECRET'
+# keep sessions in memcache and only put their id into the cookie
+SESSION_STORE = False
+SESSION_STORE_LOCAL_ENTRIES = 2000
+SESSION_DECODED_ENTRIES = 2000
+
+# rendered pages kept in process, see handlers/templates.py
+PAGE_CACHE_ENTRIES = 1000
+
+# request and upstream call metrics on /metrics, see metrics/
+METRICS_ENABLED = True
+# fraction of requests run under cProfile, can be changed per instance on /metrics
+METRICS_PROFILE_RATE = 0.0
+METRICS_PROFILE_LINES = 40
+
+# deck manifests, see pdf/manifest.py
+MANIFEST_CACHE_LOCAL_ENTRIES = 500
+MANIFEST_MAX_PAGES = 5000
+MANIFEST_MAX_OUTLINE = 1000
+
+# recursive app folder index, see proxy/folders.py
+FOLDER_INDEX_SYNC_INTERVAL = 10
+FOLDER_INDEX_DELTA_PAGES = 5
+FOLDER_INDEX_LOCAL_ENTRIES = 500
+SLIDES_PAGE_SIZE = 50
+
+# background prefetch of likely opened decks, see proxy/prefetch.py
+PREFETCH = False
+PREFETCH_DECKS = 3
+PREFETCH_CONCURRENCY = 2
+PREFETCH_BYTES = 32 * 1024 * 1024
+PREFETCH_WINDOW = 600
+PREFETCH_INTERVAL = 60
+
+# static assets, see build_assets.py and handlers/static_handler.py
+# e.g. 'https://cdn.example.com' if a CDN fronts /assets
+ASSET_URL_PREFIX = ''
+
+# single-flight coalescing of upstream fetches, see proxy/flight.py
+FLIGHT_WAIT = 10
+FLIGHT_LEASE = 30
+FLIGHT_POLL_INTERVAL = 0.1
+FLIGHT_ERROR_TTL = 5
+
+# deadlines, retries, hedging and circuit breaking of upstream calls, see oauth/upstream.py
+UPSTREAM_DEADLINE_MIN = 2
+UPSTREAM_DEADLINE_MAX = 10
+UPSTREAM_DEADLINE_FACTOR = 3
+UPSTREAM_LATENCY_WINDOW = 200
+UPSTREAM_LATENCY_MIN_SAMPLES = 20
+UPSTREAM_RETRIES = 2
+UPSTREAM_BACKOFF = 0.1
+UPSTREAM_BUDGET = 15
+UPSTREAM_HEDGE = True
+UPSTREAM_HEDGE_MIN = 0.2
+UPSTREAM_BREAKER_FAILURES = 5
+UPSTREAM_BREAKER_COOLDOWN = 30
+
+# parallel range requests for files too big to fetch at once, see proxy/files.py
+CHUNKED_FETCH_BYTES = 4 * 1024 * 1024
+CHUNKED_FETCH_CONCURRENCY = 4
+
+# full text search over the decks, see proxy/search.py and pdf/text.py
+SEARCH = True
+SEARCH_BATCH = 10
+# downloads in flight together are at most this big, a bigger deck goes alone
+SEARCH_BATCH_BYTES = 32 * 1024 * 1024
+SEARCH_INTERVAL = 60
+SEARCH_LEASE = 600
+SEARCH_MAX_BYTES = 16 * 1024 * 1024
+SEARCH_RESULTS = 50
+# slides listed per deck in the results
+SEARCH_PAGES_SHOWN = 10
+SEARCH_PREFIX_TERMS = 100
+SEARCH_LOCAL_BYTES = 32 * 1024 * 1024
+
+# per user and per Dropbox endpoint request budgets, see oauth/quota.py
+# requests a second a user may make of the handlers that call Dropbox
+QUOTA_USER_RATE = 5
+QUOTA_USER_BURST = 30
+# calls a second to each Dropbox endpoint, 0 for no limit
+QUOTA_ENDPOINT_RATE = 0
+QUOTA_ENDPOINT_BURST = 200
+QUOTA_WINDOW = 10
+QUOTA_SYNC_INTERVAL = 1
+QUOTA_LOCAL_ENTRIES = 10000
+# what Retry-After says when Dropbox itself was over its limits
+QUOTA_RETRY_AFTER = 5
+
+# cold starts, see main.py, handlers/lazy.py and metrics/startup.py
+# time imports at startup and on the first request of every route
+STARTUP_REPORT = True
+STARTUP_REPORT_MODULES = 30
+# handlers /_ah/warmup loads before the instance gets traffic
+WARMUP_HANDLERS = ('handlers.main_handler.MainHandler',
+                   'handlers.slides_handler.SlidesHandler',
+                   'handlers.presenter_handler.PresenterHandler',
+                   'handlers.image_handler.PageImageHandler')
+# warm up workers of runtime/wsgi.py when they start
+WARMUP_ON_START = False
+
+# slide annotations, see presentation/annotations.py
+ANNOTATION_BATCH_OPS = 50
+# how often the presenter sends what was drawn, in seconds
+ANNOTATION_BATCH_INTERVAL = 0.5
+ANNOTATION_MAX_POINTS = 200
+ANNOTATION_MAX_WIDTH = 50
+# with MAX_POINTS this keeps a page well below the 1 MB memcache and entity limits
+ANNOTATION_MAX_STROKES = 100
+ANNOTATION_COMPACT_DELTAS = 50
+ANNOTATION_COMPACT_BYTES = 128 * 1024
+ANNOTATION_COMPACT_LEASE = 60
+ANNOTATION_CACHE_RETRIES = 5
+# a cached state that missed a delta is read again after this many seconds
+ANNOTATION_STATE_TTL = 30
+
+# single page PDFs for the presenter, see pdf/split.py
+SPLIT_PAGES = True
+# parsed decks kept per instance, weighed at twice their file size for the
+# objects cut out of them
+SPLIT_DECK_BYTES = 64 * 1024 * 1024
+SPLIT_CACHE_BYTES = 32 * 1024 * 1024
@@ -1,13 +1,13 @@
-import os
 from oauth import oauth
 
 import logging
 _logger = logging.getLogger(__name__)
 
+from google.appengine.api import taskqueue
 from google.appengine.ext import webapp
-from google.appengine.ext.webapp import template
 
 import config
+from handlers import templates
 from session import cookie
 
 class ConnectHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
@@ -23,7 +23,7 @@ class ConnectHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
             self.redirect('/slides')
         
         callback_url = "%s/connect/verify" % self.request.host_url
-        client = oauth.DropboxClient(application_key, application_secret, callback_url)
+        client = oauth.get_dropbox_client(application_key, application_secret, callback_url)
         
         if mode == "login":
             return self.redirect(client.get_authorization_url())
@@ -34,7 +34,9 @@ class ConnectHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
             secret = user_info['secret']
             token = user_info['token']
             
-            session['current_user'] = user_info
+            # the cookie only needs what the pages show and what caches are keyed by
+            session['current_user'] = {'id': user_info['id'],
+                                       'name': user_info['name']}
             dropbox_credentials = {'secret': secret,
                                    'token': token}
             session['dropbox_credentials'] = dropbox_credentials
@@ -47,5 +49,14 @@ class ConnectHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
             self.redirect('/')
         else:   
             template_values = {}
-            path = os.path.join(os.path.dirname(__file__), '..', 'templates', 'connect.html')
-            self.response.out.write(template.render(path, template_values))
\ No newline at end of file
+            templates.write_page(self, 'connect.html', template_values)
+
+class TokenSweepHandler(webapp.RequestHandler):
+    """
+    ('/tasks/oauth/sweep')
+    """
+    def get(self):
+        deleted, more = oauth.sweep_auth_tokens()
+        _logger.info('Deleted %d expired request tokens' % deleted)
+        if more:
+            taskqueue.add(url='/tasks/oauth/sweep', method='GET')
@@ -0,0 +1,16 @@
+"""
+Template filters, registered for every template by handlers/templates.py.
+"""
+
+from google.appengine.ext.webapp import template
+
+from handlers import static_handler
+
+register = template.create_template_register()
+
+@register.filter
+def asset(name):
+    """
+    {{ "scripts/pdf.js"|asset }} is the cacheable URL of assets/scripts/pdf.js
+    """
+    return static_handler.url(name)
@@ -0,0 +1,136 @@
+import logging
+_logger = logging.getLogger(__name__)
+
+from oauth import oauth
+
+from google.appengine.ext import webapp
+
+import config
+from cache import content
+from pdf import raster
+from pdf import split
+from proxy import files
+from session import cookie
+
+class PageImageHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
+    """
+    ('/page')
+    """
+    def get(self):
+        session = self.get_session()
+        try:
+            deck = files.resolve(self.request, session)
+        except files.FileException, e:
+            self.error(e.status_code)
+            return
+        if not raster.available():
+            self.error(404)
+        elif deck:
+            owner, dropbox_credentials, path = deck
+            try:
+                page = int(self.request.get('n', '1'))
+                width = int(self.request.get('w', str(config.RASTER_WIDTHS[0])))
+            except ValueError:
+                self.error(400)
+                return
+            if not path or page < 1 or width < 1:
+                self.error(400)
+                return
+            callback_url = "%s/connect/verify" % self.request.host_url
+            client = oauth.get_dropbox_client(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
+            fmt = 'png'
+            if 'image/webp' in self.request.headers.get('Accept', '') and raster.webp_available():
+                fmt = 'webp'
+            try:
+                metadata = files.current_metadata(client, dropbox_credentials, owner, path)
+                width = raster.nearest_width(width)
+                self.response.headers["Cache-Control"] = 'private, no-cache'
+                self.response.headers["Vary"] = 'Accept'
+                etag = _entity_tag(metadata, page, width, fmt)
+                if content.none_match(self.request.headers.get('If-None-Match'), etag):
+                    self.response.headers["ETag"] = etag
+                    self.response.set_status(304)
+                    return
+                metadata, body = files.load(client, dropbox_credentials, owner, path, metadata)
+                self.response.headers["ETag"] = _entity_tag(metadata, page, width, fmt)
+                if body is None:
+                    # too large to be kept around for rendering
+                    self.error(413)
+                    return
+                image = raster.renderer.render(owner, path, metadata.get('rev'), body, page, width, fmt)
+            except files.FileException, e:
+                self.error(e.status_code)
+                return
+            except raster.PageNotFoundException:
+                self.error(404)
+                return
+            except raster.RasterException, e:
+                _logger.error(str(e))
+                self.error(503)
+                return
+            self.response.headers["Content-Type"] = raster.MIME_TYPES[fmt]
+            self.response.headers["Content-Length"] = str(len(image))
+            self.response.out.write(image)
+        else:
+            self.redirect('/connect')
+
+class PageFileHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
+    """
+    ('/file/page')
+    """
+    def get(self):
+        session = self.get_session()
+        try:
+            deck = files.resolve(self.request, session)
+        except files.FileException, e:
+            self.error(e.status_code)
+            return
+        if not config.SPLIT_PAGES:
+            self.error(404)
+        elif deck:
+            owner, dropbox_credentials, path = deck
+            try:
+                page = int(self.request.get('n', '1'))
+            except ValueError:
+                self.error(400)
+                return
+            if not path or page < 1:
+                self.error(400)
+                return
+            callback_url = "%s/connect/verify" % self.request.host_url
+            client = oauth.get_dropbox_client(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
+            def load():
+                loaded, body = files.load(client, dropbox_credentials, owner, path, metadata)
+                # decks over CONTENT_CACHE_MAX_ITEM_BYTES are not split, the
+                # parser needs all of the file and /file range loads them
+                if body is None:
+                    raise files.FileException(413)
+                return body
+            try:
+                metadata = files.current_metadata(client, dropbox_credentials, owner, path)
+                etag = content.entity_tag('%s-%d' % (metadata.get('rev'), page))
+                self.response.headers["Cache-Control"] = 'private, no-cache'
+                self.response.headers["ETag"] = etag
+                if content.none_match(self.request.headers.get('If-None-Match'), etag):
+                    self.response.set_status(304)
+                    return
+                body = split.splitter.page(owner, path, metadata.get('rev'), page, load)
+            except files.FileException, e:
+                self.error(e.status_code)
+                return
+            except split.PageNotFoundException:
+                self.error(404)
+                return
+            except split.SplitException, e:
+                # the client can still load the whole deck
+                _logger.info('Cannot split %s: %s' % (path, e))
+                self.error(415)
+                return
+            self.response.headers["Content-Type"] = 'application/pdf'
+            self.response.headers["Content-Length"] = str(len(body))
+            self.response.out.write(body)
+        else:
+            self.redirect('/connect')
+
+def _entity_tag(metadata, page, width, fmt):
+    return '"%s-%d-%d-%s"' % (metadata.get('rev'), page, width, fmt)
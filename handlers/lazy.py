@@ -0,0 +1,86 @@
+"""
+Route level lazy loading of handlers.
+
+main.py names the handler of every route instead of importing it, and the
+module of a handler is imported when its route is first requested. A cold
+instance then only pays for the modules of the route that woke it up, not
+for PDF parsing, search and presentations before it can serve /.
+
+webapp creates a handler per request by calling what the route maps to, so
+a LazyHandler stands in for the class and returns instances of it.
+
+`warmup` imports the handlers of WARMUP_HANDLERS and compiles the templates
+up front, for /_ah/warmup on App Engine and runtime/wsgi.py elsewhere.
+"""
+
+import threading
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+import config
+from metrics import startup
+
+_lock = threading.Lock()
+# dotted name -> LazyHandler
+_handlers = {}
+
+class LazyHandler(object):
+
+    def __init__(self, name):
+        """
+        `name` is the dotted path of the handler class, e.g.
+        'handlers.main_handler.MainHandler'.
+        """
+        self.name = name
+        self.module, self.__name__ = name.rsplit('.', 1)
+        self._class = None
+
+    def load(self):
+        if self._class is None:
+            _lock.acquire()
+            try:
+                if self._class is None:
+                    started = time.time()
+                    if config.STARTUP_REPORT:
+                        startup.start()
+                    try:
+                        module = __import__(self.module, {}, {}, [self.__name__])
+                    finally:
+                        if config.STARTUP_REPORT:
+                            startup.stop()
+                    startup.record(self.module, time.time() - started)
+                    self._class = getattr(module, self.__name__)
+            finally:
+                _lock.release()
+        return self._class
+
+    def __call__(self):
+        return self.load()()
+
+def handler(name):
+    """
+    The LazyHandler for `name`, one per name.
+    """
+    _lock.acquire()
+    try:
+        if name not in _handlers:
+            _handlers[name] = LazyHandler(name)
+        return _handlers[name]
+    finally:
+        _lock.release()
+
+def warmup(names=config.WARMUP_HANDLERS):
+    """
+    Loads the handlers `names` and compiles every template.
+    """
+    started = time.time()
+    for name in names:
+        try:
+            handler(name).load()
+        except (ImportError, AttributeError), e:
+            _logger.error('Cannot warm up %s: %s' % (name, e))
+    from handlers import templates
+    templates.preload()
+    _logger.info('Warmed up in %.0f ms' % ((time.time() - started) * 1000))
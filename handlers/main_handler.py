@@ -1,10 +1,7 @@
-import os
-from oauth import oauth
-
 from google.appengine.ext import webapp
-from google.appengine.ext.webapp import template
 
 import config
+from handlers import templates
 from session import cookie
 
 class MainHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
@@ -19,5 +16,4 @@ class MainHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
         else:
              username = None
         template_values = {'username': username}
-        path = os.path.join(os.path.dirname(__file__), '..', 'templates', 'index.html')
-        self.response.out.write(template.render(path, template_values))
\ No newline at end of file
+        templates.write_page(self, 'index.html', template_values, (username,))
\ No newline at end of file
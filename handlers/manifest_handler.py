@@ -0,0 +1,54 @@
+import logging
+_logger = logging.getLogger(__name__)
+
+from oauth import oauth
+
+from google.appengine.ext import webapp
+
+import config
+from cache import content
+from pdf import manifest
+from proxy import files
+from session import cookie
+
+class ManifestHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
+    """
+    ('/manifest')
+    """
+    def get(self):
+        session = self.get_session()
+        try:
+            deck = files.resolve(self.request, session)
+        except files.FileException, e:
+            self.error(e.status_code)
+            return
+        if deck:
+            owner, dropbox_credentials, path = deck
+            if not path:
+                self.error(400)
+                return
+            callback_url = "%s/connect/verify" % self.request.host_url
+            client = oauth.get_dropbox_client(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
+            try:
+                metadata = files.current_metadata(client, dropbox_credentials, owner, path)
+                self.response.headers["Cache-Control"] = 'private, no-cache'
+                if content.none_match(self.request.headers.get('If-None-Match'), _entity_tag(metadata)):
+                    self.response.headers["ETag"] = _entity_tag(metadata)
+                    self.response.set_status(304)
+                    return
+                metadata, body = manifest.load(client, dropbox_credentials, owner, path, metadata)
+            except files.FileException, e:
+                self.error(e.status_code)
+                return
+            except manifest.ManifestException, e:
+                _logger.info('No manifest for %s: %s' % (path, e))
+                self.error(422)
+                return
+            self.response.headers["ETag"] = _entity_tag(metadata)
+            self.response.headers["Content-Type"] = 'application/json'
+            self.response.out.write(body)
+        else:
+            self.redirect('/connect')
+
+def _entity_tag(metadata):
+    return '"%s-m%d"' % (metadata.get('rev'), manifest.VERSION)
@@ -0,0 +1,61 @@
+import os
+
+from google.appengine.api import memcache
+from google.appengine.ext import webapp
+from django.utils import simplejson as json
+
+from cache.content import file_cache
+from cache.listing import listing_cache
+from handlers import templates
+from metrics import startup
+from metrics.profiler import profiler
+from metrics.registry import cache_stats, registry
+from oauth import upstream
+from pdf import raster
+from pdf import split
+from proxy import folders
+from session import cookie
+from session.store import session_store
+
+# in-process caches, by the name they are reported under
+_CACHES = (('content', file_cache.local),
+           ('listing', listing_cache.local),
+           ('folders', folders._local),
+           ('pages', templates._pages),
+           ('sessions', cookie._decoded),
+           ('session_store', session_store.local),
+           ('raster_images', raster.renderer.images),
+           ('split_decks', split.splitter.decks),
+           ('split_pages', split.splitter.pages))
+
+class MetricsHandler(webapp.RequestHandler):
+    """
+    ('/metrics')
+    """
+    def get(self):
+        profile = self.request.get('profile')
+        if profile == 'report':
+            self.response.headers["Content-Type"] = 'text/plain'
+            self.response.out.write(profiler.report())
+            return
+        if profile:
+            try:
+                profiler.rate = min(max(float(profile), 0.0), 1.0)
+            except ValueError:
+                self.error(400)
+                return
+            profiler.reset()
+        if self.request.get('reset'):
+            registry.reset()
+
+        metrics = registry.snapshot()
+        metrics['instance'] = os.environ.get('INSTANCE_ID') or os.getpid()
+        metrics['profile_rate'] = profiler.rate
+        metrics['circuits'] = upstream.breaker.states()
+        metrics['startup'] = startup.report()
+        metrics['caches'] = dict([(name, cache_stats(cache)) for name, cache in _CACHES])
+        # one RPC, includes every instance
+        metrics['memcache'] = memcache.get_stats()
+        self.response.headers["Content-Type"] = 'application/json'
+        self.response.headers["Cache-Control"] = 'no-cache'
+        self.response.out.write(json.dumps(metrics, sort_keys=True, indent=1))
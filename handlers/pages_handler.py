@@ -1,10 +1,7 @@
-import os
-from oauth import oauth
-
 from google.appengine.ext import webapp
-from google.appengine.ext.webapp import template
 
 import config
+from handlers import templates
 from session import cookie
         
 class AboutHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
@@ -19,8 +16,7 @@ class AboutHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
         else:
              username = None
         template_values = {'username': username}
-        path = os.path.join(os.path.dirname(__file__), '..', 'templates', 'about.html')
-        self.response.out.write(template.render(path, template_values))
+        templates.write_page(self, 'about.html', template_values, (username,))
         
 class HelpHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
     """
@@ -34,5 +30,4 @@ class HelpHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
         else:
              username = None
         template_values = {'username': username}
-        path = os.path.join(os.path.dirname(__file__), '..', 'templates', 'help.html')
-        self.response.out.write(template.render(path, template_values))
\ No newline at end of file
+        templates.write_page(self, 'help.html', template_values, (username,))
\ No newline at end of file
@@ -0,0 +1,172 @@
+from oauth import oauth
+
+import urllib
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.ext import webapp
+from django.utils import simplejson as json
+
+import config
+from handlers import templates
+from pdf import raster
+from presentation import annotations
+from presentation import sync
+from proxy import files
+from session import cookie
+
+class PresentationHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
+    """
+    ('/presentation')
+    """
+    def post(self):
+        session = self.get_session()
+        path = self.request.get('path')
+        if session.get('dropbox_credentials') and path:
+            presentation_id = sync.create(files.owner(session), path, session.get('dropbox_credentials'))
+            self.redirect('/presenter?%s' % urllib.urlencode({'path': path.encode('utf8'),
+                                                              'presentation': presentation_id}))
+        else:
+            self.redirect('/connect')
+
+class PresentationSyncHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
+    """
+    ('/presentation/([0-9a-f]+)/(page|state|join)')
+    """
+    def get(self, presentation_id, mode):
+        try:
+            if mode == 'state':
+                state = sync.get_state(presentation_id)
+                since = self.request.get('since')
+                if since and since.isdigit() and int(since) >= state['seq']:
+                    self.response.set_status(204)
+                    return
+                _write_json(self.response, state)
+            elif mode == 'join':
+                token = None
+                if config.SYNC_PUSH:
+                    token = sync.join(presentation_id)
+                _write_json(self.response, {'token': token,
+                                            'state': sync.get_state(presentation_id),
+                                            'poll_interval': config.SYNC_POLL_INTERVAL})
+            else:
+                self.error(405)
+        except sync.PresentationNotFoundException:
+            self.error(404)
+
+    def post(self, presentation_id, mode):
+        session = self.get_session()
+        if mode != 'page':
+            self.error(405)
+            return
+        try:
+            presentation = sync.get(presentation_id)
+        except sync.PresentationNotFoundException:
+            self.error(404)
+            return
+        if not session.get('dropbox_credentials') or str(files.owner(session)) != presentation.owner:
+            self.error(403)
+            return
+        try:
+            page = int(self.request.get('page'))
+        except ValueError:
+            self.error(400)
+            return
+        _write_json(self.response, sync.publish(presentation_id, page))
+
+class AnnotationHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
+    """
+    ('/annotations')
+    """
+    def get(self):
+        session = self.get_session()
+        try:
+            page_id = self._page_id(session)
+        except files.FileException, e:
+            self.error(e.status_code)
+            return
+        since = self.request.get('since')
+        changes = annotations.changes(page_id, since.isdigit() and int(since) or None)
+        if changes is None:
+            self.response.set_status(204)
+            return
+        _write_json(self.response, changes)
+
+    def post(self):
+        session = self.get_session()
+        try:
+            page_id = self._page_id(session, write=True)
+            seq = annotations.append(page_id, json.loads(self.request.get('ops')))
+        except files.FileException, e:
+            self.error(e.status_code)
+            return
+        except (ValueError, annotations.AnnotationException), e:
+            _logger.info('Rejecting annotations: %s' % e)
+            self.error(400)
+            return
+        _write_json(self.response, {'seq': seq})
+
+    def _page_id(self, session, write=False):
+        """
+        The annotated page a request is for, the deck is resolved like for
+        /file. Only the owner of the deck may write.
+        """
+        deck = files.resolve(self.request, session)
+        if deck is None:
+            raise files.FileException(403)
+        owner, dropbox_credentials, path = deck
+        if write and (not session.get('dropbox_credentials') or str(files.owner(session)) != str(owner)):
+            raise files.FileException(403)
+        try:
+            page = int(self.request.get('n'))
+        except ValueError:
+            raise files.FileException(400)
+        callback_url = "%s/connect/verify" % self.request.host_url
+        client = oauth.get_dropbox_client(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
+        metadata = files.current_metadata(client, dropbox_credentials, owner, path)
+        return annotations.page_id(owner, path, metadata.get('rev'), page)
+
+class ViewerHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
+    """
+    ('/watch/([0-9a-f]+)')
+    """
+    def get(self, presentation_id):
+        try:
+            sync.get(presentation_id)
+        except sync.PresentationNotFoundException:
+            self.error(404)
+            return
+        template_values = {
+                              'presentation': presentation_id,
+                              'pdf': '/file?presentation=' + presentation_id,
+                              'image_mode': raster.available(),
+                              'push': config.SYNC_PUSH,
+                              'poll_interval': config.SYNC_POLL_INTERVAL
+                           }
+        self.response.out.write(templates.render('viewer.html', template_values))
+
+class BroadcastTaskHandler(webapp.RequestHandler):
+    """
+    ('/tasks/presentation/(broadcast|fanout)')
+    """
+    def post(self, mode):
+        if mode == 'broadcast':
+            try:
+                sync.broadcast(self.request.get('presentation'))
+            except sync.PresentationNotFoundException:
+                _logger.info('Dropping broadcast for unknown presentation')
+        else:
+            sync.fanout(self.request.get('bucket'), self.request.get('message'))
+
+class AnnotationTaskHandler(webapp.RequestHandler):
+    """
+    ('/tasks/annotations')
+    """
+    def post(self):
+        annotations.compact(self.request.get('page'))
+
+def _write_json(response, value):
+    response.headers["Content-Type"] = 'application/json'
+    response.headers["Cache-Control"] = 'no-cache'
+    response.out.write(json.dumps(value))
@@ -1,15 +1,22 @@
-import os
-from oauth import oauth
+import re
 
 import logging
 _logger = logging.getLogger(__name__)
 
 from google.appengine.ext import webapp
-from google.appengine.ext.webapp import template
+from django.utils import simplejson as json
 
 import config
+from handlers import templates
+from pdf import manifest
+from pdf import raster
+from proxy import files
+from proxy import prefetch
 from session import cookie
 
+# what sync.create hands out, anything else would end up in the page as is
+_PRESENTATION_ID = re.compile(r'^[0-9a-f]+$')
+
 class PresenterHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
     """
     ('/presenter')
@@ -23,11 +30,47 @@ class PresenterHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
                  username = current_user['name']
             else:
                  username = None
+            if path:
+                prefetch.record_open(files.owner(session), path)
+            try:
+                page = max(int(self.request.get('page', '1')), 1)
+            except ValueError:
+                page = 1
             template_values = {
+                                  'manifest': self._manifest(session, path),
                                   'pdf': '/file?path='+path,
+                                  'path': path,
+                                  # a JavaScript string that cannot end the script element
+                                  'path_json': json.dumps(path).replace('<', '\\u003c'),
+                                  'page': page,
+                                  'presentation': _presentation_id(self.request.get('presentation')),
+                                  'host_url': self.request.host_url,
+                                  'image_mode': raster.available(),
+                                  'split_pages': config.SPLIT_PAGES,
+                                  'annotation_batch_interval': int(config.ANNOTATION_BATCH_INTERVAL * 1000),
+                                  'annotation_batch_ops': config.ANNOTATION_BATCH_OPS,
+                                  'annotation_max_points': config.ANNOTATION_MAX_POINTS,
                                   'username': username
                                }
-            path = os.path.join(os.path.dirname(__file__), '..', 'templates', 'presenter.html')
-            self.response.out.write(template.render(path, template_values))
+            self.response.out.write(templates.render('presenter.html', template_values))
         else:
-            self.redirect('/connect')
\ No newline at end of file
+            self.redirect('/connect')
+
+    def _manifest(self, session, path):
+        """
+        The deck manifest as JSON to inline into the page if it is cached,
+        'null' otherwise, the page then asks /manifest for it. Extracting it
+        here would hold the page back until the whole deck is loaded.
+        """
+        if not path:
+            return 'null'
+        body = manifest.cached(files.owner(session), path)
+        if body is None:
+            return 'null'
+        # it goes into a script element
+        return body.replace('</', '<\\/')
+
+def _presentation_id(value):
+    if _PRESENTATION_ID.match(value):
+        return value
+    return ''
@@ -0,0 +1,54 @@
+from oauth import oauth
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.ext import webapp
+
+import config
+from handlers import templates
+from proxy import files
+from proxy import search
+from session import cookie
+
+class SearchHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
+    """
+    ('/search')
+    """
+    def get(self):
+        session = self.get_session()
+        if not session.get('dropbox_credentials'):
+            self.redirect('/connect/login')
+            return
+        current_user = session.get('current_user')
+        if current_user:
+             username = current_user['name']
+        else:
+             username = None
+        query = self.request.get('q').strip()
+        index = search.load(files.owner(session))
+        results = []
+        for deck, pages in index.search(query):
+            path, rev, page_count = deck
+            results.append({'path': path,
+                            'pages': pages[:config.SEARCH_PAGES_SHOWN],
+                            'more_pages': len(pages) > config.SEARCH_PAGES_SHOWN})
+        template_values = {
+                              'query': query,
+                              'results': results,
+                              'decks': len(index.decks),
+                              'username': username}
+        self.response.out.write(templates.render('search.html', template_values))
+
+class SearchTaskHandler(webapp.RequestHandler):
+    """
+    ('/tasks/search')
+    """
+    def post(self):
+        callback_url = "%s/connect/verify" % self.request.host_url
+        client = oauth.get_dropbox_client(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
+        dropbox_credentials = {'token': self.request.get('token'),
+                               'secret': self.request.get('secret')}
+        owner = self.request.get('owner')
+        extracted = search.run(client, dropbox_credentials, owner)
+        _logger.info('Indexed the text of %d decks for %s' % (extracted, owner))
@@ -1,14 +1,22 @@
-import os
 from oauth import oauth
+from oauth import quota
 
 import logging
 _logger = logging.getLogger(__name__)
 
 from google.appengine.ext import webapp
-from google.appengine.ext.webapp import template
 from django.utils import simplejson as json
 
 import config
+from handlers import templates
+from cache import content
+from cache.listing import listing_cache
+from pdf import raster
+from proxy import files
+from proxy import folders
+from proxy import prefetch
+from proxy import ranges
+from proxy import search
 from session import cookie
 
 
@@ -20,47 +28,246 @@ class SlidesHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
     def get(self, mode=''):    
         session = self.get_session()    
         callback_url = "%s/connect/verify" % self.request.host_url
-        client = oauth.DropboxClient(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
+        client = oauth.get_dropbox_client(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
         if session.get('dropbox_credentials'):
             dropbox_credentials = session.get('dropbox_credentials')
-            result = client.make_request('https://api.dropbox.com/1/metadata/sandbox', token=dropbox_credentials.get('token'), secret=dropbox_credentials.get('secret'), additional_params={})
-            result_object = json.loads(result.content)
+            owner = files.owner(session)
+            # over their budget, users get the index as it is
+            limited = quota.users.take(owner)
+            if limited:
+                index, changed = folders.load(owner), []
+            else:
+                try:
+                    index, changed = folders.current(client, dropbox_credentials, owner)
+                except folders.FolderIndexException, e:
+                    self.error(e.status_code)
+                    return
             current_user = session.get('current_user')
             if current_user:
                  username = current_user['name']
             else:
                  username = None
-            template_values = {
-                                  'contents': result_object.get('contents'),
-                                  'username': username}
-            path = os.path.join(os.path.dirname(__file__), '..', 'templates', 'slides.html')
-            self.response.out.write(template.render(path, template_values))
+            sort = self.request.get('sort', 'modified')
+            if sort not in folders.SORTS:
+                sort = 'modified'
+            # newest and biggest first, names from a to z
+            reverse = sort != 'name'
+            query = self.request.get('q').strip()
+            try:
+                page_number = max(int(self.request.get('page', '1')), 1)
+            except ValueError:
+                page_number = 1
+            view = '%s:%s:%s:%d' % (index.version, sort, query.encode('utf8'), page_number)
+            page = listing_cache.get_page(owner, view, username)
+            if page is None:
+                matches = index.files(sort, reverse, query)
+                pages = max((len(matches) + config.SLIDES_PAGE_SIZE - 1) / config.SLIDES_PAGE_SIZE, 1)
+                page_number = min(page_number, pages)
+                start = (page_number - 1) * config.SLIDES_PAGE_SIZE
+                template_values = {
+                                      'contents': matches[start:start + config.SLIDES_PAGE_SIZE],
+                                      'total': len(matches),
+                                      'page': page_number,
+                                      'pages': pages,
+                                      'previous_page': page_number > 1 and page_number - 1,
+                                      'next_page': page_number < pages and page_number + 1,
+                                      'sort': sort,
+                                      'sorts': folders.SORTS,
+                                      'query': query,
+                                      'indexing': not index.complete,
+                                      'thumbnails': raster.available(),
+                                      'thumbnail_width': min(config.RASTER_WIDTHS),
+                                      'username': username}
+                page = templates.render('slides.html', template_values)
+                if index.complete:
+                    listing_cache.set_page(owner, view, username, page)
+            self.response.out.write(page)
+            if not limited:
+                prefetch.schedule(owner, dropbox_credentials, index)
+                search.schedule(owner, dropbox_credentials, index)
         else:
             self.redirect('/connect/login')
             
+class PrefetchTaskHandler(webapp.RequestHandler):
+    """
+    ('/tasks/prefetch')
+    """
+    def post(self):
+        callback_url = "%s/connect/verify" % self.request.host_url
+        client = oauth.get_dropbox_client(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
+        dropbox_credentials = {'token': self.request.get('token'),
+                               'secret': self.request.get('secret')}
+        owner = self.request.get('owner')
+        fetched = prefetch.run(client, dropbox_credentials, owner, self.request.get('generation'),
+                               json.loads(self.request.get('entries')))
+        _logger.info('Prefetched %d decks for %s' % (fetched, owner))
+
 class FileLoaderHandler(webapp.RequestHandler, cookie.SimpleCookieSessionMixin):
     """
     ('/file/(*.)')
     """
     def get(self):
         session = self.get_session()   
-        path = self.request.get('path') 
-        if session.get('dropbox_credentials'):
-            callback_url = "%s/connect/verify" % self.request.host_url
-            client = oauth.DropboxClient(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
-            if path:
-                dropbox_credentials = session.get('dropbox_credentials')
-                result = client.make_request('https://api-content.dropbox.com/1/files/sandbox' + path, token=dropbox_credentials.get('token'), secret=dropbox_credentials.get('secret'), additional_params={})
-                if result.status_code == 200:
-                    metadata = json.loads(result.headers['x-dropbox-metadata'])
-                    self.response.headers["Content-Type"] = metadata.get('mime_type')
-                    print result.content
-                else:
-                   self.error(result.status_code)
-        else:
-            self.redirect('/connect')
-            
-            
-            
-            
-            
\ No newline at end of file
+        try:
+            deck = files.resolve(self.request, session)
+            if deck:
+                owner, dropbox_credentials, path = deck
+                callback_url = "%s/connect/verify" % self.request.host_url
+                client = oauth.get_dropbox_client(config.APPLICATION_KEY, config.APPLICATION_SECRET, callback_url)
+                if path:
+                    # the budget is the reader's, viewers of a presentation
+                    # do not use up the presenter's, and anonymous ones only
+                    # count against the endpoint
+                    wait = 0
+                    if session.get('dropbox_credentials'):
+                        wait = quota.users.take(files.owner(session))
+                    if not wait:
+                        self._serve(client, dropbox_credentials, owner, path)
+                    elif not self._serve_cached(owner, path):
+                        _too_many_requests(self.response, wait)
+            else:
+                self.redirect('/connect')
+        except files.FileException, e:
+            # a piece can fail after the headers of the entity were set
+            self.response.clear()
+            for name in ('Content-Range', 'Content-Length', 'ETag'):
+                del self.response.headers[name]
+            if e.status_code == 429:
+                _too_many_requests(self.response, config.QUOTA_RETRY_AFTER)
+            else:
+                self.error(e.status_code)
+    
+    def _validate(self, metadata):
+        """
+        Answers conditional requests. Returns whether the entity still has
+        to be sent and the byte range of it to send.
+        """
+        etag = content.entity_tag(metadata.get('rev'))
+        if content.none_match(self.request.headers.get('If-None-Match'), etag):
+            self.response.set_status(304)
+            self.response.headers["ETag"] = etag
+            return (False, None)
+        byte_range = ranges.parse_range_header(self.request.headers.get('Range'))
+        if byte_range and not ranges.if_range_matches(self.request.headers.get('If-Range'), etag):
+            # the deck changed since the client started loading it,
+            # so it has to start over with the whole file
+            byte_range = None
+        return (True, byte_range)
+    
+    def _serve_cached(self, owner, path):
+        """
+        Serves the deck from the caches alone, at the rev seen last. Returns
+        False if they do not have it.
+        """
+        metadata = content.file_cache.get_revision(owner, path, stale=True)
+        if metadata is None:
+            return False
+        body = content.file_cache.get(owner, path, metadata.get('rev'))
+        if body is None:
+            return False
+        send, byte_range = self._validate(metadata)
+        if send:
+            self._write_headers(metadata)
+            self._send(body, 0, len(body), byte_range)
+        return True
+    
+    def _serve(self, client, dropbox_credentials, owner, path):
+        metadata = files.current_metadata(client, dropbox_credentials, owner, path)
+        send, byte_range = self._validate(metadata)
+        if not send:
+            return
+        
+        metadata, body = files.load(client, dropbox_credentials, owner, path, metadata)
+        if body is not None:
+            self._write_headers(metadata)
+            self._send(body, 0, len(body), byte_range)
+            return
+        
+        # too big for the cache, only fetch what was asked for
+        total = metadata.get('bytes', 0)
+        window = (0, total - 1)
+        if byte_range:
+            try:
+                window = ranges.resolve_range(byte_range, total)
+            except ranges.UnsatisfiableRangeException:
+                # the size is known, Dropbox need not be asked
+                self._write_headers(metadata)
+                self.response.set_status(416)
+                self.response.headers["Content-Range"] = 'bytes */%d' % total
+                return
+        if window[1] - window[0] + 1 > config.FILE_MAX_RESPONSE_BYTES:
+            # the response is buffered and App Engine caps its size, a
+            # range gets what fits and the client asks for the rest
+            if not byte_range:
+                self.response.headers["Accept-Ranges"] = 'bytes'
+                raise files.FileException(413)
+            window = (window[0], window[0] + config.FILE_MAX_RESPONSE_BYTES - 1)
+        if window[1] - window[0] + 1 > config.CHUNKED_FETCH_BYTES:
+            pieces = files.fetch_chunked(client, dropbox_credentials, path, metadata.get('rev'), window[0], window[1])
+            self._write_headers(metadata)
+            self._send_pieces(pieces, window, total, byte_range)
+            return
+        result = files.fetch(client, dropbox_credentials, path, byte_range)
+        if result.status_code not in (200, 206):
+            raise files.FileException(result.status_code)
+        fetched = json.loads(result.headers['x-dropbox-metadata'])
+        if fetched.get('rev') != metadata.get('rev'):
+            content.file_cache.set_revision(owner, path, fetched)
+            if result.status_code == 206 and self.request.headers.get('If-Range'):
+                byte_range = None
+                result = files.fetch(client, dropbox_credentials, path)
+                if result.status_code != 200:
+                    raise files.FileException(result.status_code)
+                fetched = json.loads(result.headers['x-dropbox-metadata'])
+        offset = 0
+        total = fetched.get('bytes', len(result.content))
+        upstream_range = ranges.parse_content_range(result.headers.get('content-range'))
+        if result.status_code == 206 and upstream_range:
+            offset, _, total = upstream_range
+        self._write_headers(fetched)
+        self._send(result.content, offset, total, byte_range)
+    
+    def _write_headers(self, metadata):
+        self.response.headers["Content-Type"] = metadata.get('mime_type')
+        self.response.headers["Accept-Ranges"] = 'bytes'
+        self.response.headers["ETag"] = content.entity_tag(metadata.get('rev'))
+        self.response.headers["Cache-Control"] = 'private, no-cache'
+    
+    def _send(self, body, offset, total, byte_range):
+        """
+        Writes the (partial) entity in FILE_CHUNK_SIZE pieces. `body` holds
+        the bytes of the file starting at `offset`, either all of them or, if
+        Dropbox honored a forwarded Range header, just the requested window.
+        """
+        if byte_range:
+            try:
+                start, end = ranges.resolve_range(byte_range, total)
+            except ranges.UnsatisfiableRangeException:
+                self.response.set_status(416)
+                self.response.headers["Content-Range"] = 'bytes */%d' % total
+                return
+            if start != offset or end - start + 1 != len(body):
+                body = body[start - offset:end - offset + 1]
+            self.response.set_status(206)
+            self.response.headers["Content-Range"] = ranges.content_range(start, end, total)
+        self.response.headers["Content-Length"] = str(len(body))
+        for chunk in ranges.iter_chunks(body, config.FILE_CHUNK_SIZE):
+            self.response.out.write(chunk)
+    
+    def _send_pieces(self, pieces, window, total, byte_range):
+        """
+        Writes the bytes of `window` as files.fetch_chunked yields them.
+        """
+        start, end = window
+        if byte_range:
+            self.response.set_status(206)
+            self.response.headers["Content-Range"] = ranges.content_range(start, end, total)
+        self.response.headers["Content-Length"] = str(end - start + 1)
+        for piece in pieces:
+            for chunk in ranges.iter_chunks(piece, config.FILE_CHUNK_SIZE):
+                self.response.out.write(chunk)
+
+def _too_many_requests(response, wait):
+    # older webapp versions do not know the code
+    response.set_status(429, 'Too Many Requests')
+    response.headers["Retry-After"] = str(int(wait) + 1)
@@ -0,0 +1,125 @@
+"""
+Static assets, for templates and for hosts without a static file server.
+
+`url` turns an asset name like 'scripts/pdf.js' into the URL of its content
+hashed copy from build_assets.py, which never changes and is cached by
+browsers for a year. Templates call it through the `asset` filter.
+
+On App Engine app.yaml serves /assets itself. Elsewhere (runtime/wsgi.py)
+StaticHandler does, picking the best precompressed variant the client
+accepts. Unhashed assets are served with an ETag and revalidated.
+"""
+
+import hashlib
+import mimetypes
+import os
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.ext import webapp
+from django.utils import simplejson as json
+
+import config
+from cache import content
+
+ASSET_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'assets'))
+BUILD_DIR = os.path.join(ASSET_DIR, 'build')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# preferred first, with the suffix build_assets.py gives the variant
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+def _load_manifest():
+    try:
+        f = open(os.path.join(BUILD_DIR, 'manifest.json'))
+    except IOError:
+        _logger.info('No asset manifest, run build_assets.py')
+        return {}
+    try:
+        return json.loads(f.read())
+    finally:
+        f.close()
+
+_manifest = _load_manifest()
+# path -> (data, etag) of files read so far, bounded by the number of assets
+_files = {}
+
+def url(name):
+    """
+    The URL of the asset `name`, relative to assets/.
+    """
+    hashed = _manifest.get(name)
+    if hashed is None:
+        return '%s/assets/%s' % (config.ASSET_URL_PREFIX, name)
+    return '%s/assets/build/%s' % (config.ASSET_URL_PREFIX, hashed)
+
+def accepted_encodings(header):
+    """
+    The content codings `header` (an Accept-Encoding value) allows.
+    """
+    accepted = set()
+    for part in (header or '').split(','):
+        fields = part.strip().split(';')
+        coding = fields[0].strip().lower()
+        quality = 1.0
+        for field in fields[1:]:
+            field = field.strip()
+            if field.startswith('q='):
+                try:
+                    quality = float(field[2:])
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding)
+    return accepted
+
+def _read(path):
+    cached = _files.get(path)
+    if cached is None:
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        cached = _files[path] = (data, content.entity_tag(hashlib.sha1(data).hexdigest()))
+    return cached
+
+class StaticHandler(webapp.RequestHandler):
+    """
+    ('/assets/(.*)')
+    """
+    def get(self, name):
+        path = os.path.abspath(os.path.join(ASSET_DIR, name))
+        if not path.startswith(ASSET_DIR + os.sep) or name.endswith(('.gz', '.br')):
+            self.error(404)
+            return
+        original = _read(path)
+        if original is None:
+            self.error(404)
+            return
+        immutable = path.startswith(BUILD_DIR + os.sep)
+        data, etag = original
+        self.response.headers["Content-Type"] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.response.headers["Vary"] = 'Accept-Encoding'
+        if immutable:
+            self.response.headers["Cache-Control"] = IMMUTABLE
+            accepted = accepted_encodings(self.request.headers.get('Accept-Encoding'))
+            for coding, suffix in ENCODINGS:
+                if coding in accepted:
+                    variant = _read(path + suffix)
+                    if variant is not None:
+                        data, etag = variant
+                        self.response.headers["Content-Encoding"] = coding
+                        break
+        else:
+            self.response.headers["Cache-Control"] = 'public, no-cache'
+        self.response.headers["ETag"] = etag
+        if content.none_match(self.request.headers.get('If-None-Match'), etag):
+            self.response.set_status(304)
+            return
+        self.response.out.write(data)
@@ -0,0 +1,73 @@
+"""
+Template registry and rendered page cache.
+
+Templates are loaded and compiled once per process, either up front through
+`preload` or on first use, instead of every handler joining paths and
+rendering from the file system on each request.
+
+Pages whose output depends on nothing but a small key, like /help and /about
+which only vary by username, are rendered once per key and served from an
+in-process cache with an ETag, so a revalidating browser gets a 304.
+"""
+
+import hashlib
+import os
+
+from google.appengine.ext.webapp import template
+
+import config
+from cache import lru
+from cache import content
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), '..', 'templates')
+
+# {{ name|asset }} in every template
+template.register_template_library('handlers.filters')
+
+_compiled = {}
+_pages = lru.LRUCache(config.PAGE_CACHE_ENTRIES)
+
+def get(name):
+    """
+    Returns the compiled template `name` from the templates directory.
+    """
+    compiled = _compiled.get(name)
+    if compiled is None:
+        compiled = _compiled[name] = template.load(os.path.join(TEMPLATE_DIR, name))
+    return compiled
+
+def render(name, template_values):
+    return get(name).render(template.Context(template_values))
+
+def preload():
+    """
+    Compiles every template, meant to be called once at startup.
+    """
+    for name in os.listdir(TEMPLATE_DIR):
+        if name.endswith('.html'):
+            get(name)
+
+def write_page(handler, name, template_values, key=()):
+    """
+    Writes the template `name` to the response of `handler`, rendering it
+    only the first time it is needed for `key`. `key` must capture every
+    template value the output depends on.
+    """
+    cache_key = (name,) + tuple(key)
+    page = _pages.get(cache_key)
+    if page is None:
+        html = render(name, template_values)
+        if isinstance(html, unicode):
+            html = html.encode('utf8')
+        # the version changes on every deploy, and so may the templates
+        etag = content.entity_tag(hashlib.sha1('%s:%s' % (os.environ.get('CURRENT_VERSION_ID', ''), html)).hexdigest())
+        page = (etag, html)
+        _pages.set(cache_key, page)
+    etag, html = page
+    handler.response.headers["ETag"] = etag
+    handler.response.headers["Cache-Control"] = 'private, no-cache'
+    if content.none_match(handler.request.headers.get('If-None-Match'), etag):
+        handler.response.set_status(304)
+        return
+    handler.response.headers["Content-Type"] = 'text/html; charset=utf-8'
+    handler.response.out.write(html)
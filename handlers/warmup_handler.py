@@ -0,0 +1,10 @@
+from google.appengine.ext import webapp
+
+from handlers import lazy
+
+class WarmupHandler(webapp.RequestHandler):
+    """
+    ('/_ah/warmup')
+    """
+    def get(self):
+        lazy.warmup()
@@ -19,33 +19,69 @@
 # 6. Finally, visit http://localhost:8080/timeline to see your twitter 
 # timeline.
 #
+import time
+
 import logging
 
 _logger = logging.getLogger(__name__)
 
+import config
+from metrics import startup
+
+_started = time.time()
+if config.STARTUP_REPORT:
+    startup.start()
+
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp import util
 
-import config
+from handlers import lazy
+from metrics import middleware
+
+# handler classes by dotted name, each module is imported on the first
+# request of one of its routes, see handlers/lazy.py
+_ROUTES = [('/', 'handlers.main_handler.MainHandler'),
+           ('/connect/(.*)', 'handlers.connect_handler.ConnectHandler'),
+           ('/presenter', 'handlers.presenter_handler.PresenterHandler'),
+           ('/slides', 'handlers.slides_handler.SlidesHandler'),
+           ('/file', 'handlers.slides_handler.FileLoaderHandler'),
+           ('/file/page', 'handlers.image_handler.PageFileHandler'),
+           ('/page', 'handlers.image_handler.PageImageHandler'),
+           ('/manifest', 'handlers.manifest_handler.ManifestHandler'),
+           ('/search', 'handlers.search_handler.SearchHandler'),
+           ('/presentation', 'handlers.presentation_handler.PresentationHandler'),
+           ('/presentation/([0-9a-f]+)/(page|state|join)', 'handlers.presentation_handler.PresentationSyncHandler'),
+           ('/watch/([0-9a-f]+)', 'handlers.presentation_handler.ViewerHandler'),
+           ('/annotations', 'handlers.presentation_handler.AnnotationHandler'),
+           ('/tasks/presentation/(broadcast|fanout)', 'handlers.presentation_handler.BroadcastTaskHandler'),
+           ('/tasks/annotations', 'handlers.presentation_handler.AnnotationTaskHandler'),
+           ('/tasks/oauth/sweep', 'handlers.connect_handler.TokenSweepHandler'),
+           ('/tasks/prefetch', 'handlers.slides_handler.PrefetchTaskHandler'),
+           ('/tasks/search', 'handlers.search_handler.SearchTaskHandler'),
+           ('/metrics', 'handlers.metrics_handler.MetricsHandler'),
+           ('/help', 'handlers.pages_handler.HelpHandler'),
+           ('/about', 'handlers.pages_handler.AboutHandler'),
+           # App Engine sends it before routing traffic to a new instance
+           ('/_ah/warmup', 'handlers.warmup_handler.WarmupHandler'),
+           # app.yaml serves these on App Engine
+           ('/assets/(.*)', 'handlers.static_handler.StaticHandler')]
+
+def create_application():
+    return webapp.WSGIApplication([(pattern, lazy.handler(name)) for pattern, name in _ROUTES],
+                                  debug=True)
+
+# the WSGI callable, runtime/wsgi.py serves it outside of App Engine
+application = create_application()
+if config.METRICS_ENABLED:
+    application = middleware.MetricsMiddleware(application)
 
-from handlers import (connect_handler,
-                      main_handler,
-                      presenter_handler,
-                      slides_handler,
-                      pages_handler)
+if config.STARTUP_REPORT:
+    startup.stop()
+startup.record('main', time.time() - _started)
+_logger.info('Started in %.0f ms' % ((time.time() - _started) * 1000))
 
 def main():
-    application = webapp.WSGIApplication([
-                                            ('/', main_handler.MainHandler),
-                                            ('/connect/(.*)', connect_handler.ConnectHandler),
-                                            ('/presenter', presenter_handler.PresenterHandler),
-                                            ('/slides', slides_handler.SlidesHandler),
-                                            ('/file', slides_handler.FileLoaderHandler),
-                                            ('/help', pages_handler.HelpHandler),
-                                            ('/about', pages_handler.AboutHandler)
-                                         ], debug=True)                                
-                                       
     util.run_wsgi_app(application)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,65 @@
+"""
+WSGI middleware that times every request.
+
+Requests are labelled with the route pattern they match, so /file?path=a
+and /file?path=b end up in the same histogram. Per route it records the
+total time, the time spent writing the body to the client, bytes sent and
+errors (responses of 500 and above, or exceptions).
+"""
+
+import time
+
+from metrics.profiler import profiler
+from metrics.registry import registry
+
+class MetricsMiddleware(object):
+
+    def __init__(self, application):
+        self.application = application
+        # webapp.WSGIApplication compiles its routes as ^pattern$
+        self._routes = [(regexp, regexp.pattern.lstrip('^').rstrip('$'))
+                        for regexp, handler in getattr(application, '_url_mapping', [])]
+
+    def route(self, path):
+        for regexp, pattern in self._routes:
+            if regexp.match(path):
+                return pattern
+        return 'unmatched'
+
+    def __call__(self, environ, start_response):
+        route = self.route(environ.get('PATH_INFO', ''))
+        started = time.time()
+        state = {'status': 500, 'bytes': 0, 'write': 0.0}
+
+        def timed_start_response(status, headers, exc_info=None):
+            state['status'] = int(status[:3])
+            write = start_response(status, headers, exc_info)
+            def timed_write(data):
+                write_started = time.time()
+                write(data)
+                state['write'] += time.time() - write_started
+                state['bytes'] += len(data)
+            return timed_write
+
+        try:
+            if profiler.sampled():
+                result = profiler.run(self.application, environ, timed_start_response)
+            else:
+                result = self.application(environ, timed_start_response)
+            if not isinstance(result, list):
+                body = list(result)
+                if hasattr(result, 'close'):
+                    result.close()
+                result = body
+            for data in result:
+                state['bytes'] += len(data)
+            return result
+        except Exception:
+            state['status'] = 500
+            raise
+        finally:
+            registry.observe('request', route, time.time() - started)
+            registry.observe('write', route, state['write'])
+            registry.incr('bytes_out', route, state['bytes'])
+            if state['status'] >= 500:
+                registry.incr('errors', route)
@@ -0,0 +1,67 @@
+"""
+Request sampling profiler.
+
+A `rate` fraction of requests runs under cProfile and their stats are added
+up per instance, so a hot path can be looked at on live traffic without
+profiling every request. Off (rate 0) unless METRICS_PROFILE_RATE says
+otherwise or it is switched on through /metrics?profile=<rate>.
+"""
+
+import cProfile
+import pstats
+import random
+import threading
+from StringIO import StringIO
+
+import config
+
+class Profiler(object):
+
+    def __init__(self, rate=config.METRICS_PROFILE_RATE):
+        self.rate = rate
+        self.requests = 0
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def sampled(self):
+        return self.rate > 0 and random.random() < self.rate
+
+    def run(self, function, *args):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            self._lock.acquire()
+            try:
+                self.requests += 1
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+            finally:
+                self._lock.release()
+
+    def report(self, lines=config.METRICS_PROFILE_LINES, sort='cumulative'):
+        """
+        The top `lines` functions of all profiled requests as text.
+        """
+        self._lock.acquire()
+        try:
+            if self._stats is None:
+                return 'No requests profiled, rate is %s\n' % self.rate
+            output = StringIO()
+            self._stats.stream = output
+            self._stats.sort_stats(sort).print_stats(lines)
+            return 'Profiled %d requests, rate is %s\n%s' % (self.requests, self.rate, output.getvalue())
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.requests = 0
+            self._stats = None
+        finally:
+            self._lock.release()
+
+profiler = Profiler()
@@ -0,0 +1,116 @@
+"""
+In-process counters and latency histograms.
+
+Every instance keeps its own numbers from the moment it starts, /metrics
+shows those of the instance that answers it. Histograms have fixed buckets,
+so recording a value is a bisect and two additions under a lock, and the
+percentiles in a snapshot are the upper bounds of the buckets they fall in.
+"""
+
+import bisect
+import threading
+import time
+
+# upper bounds in milliseconds, the last bucket takes everything above
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, milliseconds):
+        self.counts[bisect.bisect_left(BUCKETS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        if milliseconds > self.max:
+            self.max = milliseconds
+
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if index < len(BUCKETS):
+                    return BUCKETS[index]
+                return self.max
+        return 0
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean_ms': self.count and round(self.total / self.count, 2) or 0,
+                'p50_ms': self.percentile(0.5),
+                'p95_ms': self.percentile(0.95),
+                'p99_ms': self.percentile(0.99),
+                'max_ms': round(self.max, 2)}
+
+class Registry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.started = time.time()
+            self._histograms = {}
+            self._counters = {}
+        finally:
+            self._lock.release()
+
+    def observe(self, metric, label, seconds):
+        """
+        Records a duration of `seconds` in the histogram `metric` of `label`,
+        e.g. observe('upstream', 'api.dropbox.com', 0.12).
+        """
+        self._lock.acquire()
+        try:
+            histograms = self._histograms.setdefault(metric, {})
+            histogram = histograms.get(label)
+            if histogram is None:
+                histogram = histograms[label] = Histogram()
+            histogram.add(seconds * 1000)
+        finally:
+            self._lock.release()
+
+    def incr(self, metric, label, delta=1):
+        self._lock.acquire()
+        try:
+            counters = self._counters.setdefault(metric, {})
+            counters[label] = counters.get(label, 0) + delta
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        self._lock.acquire()
+        try:
+            histograms = {}
+            for metric, labels in self._histograms.items():
+                histograms[metric] = dict([(label, histogram.snapshot())
+                                           for label, histogram in labels.items()])
+            counters = {}
+            for metric, labels in self._counters.items():
+                counters[metric] = dict(labels)
+            return {'uptime': round(time.time() - self.started, 1),
+                    'histograms': histograms,
+                    'counters': counters}
+        finally:
+            self._lock.release()
+
+registry = Registry()
+
+def cache_stats(cache):
+    """
+    Hit and miss counts of an LRUCache.
+    """
+    lookups = cache.hits + cache.misses
+    return {'hits': cache.hits,
+            'misses': cache.misses,
+            'hit_ratio': lookups and round(float(cache.hits) / lookups, 3) or 0,
+            'entries': len(cache),
+            'size': cache.size}
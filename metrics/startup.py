@@ -0,0 +1,95 @@
+"""
+What an instance spends on imports before it can answer a request.
+
+While a thread is between `start` and `stop`, every import that loads new
+modules is timed, inclusive of the modules it pulls in (total) and without
+them (self), keyed by the name it was imported as. main.py traces its own
+startup and handlers/lazy.py the first load of every handler module, so
+/metrics shows which imports a cold start pays for and which ones the first
+request of a route does.
+
+The hook stays installed once STARTUP_REPORT has switched it on, imports on
+threads that are not tracing cost one attribute lookup more.
+"""
+
+import __builtin__
+import sys
+import threading
+import time
+
+import config
+
+_original_import = __builtin__.__import__
+_state = threading.local()
+_lock = threading.Lock()
+
+# import name -> [total seconds, self seconds]
+_modules = {}
+# phase (startup, a handler load) -> seconds
+_phases = {}
+
+def _import(name, globals=None, locals=None, fromlist=None, level=-1):
+    stack = getattr(_state, 'stack', None)
+    if not stack:
+        return _original_import(name, globals, locals, fromlist, level)
+    loaded = len(sys.modules)
+    # time spent in nested imports, which is not this one's own
+    stack.append(0.0)
+    started = time.time()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.time() - started
+        nested = stack.pop()
+        if len(sys.modules) > loaded:
+            stack[-1] += elapsed
+            _lock.acquire()
+            try:
+                times = _modules.setdefault(name, [0.0, 0.0])
+                times[0] += elapsed
+                times[1] += elapsed - nested
+            finally:
+                _lock.release()
+
+def start():
+    """
+    Starts timing the imports of the current thread. Calls nest, only the
+    outermost `stop` ends the trace.
+    """
+    if __builtin__.__import__ is not _import:
+        __builtin__.__import__ = _import
+    stack = getattr(_state, 'stack', None)
+    if not stack:
+        # the bottom entry collects imports that are not nested in another
+        _state.stack = stack = [0.0]
+        _state.depth = 0
+    _state.depth += 1
+
+def stop():
+    if not getattr(_state, 'stack', None):
+        return
+    _state.depth -= 1
+    if not _state.depth:
+        _state.stack = None
+
+def record(phase, seconds):
+    _lock.acquire()
+    try:
+        _phases[phase] = _phases.get(phase, 0.0) + seconds
+    finally:
+        _lock.release()
+
+def report(limit=config.STARTUP_REPORT_MODULES):
+    """
+    Milliseconds per phase and the `limit` imports with the most time of
+    their own, as [name, total ms, self ms].
+    """
+    _lock.acquire()
+    try:
+        phases = dict([(phase, round(seconds * 1000, 1)) for phase, seconds in _phases.items()])
+        modules = [[name, round(times[0] * 1000, 1), round(times[1] * 1000, 1)]
+                   for name, times in _modules.items()]
+    finally:
+        _lock.release()
+    modules.sort(key=lambda module: -module[2])
+    return {'phases': phases, 'modules': modules[:limit]}
@@ -48,17 +48,20 @@ from google.appengine.api import urlfetch
 from google.appengine.ext import db
 
 from cgi import parse_qs
+import datetime
 from django.utils import simplejson as json
-from hashlib import sha1
-from hmac import new as hmac
-from random import getrandbits
-from time import time
-from urllib import urlencode
 from urllib import quote as urlquote
 from urllib import unquote as urlunquote
 
 import logging
+import time
+import urlparse
 
+from cache import lru
+from metrics.registry import registry
+
+import signer
+import upstream
 
 TWITTER = "twitter"
 YAHOO = "yahoo"
@@ -71,13 +74,44 @@ YAMMER = "yammer"
 class OAuthException(Exception):
   pass
 
+# How long a request token may take to come back from the service.
+REQUEST_TOKEN_TTL = 20*60
+
 class AuthToken(db.Model):
+    """Auth Token.
+
+    A request token waiting for the user to come back from the service.
+    Stored under the key name "oauth_<service>_<token>", the memcache key of
+    the secret, so it is looked up with a key get. Tokens older than REQUEST_TOKEN_TTL are ignored and removed
+    in bulk by sweep_auth_tokens.
+    """
 
     service = db.StringProperty(required=True)
     token = db.StringProperty(required=True)
     secret = db.StringProperty(required=True)
     created = db.DateTimeProperty(auto_now_add=True)
 
+    def expired(self):
+        return self.created < _token_expiry()
+
+def _upstream_callback(rpc, host, started):
+    """
+    Records latency, bytes and errors of an upstream call once its RPC has
+    completed. Callbacks run when the RPC is waited for, so the latency
+    includes the time until the caller wanted the result.
+    """
+    def callback():
+        registry.observe('upstream', host, time.time() - started)
+        try:
+            result = rpc.get_result()
+        except urlfetch.Error, e:
+            registry.incr('upstream_errors', '%s %s' % (host, e.__class__.__name__))
+            return
+        registry.incr('bytes_in', host, len(result.content))
+        if result.status_code >= 500:
+            registry.incr('upstream_errors', '%s %d' % (host, result.status_code))
+    return callback
+
 class OAuthClient():
 
     def __init__(self, service_name, consumer_key, consumer_secret, request_url,
@@ -90,6 +124,7 @@ class OAuthClient():
         self.request_url = request_url
         self.access_url = access_url
         self.callback_url = callback_url
+        self.signer = signer.Signer(consumer_key, consumer_secret, callback_url)
 
     def prepare_request(self, url, token="", secret="", additional_params=None,
                       method=urlfetch.GET, t=None, nonce=None):
@@ -100,74 +135,75 @@ class OAuthClient():
         Returns the payload of the request.
         """
 
-        def encode(text):
-            return urlquote(str(text), "~")
-
-        params = {
-            "oauth_consumer_key": self.consumer_key,
-            "oauth_signature_method": "HMAC-SHA1",
-            "oauth_timestamp": t if t else str(int(time())),
-            "oauth_nonce": nonce if nonce else str(getrandbits(64)),
-            "oauth_version": "1.0"
-        }
-        
-        if token:
-            params["oauth_token"] = token
-        elif self.callback_url:
-            params["oauth_callback"] = self.callback_url
-        
-        if additional_params:
-            params.update(additional_params)
-        
-        for k,v in params.items():
-            if isinstance(v, unicode):
-                params[k] = v.encode('utf8')
-        
-        # Join all of the params together.
-        params_str = "&".join(["%s=%s" % (encode(k), encode(params[k])) for k in sorted(params)])
-        
-        # Join the entire message together per the OAuth specification.
-        message = "&".join(["GET" if method == urlfetch.GET else "POST",
-                           encode(url), encode(params_str)])
-        
-        # Create a HMAC-SHA1 signature of the message.
-        key = "%s&%s" % (self.consumer_secret, secret) # Note compulsory "&".
-        signature = hmac(key, message, sha1)
-        digest_base64 = signature.digest().encode("base64").strip()
-        params["oauth_signature"] = digest_base64
-        
-        # Construct the request payload and return it
-        return urlencode(params)
+        return self.signer.sign(url, token, secret, additional_params,
+                                "GET" if method == urlfetch.GET else "POST",
+                                t, nonce)
             
     def make_async_request(self, url, token="", secret="", additional_params=None,
-                           protected=False, method=urlfetch.GET, headers={}):
+                           protected=False, method=urlfetch.GET, headers=None):
         """Make Request.
         Make an authenticated request to any OAuth protected resource.
         If protected is equal to True, the Authorization: OAuth header will be set.
-        A urlfetch response object is returned.
+        Returns an RPC whose get_result() is the urlfetch response, see
+        upstream.py for its deadline, retries and circuit breaker.
         """
         
-        payload = self.prepare_request(url, token, secret, additional_params,
-                                       method)
-        
-        if method == urlfetch.GET:
-            url = "%s?%s" % (url, payload)
-            payload = None
-        
+        # never touch the caller's dict, clients are shared between requests
+        headers = dict(headers or {})
         if protected:
             headers["Authorization"] = "OAuth"
         
-        rpc = urlfetch.create_rpc(deadline=10.0)
-        urlfetch.make_fetch_call(rpc, url, method=method, headers=headers,
-                                 payload=payload)
-        return rpc
+        def start(deadline):
+            # every attempt gets a fresh nonce
+            started = time.time()
+            payload = self.prepare_request(url, token, secret,
+                                           additional_params, method)
+            host = urlparse.urlsplit(url)[1]
+            registry.observe('sign', host, time.time() - started)
+            
+            fetch_url = url
+            if method == urlfetch.GET:
+                fetch_url = "%s?%s" % (url, payload)
+                payload = None
+            
+            rpc = urlfetch.create_rpc(deadline=deadline)
+            rpc.callback = _upstream_callback(rpc, host, time.time())
+            urlfetch.make_fetch_call(rpc, fetch_url, method=method,
+                                     headers=headers, payload=payload)
+            return rpc
+        
+        return upstream.UpstreamRPC(start, url, method)
 
     def make_request(self, url, token="", secret="", additional_params=None,
-                     protected=False, method=urlfetch.GET, headers={}):
+                     protected=False, method=urlfetch.GET, headers=None):
 
         return self.make_async_request(url, token, secret, additional_params,
                                        protected, method, headers).get_result()
 
+    def make_async_requests(self, requests):
+        """Make Async Requests.
+
+        Starts one signed request per entry of `requests`, each a dictionary
+        of make_async_request keyword arguments, without waiting for any of
+        them. Returns the list of RPCs in the same order.
+        """
+
+        return [self.make_async_request(**request) for request in requests]
+
+    def make_requests(self, requests):
+        """Make Requests.
+
+        Issues all `requests` concurrently and returns their urlfetch
+        responses in order, so N calls take the wall clock time of the
+        slowest one instead of the sum. If a request failed its exception is
+        raised once all of them have finished.
+        """
+
+        rpcs = self.make_async_requests(requests)
+        for rpc in rpcs:
+            rpc.wait()
+        return [rpc.get_result() for rpc in rpcs]
+
     def get_authorization_url(self):
         """Get Authorization URL.
       
@@ -187,18 +223,13 @@ class OAuthClient():
         auth_token = urlunquote(auth_token)
         auth_verifier = urlunquote(auth_verifier)
      
-        auth_secret = memcache.get(self._get_memcache_auth_key(auth_token))
+        auth_key = self._get_memcache_auth_key(auth_token)
+        auth_secret = memcache.get(auth_key)
      
         if not auth_secret:
-            result = AuthToken.gql("""
-              WHERE
-                service = :1 AND
-                token = :2
-              LIMIT
-                1
-            """, self.service_name, auth_token).get()
+            result = AuthToken.get_by_key_name(auth_key)
             
-            if not result:
+            if not result or result.expired():
                 logging.error("The auth token %s was not found in our db" % auth_token)
                 raise Exception, "Could not find Auth Token in database"
             else:
@@ -212,6 +243,10 @@ class OAuthClient():
      
         # Extract the access token/secret from the response.
         result = self._extract_credentials(response)
+
+        # The request token has been used up, don't wait for the sweeper.
+        memcache.delete(auth_key)
+        db.delete(db.Key.from_path(AuthToken.kind(), auth_key))
      
         # Try to collect some information about this user from the service.
         user_info = self._lookup_user_info(result["token"], result["secret"])
@@ -234,14 +269,15 @@ class OAuthClient():
         auth_secret = result["secret"]
        
         # Save the auth token and secret in our database.
-        auth = AuthToken(service=self.service_name,
+        auth_key = self._get_memcache_auth_key(auth_token)
+        auth = AuthToken(key_name=auth_key,
+                         service=self.service_name,
                          token=auth_token,
                          secret=auth_secret)
         auth.put()
        
         # Add the secret to memcache as well.
-        memcache.set(self._get_memcache_auth_key(auth_token), auth_secret,
-                     time=20*60)
+        memcache.set(auth_key, auth_secret, time=REQUEST_TOKEN_TTL)
        
         return auth_token
 
@@ -341,4 +377,48 @@ class DropboxClient(OAuthClient):
         user_info["name"] = data["display_name"]
         user_info["country"] = data["country"]
       
-        return user_info
\ No newline at end of file
+        return user_info
+
+
+def sweep_auth_tokens(batch_size=500, batches=10):
+    """Sweep Auth Tokens.
+
+    Deletes request tokens older than REQUEST_TOKEN_TTL, including the ones
+    stored before tokens were keyed by name, in batches of keys only
+    queries and bulk deletes. Returns the number of deleted tokens and
+    whether there are more left than `batches` batches could remove.
+    """
+
+    deleted = 0
+    for batch in xrange(batches):
+        keys = AuthToken.all(keys_only=True).filter("created <", _token_expiry()).fetch(batch_size)
+        if keys:
+            db.delete(keys)
+            deleted += len(keys)
+        if len(keys) < batch_size:
+            return deleted, False
+    return deleted, True
+
+def _token_expiry():
+    return datetime.datetime.now() - datetime.timedelta(seconds=REQUEST_TOKEN_TTL)
+
+
+# callback URLs follow the Host header of the request, so the clients are
+# bounded like any other per process cache
+_clients = lru.LRUCache(16)
+
+def get_dropbox_client(consumer_key, consumer_secret, callback_url):
+    """Get Dropbox Client.
+
+    Returns the per process DropboxClient for the given credentials and
+    callback URL. Clients keep no per request state, so handlers share them
+    instead of building a new one on every request, and urlfetch keeps the
+    connections to the Dropbox hosts alive between them.
+    """
+
+    key = (consumer_key, consumer_secret, callback_url)
+    client = _clients.get(key)
+    if client is None:
+        client = DropboxClient(consumer_key, consumer_secret, callback_url)
+        _clients.set(key, client)
+    return client
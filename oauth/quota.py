@@ -0,0 +1,92 @@
+"""
+Token buckets for what we ask of Dropbox, per user and per endpoint.
+
+Every instance keeps its own buckets, `rate` tokens a second up to `burst`,
+so taking a token costs a dictionary lookup. What an instance took for a key
+is added to a memcache counter for the current QUOTA_WINDOW second window
+at most every QUOTA_SYNC_INTERVAL seconds, and once the sum over all
+instances passes rate * QUOTA_WINDOW + burst the key is cut off on every
+instance that syncs until the window is over. One instance is held to the
+bucket exactly, all of them together to the budget of the window.
+
+`take` returns 0, or the seconds until a token will be there, which
+handlers send as Retry-After if they cannot answer from the caches instead.
+"""
+
+import threading
+import time
+
+from google.appengine.api import memcache
+
+import config
+from cache import lru
+from metrics.registry import registry
+
+NAMESPACE = 'quota'
+
+# tokens, refilled at, taken since the last sync, synced at, cut off until
+_TOKENS, _REFILLED, _UNSYNCED, _SYNCED, _BLOCKED = range(5)
+
+class Limiter(object):
+
+    def __init__(self, name, rate, burst, entries=config.QUOTA_LOCAL_ENTRIES):
+        """
+        A `rate` of 0 turns the limiter off.
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = lru.LRUCache(entries)
+
+    def take(self, key, cost=1):
+        """
+        Takes `cost` tokens for `key`. Returns 0 if there were enough,
+        otherwise how many seconds to wait for them.
+        """
+        if not self.rate:
+            return 0
+        now = time.time()
+        self._lock.acquire()
+        try:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [self.burst, now, 0, now, 0]
+                self._buckets.set(key, bucket)
+            bucket[_TOKENS] = min(self.burst, bucket[_TOKENS] + (now - bucket[_REFILLED]) * self.rate)
+            bucket[_REFILLED] = now
+            if bucket[_BLOCKED] > now:
+                wait = bucket[_BLOCKED] - now
+            elif bucket[_TOKENS] < cost:
+                wait = (cost - bucket[_TOKENS]) / self.rate
+            else:
+                bucket[_TOKENS] -= cost
+                bucket[_UNSYNCED] += cost
+                wait = 0
+            unsynced = 0
+            if bucket[_UNSYNCED] and now - bucket[_SYNCED] >= config.QUOTA_SYNC_INTERVAL:
+                unsynced = bucket[_UNSYNCED]
+                bucket[_UNSYNCED] = 0
+                bucket[_SYNCED] = now
+        finally:
+            self._lock.release()
+        if unsynced:
+            self._sync(key, bucket, unsynced, now)
+        if wait:
+            registry.incr('quota_limited', self.name)
+        return wait
+
+    def _sync(self, key, bucket, unsynced, now):
+        window = int(now / config.QUOTA_WINDOW)
+        counter = '%s:%s:%d' % (self.name, key, window)
+        total = memcache.incr(counter, unsynced, namespace=NAMESPACE)
+        if total is None:
+            memcache.add(counter, 0, time=config.QUOTA_WINDOW * 2, namespace=NAMESPACE)
+            total = memcache.incr(counter, unsynced, namespace=NAMESPACE)
+        if total is not None and total > self.rate * config.QUOTA_WINDOW + self.burst:
+            bucket[_BLOCKED] = (window + 1) * config.QUOTA_WINDOW
+
+# requests of one user that may need Dropbox, by uid
+users = Limiter('user', config.QUOTA_USER_RATE, config.QUOTA_USER_BURST)
+# calls to one Dropbox endpoint (see upstream.endpoint) for all users together
+endpoints = Limiter('endpoint', config.QUOTA_ENDPOINT_RATE, config.QUOTA_ENDPOINT_BURST)
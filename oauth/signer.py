@@ -0,0 +1,109 @@
+"""
+HMAC-SHA1 request signing for OAuth 1.0.
+
+Produces the same signatures as the original OAuthClient.prepare_request but
+does less work per request: the constant oauth_* parameters are encoded once
+per consumer, the keyed HMAC state is computed once per token secret and
+copied for every request, and encoded URLs are remembered. sign_many signs a
+batch with a single timestamp.
+
+bench/signing.py checks the output against the original implementation and
+reports signatures per second for both.
+"""
+
+import binascii
+from hashlib import sha1
+from hmac import new as hmac
+from random import getrandbits
+from time import time
+from urllib import quote as urlquote
+
+from cache import lru
+
+def encode(text):
+    return urlquote(_utf8(text), "~")
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return str(value)
+
+class Signer(object):
+
+    def __init__(self, consumer_key, consumer_secret, callback_url=None,
+                 cache_size=1024):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.callback_url = callback_url
+        self._constant_pairs = {
+            "oauth_consumer_key": "oauth_consumer_key=" + encode(consumer_key),
+            "oauth_signature_method": "oauth_signature_method=HMAC-SHA1",
+            "oauth_version": "oauth_version=1.0"
+        }
+        self._callback_pair = None
+        if callback_url:
+            self._callback_pair = "oauth_callback=" + encode(callback_url)
+        self._encoded_keys = {}
+        self._hmacs = lru.LRUCache(cache_size)
+        self._urls = lru.LRUCache(cache_size)
+
+    def sign(self, url, token="", secret="", additional_params=None,
+             method="GET", t=None, nonce=None):
+        """
+        Returns the urlencoded request parameters, including the signature,
+        for a `method` ("GET" or "POST") request to `url`.
+        """
+        pairs = self._constant_pairs.copy()
+        pairs["oauth_timestamp"] = "oauth_timestamp=" + encode(t or int(time()))
+        pairs["oauth_nonce"] = "oauth_nonce=" + encode(nonce or getrandbits(64))
+        if token:
+            pairs["oauth_token"] = "oauth_token=" + encode(token)
+        elif self._callback_pair:
+            pairs["oauth_callback"] = self._callback_pair
+        if additional_params:
+            encoded_keys = self._encoded_keys
+            for k, v in additional_params.iteritems():
+                encoded_key = encoded_keys.get(k)
+                if encoded_key is None:
+                    encoded_key = encoded_keys[k] = encode(k)
+                pairs[k] = "%s=%s" % (encoded_key, encode(v))
+
+        # Join all of the params together.
+        params_str = "&".join([pairs[k] for k in sorted(pairs)])
+
+        # Join the entire message together per the OAuth specification.
+        message = "&".join([method, self._encode_url(url), encode(params_str)])
+
+        signature = self._hmac(secret)
+        signature.update(message)
+        digest_base64 = binascii.b2a_base64(signature.digest())[:-1]
+        return "%s&oauth_signature=%s" % (params_str, encode(digest_base64))
+
+    def sign_many(self, requests):
+        """
+        Signs a list of requests, each a dictionary of `sign` keyword
+        arguments, and returns the payloads in the same order. All requests
+        share one timestamp unless they bring their own.
+        """
+        t = str(int(time()))
+        payloads = []
+        for request in requests:
+            if not request.get('t'):
+                request = dict(request, t=t)
+            payloads.append(self.sign(**request))
+        return payloads
+
+    def _hmac(self, secret):
+        base = self._hmacs.get(secret)
+        if base is None:
+            key = "%s&%s" % (self.consumer_secret, secret) # Note compulsory "&".
+            base = hmac(key, None, sha1)
+            self._hmacs.set(secret, base)
+        return base.copy()
+
+    def _encode_url(self, url):
+        encoded = self._urls.get(url)
+        if encoded is None:
+            encoded = encode(url)
+            self._urls.set(url, encoded)
+        return encoded
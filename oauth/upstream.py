@@ -0,0 +1,292 @@
+"""
+Deadlines, retries, hedging and circuit breaking for upstream calls.
+
+Every call made through OAuthClient.make_async_request goes through here:
+
+- its deadline follows the latency seen for its endpoint (host and API
+  method, e.g. api.dropbox.com/1/metadata): UPSTREAM_DEADLINE_FACTOR times
+  the p99 of the last UPSTREAM_LATENCY_WINDOW to 2 * UPSTREAM_LATENCY_WINDOW
+  successful calls, within UPSTREAM_DEADLINE_MIN and UPSTREAM_DEADLINE_MAX.
+  Until an endpoint has UPSTREAM_LATENCY_MIN_SAMPLES calls the maximum is
+  used.
+- GETs, which are idempotent, are retried up to UPSTREAM_RETRIES times
+  after failing or timing out, with full jitter backoff: a random pause of
+  up to UPSTREAM_BACKOFF * 2 ** attempt seconds. Retries stop once the call
+  would take longer than UPSTREAM_BUDGET seconds altogether. Other methods
+  are never retried.
+- metadata GETs are hedged if UPSTREAM_HEDGE is set. An RPC cannot be waited
+  for with a timeout, so the first attempt gets the p95 of the endpoint as
+  its deadline and the hedge replaces it when that passes, instead of
+  racing it.
+- every host has a circuit breaker. UPSTREAM_BREAKER_FAILURES failures in a
+  row open it. Failures are transport errors, timeouts and 500, 502 and 504
+  answers, and 503s without Retry-After. Dropbox answers a rate limited user
+  with a 503 with Retry-After and an account over its quota with a 507,
+  those are results for that user and go back to the caller as they are,
+  without retries. For UPSTREAM_BREAKER_COOLDOWN seconds after it opened,
+  calls to the host are answered with a 503 right away, which callers
+  treat like any other 503 from Dropbox (files.current_metadata serves the last known rev). Then
+  a single call is let through, its outcome closes or reopens the breaker.
+- calls to an endpoint over its quota.endpoints budget are answered with a
+  429 right away.
+
+Breakers and latencies are per instance.
+"""
+
+import random
+import threading
+import time
+import urlparse
+
+from google.appengine.api import urlfetch
+
+import config
+from metrics.registry import Histogram, registry
+import quota
+
+def endpoint(url):
+    """
+    The host and the first two path segments of `url`, which is the API
+    method for Dropbox URLs.
+    """
+    parts = urlparse.urlsplit(url)
+    return parts[1] + '/'.join(parts[2].split('/')[:3])
+
+class Latencies(object):
+    """
+    Recent latencies per endpoint, in two histograms of which the older one
+    is dropped whenever the newer one has UPSTREAM_LATENCY_WINDOW entries.
+    """
+
+    def __init__(self, window=config.UPSTREAM_LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, endpoint, seconds):
+        self._lock.acquire()
+        try:
+            histograms = self._histograms.get(endpoint)
+            if histograms is None or histograms[1].count >= self.window:
+                histograms = self._histograms[endpoint] = (histograms and histograms[1] or Histogram(), Histogram())
+            histograms[1].add(seconds * 1000)
+        finally:
+            self._lock.release()
+
+    def percentile(self, endpoint, fraction):
+        """
+        The `fraction` percentile of `endpoint` in seconds, None while there
+        are too few samples.
+        """
+        self._lock.acquire()
+        try:
+            histograms = self._histograms.get(endpoint)
+            if histograms is None:
+                return None
+            merged = Histogram()
+            for histogram in histograms:
+                merged.count += histogram.count
+                merged.max = max(merged.max, histogram.max)
+                for index, count in enumerate(histogram.counts):
+                    merged.counts[index] += count
+        finally:
+            self._lock.release()
+        if merged.count < config.UPSTREAM_LATENCY_MIN_SAMPLES:
+            return None
+        return merged.percentile(fraction) / 1000.0
+
+    def deadline(self, endpoint):
+        p99 = self.percentile(endpoint, 0.99)
+        if p99 is None:
+            return config.UPSTREAM_DEADLINE_MAX
+        return min(max(p99 * config.UPSTREAM_DEADLINE_FACTOR, config.UPSTREAM_DEADLINE_MIN),
+                   config.UPSTREAM_DEADLINE_MAX)
+
+    def hedge_delay(self, endpoint):
+        """
+        How long the first attempt of a hedged call gets, None if the
+        endpoint is not known well enough to hedge.
+        """
+        p95 = self.percentile(endpoint, 0.95)
+        if p95 is None:
+            return None
+        return max(p95, config.UPSTREAM_HEDGE_MIN)
+
+latencies = Latencies()
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+class CircuitBreaker(object):
+
+    def __init__(self, failures=config.UPSTREAM_BREAKER_FAILURES,
+                 cooldown=config.UPSTREAM_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        # host -> [state, failures in a row, opened or probed at]
+        self._hosts = {}
+
+    def allow(self, host):
+        """
+        Whether a call to `host` may be made now. After the cooldown only
+        the first caller gets to probe the host.
+        """
+        self._lock.acquire()
+        try:
+            state = self._hosts.get(host)
+            if state is None or state[0] == CLOSED:
+                return True
+            # a probe that never reported back is replaced after a cooldown
+            if time.time() - state[2] >= self.cooldown:
+                state[0], state[2] = HALF_OPEN, time.time()
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+    def succeeded(self, host):
+        self._lock.acquire()
+        try:
+            state = self._hosts.get(host)
+            if state is not None:
+                state[0], state[1] = CLOSED, 0
+        finally:
+            self._lock.release()
+
+    def failed(self, host):
+        self._lock.acquire()
+        try:
+            state = self._hosts.setdefault(host, [CLOSED, 0, 0])
+            state[1] += 1
+            if state[0] == HALF_OPEN or (state[0] == CLOSED and state[1] >= self.failures):
+                state[0], state[2] = OPEN, time.time()
+                registry.incr('circuit_opened', host)
+        finally:
+            self._lock.release()
+
+    def states(self):
+        self._lock.acquire()
+        try:
+            return dict([(host, state[0]) for host, state in self._hosts.items()])
+        finally:
+            self._lock.release()
+
+breaker = CircuitBreaker()
+
+def host_failed(result):
+    """
+    Whether an answer says something is wrong with the host rather than
+    with the request or its user.
+    """
+    if result.status_code in (500, 502, 504):
+        return True
+    return result.status_code == 503 and not (result.headers.get('Retry-After')
+                                               or result.headers.get('retry-after'))
+
+class Unavailable(object):
+    """
+    Stands in for the urlfetch result of a call that was not made, because
+    the breaker of its host is open (503) or its endpoint is over its quota
+    (429).
+    """
+
+    content = ''
+    content_was_truncated = False
+    final_url = None
+
+    def __init__(self, status_code=503, retry_after=None):
+        self.status_code = status_code
+        self.headers = {}
+        if retry_after:
+            self.headers['Retry-After'] = str(int(retry_after + 1))
+
+class UpstreamRPC(object):
+    """
+    What make_async_request returns, in place of the urlfetch RPC. Attempts
+    after the first are made while the caller waits for the result.
+    `start(deadline)` has to sign and start a fresh urlfetch RPC.
+    """
+
+    def __init__(self, start, url, method):
+        self._start = start
+        self.endpoint = endpoint(url)
+        self.host = urlparse.urlsplit(url)[1]
+        self.retries = method == urlfetch.GET and config.UPSTREAM_RETRIES or 0
+        self.hedge = (config.UPSTREAM_HEDGE and method == urlfetch.GET
+                      and self.endpoint.endswith('/metadata'))
+        self._result = None
+        self._error = None
+        self._done = False
+        self._rpc = None
+        if not breaker.allow(self.host):
+            registry.incr('circuit_rejected', self.host)
+            self._result = Unavailable()
+            self._done = True
+            return
+        wait = quota.endpoints.take(self.endpoint)
+        if wait:
+            self._result = Unavailable(429, wait)
+            self._done = True
+            return
+        self._first = time.time()
+        deadline = latencies.deadline(self.endpoint)
+        self._hedging = False
+        if self.hedge:
+            delay = latencies.hedge_delay(self.endpoint)
+            if delay is not None and delay < deadline:
+                deadline, self._hedging = delay, True
+        self._attempt(deadline)
+
+    def _attempt(self, deadline):
+        self._started = time.time()
+        self._rpc = self._start(deadline)
+
+    def wait(self):
+        self._finish()
+
+    def get_result(self):
+        self._finish()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _finish(self):
+        if self._done:
+            return
+        attempt = 0
+        while True:
+            try:
+                result = self._rpc.get_result()
+            except urlfetch.DeadlineExceededError, e:
+                if self._hedging:
+                    # not a failure of the host, the hedge takes over
+                    self._hedging = False
+                    registry.incr('upstream_hedged', self.endpoint)
+                    self._attempt(latencies.deadline(self.endpoint))
+                    continue
+                result, error = None, e
+            except urlfetch.Error, e:
+                result, error = None, e
+            else:
+                error = None
+            self._hedging = False
+            if error is None and not host_failed(result):
+                if result.status_code < 500:
+                    latencies.observe(self.endpoint, time.time() - self._started)
+                    breaker.succeeded(self.host)
+                self._result = result
+                break
+            breaker.failed(self.host)
+            attempt += 1
+            pause = random.uniform(0, config.UPSTREAM_BACKOFF * 2 ** attempt)
+            deadline = min(latencies.deadline(self.endpoint),
+                           config.UPSTREAM_BUDGET - (time.time() - self._first) - pause)
+            if (attempt > self.retries or deadline < config.UPSTREAM_DEADLINE_MIN
+                or not breaker.allow(self.host)):
+                self._result, self._error = result, error
+                break
+            registry.incr('upstream_retries', self.endpoint)
+            time.sleep(pause)
+            self._attempt(deadline)
+        self._done = True
+        self._rpc = None
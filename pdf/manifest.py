@@ -0,0 +1,275 @@
+"""
+Deck manifests: what a client needs to lay out a deck before it has the PDF.
+
+A manifest holds the page count, the size of every page in points (after
+/Rotate, as runs of equal sizes since most decks use one size throughout),
+the byte offset of every page object where the file has one, and the
+outline. It is extracted once per (path, rev), a rev never changes, and kept
+in an in-process LRU and memcache.
+
+    {"v": 1, "rev": "3b0f", "pages": 12,
+     "sizes": [[960.0, 540.0, 12]],
+     "offsets": [1093, 1754, ...],
+     "outline": [{"title": "Intro", "page": 1, "children": [...]}]}
+
+Pages in the outline are 1 based, like everywhere else in the app.
+"""
+
+import hashlib
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import memcache
+from django.utils import simplejson as json
+
+import config
+from cache import content
+from cache import lru
+from pdf import parser
+from proxy import files
+
+# bump when the format or the extraction changes, old entries are ignored then
+VERSION = 1
+
+# US letter, what readers assume for pages without a usable box
+DEFAULT_SIZE = (612.0, 792.0)
+
+class ManifestException(Exception):
+    pass
+
+def extract(data, rev=None):
+    """
+    Builds the manifest of the PDF in `data`.
+    """
+    try:
+        document = parser.Document(data)
+        catalog = document.get(document.trailer.get('Root'))
+        if not isinstance(catalog, dict):
+            raise ManifestException('No document catalog')
+        refs, sizes = pages(document, catalog)
+    except parser.PDFException, e:
+        raise ManifestException(str(e))
+    try:
+        outline = _outline(document, catalog, refs)
+    except (parser.PDFException, ValueError, TypeError, KeyError, IndexError), e:
+        # a broken outline is no reason to go without the rest
+        _logger.info('Ignoring the outline of %s: %s' % (rev, e))
+        outline = []
+    runs = []
+    for size in sizes:
+        if runs and runs[-1][:2] == list(size):
+            runs[-1][2] += 1
+        else:
+            runs.append([size[0], size[1], 1])
+    return {'v': VERSION,
+            'rev': rev,
+            'pages': len(refs),
+            'sizes': runs,
+            'offsets': [document.offset(ref) for ref in refs],
+            'outline': outline}
+
+def pages(document, catalog):
+    """
+    Walks the page tree in order, returns the page references and sizes.
+    """
+    refs = []
+    sizes = []
+    seen = set()
+    # (node, inherited attributes), the stack holds kids in reverse
+    stack = [(catalog.get('Pages'), {})]
+    while stack and len(refs) < config.MANIFEST_MAX_PAGES:
+        ref, inherited = stack.pop()
+        if isinstance(ref, parser.Ref):
+            if ref in seen:
+                continue
+            seen.add(ref)
+        node = document.get(ref)
+        if not isinstance(node, dict):
+            continue
+        attributes = dict(inherited)
+        for key in ('MediaBox', 'CropBox', 'Rotate'):
+            if key in node:
+                attributes[key] = node[key]
+        kids = document.get(node.get('Kids'))
+        if node.get('Type') == 'Pages' or (node.get('Type') != 'Page' and isinstance(kids, list)):
+            for kid in reversed(kids or []):
+                stack.append((kid, attributes))
+        elif isinstance(ref, parser.Ref):
+            refs.append(ref)
+            sizes.append(_size(document, attributes))
+    if not refs:
+        raise parser.PDFException('No pages')
+    return refs, sizes
+
+def _size(document, attributes):
+    box = _box(document, attributes.get('CropBox')) or _box(document, attributes.get('MediaBox'))
+    if box is None:
+        return DEFAULT_SIZE
+    width = round(abs(box[2] - box[0]), 2)
+    height = round(abs(box[3] - box[1]), 2)
+    rotate = document.get(attributes.get('Rotate')) or 0
+    if isinstance(rotate, (int, float)) and int(rotate) % 180 == 90:
+        width, height = height, width
+    return (width, height)
+
+def _box(document, value):
+    box = document.get(value)
+    if not isinstance(box, list) or len(box) != 4:
+        return None
+    box = [document.get(number) for number in box]
+    for number in box:
+        if not isinstance(number, (int, float)) or isinstance(number, bool):
+            return None
+    if box[0] == box[2] or box[1] == box[3]:
+        return None
+    return box
+
+def _outline(document, catalog, refs):
+    pages = dict([(ref.num, index + 1) for index, ref in enumerate(refs)])
+    outlines = document.get(catalog.get('Outlines'))
+    if not isinstance(outlines, dict):
+        return []
+    seen = set()
+    budget = [config.MANIFEST_MAX_OUTLINE]
+
+    def items(ref, depth):
+        found = []
+        while isinstance(ref, parser.Ref) and ref not in seen and budget[0] > 0 and depth < 16:
+            seen.add(ref)
+            budget[0] -= 1
+            item = document.get(ref)
+            if not isinstance(item, dict):
+                break
+            entry = {'title': _text(document.get(item.get('Title'))),
+                     'page': _destination_page(document, catalog, item, pages)}
+            children = items(item.get('First'), depth + 1)
+            if children:
+                entry['children'] = children
+            found.append(entry)
+            ref = item.get('Next')
+        return found
+
+    return items(outlines.get('First'), 0)
+
+def _destination_page(document, catalog, item, pages):
+    destination = document.get(item.get('Dest'))
+    if destination is None:
+        action = document.get(item.get('A'))
+        if isinstance(action, dict) and action.get('S') == 'GoTo':
+            destination = document.get(action.get('D'))
+    if isinstance(destination, str):
+        destination = _named_destination(document, catalog, destination)
+    if isinstance(destination, dict):
+        destination = document.get(destination.get('D'))
+    if isinstance(destination, list) and destination:
+        target = destination[0]
+        if isinstance(target, parser.Ref):
+            return pages.get(target.num)
+    return None
+
+def _named_destination(document, catalog, name):
+    if isinstance(name, parser.Name):
+        # PDF 1.1 style, a dictionary in the catalog
+        dests = document.get(catalog.get('Dests'))
+        if isinstance(dests, dict):
+            return document.get(dests.get(name))
+        return None
+    names = document.get(catalog.get('Names'))
+    if not isinstance(names, dict):
+        return None
+    # a name tree, the kids of each node are sorted and carry their /Limits
+    node = document.get(names.get('Dests'))
+    for depth in xrange(parser.MAX_DEPTH):
+        if not isinstance(node, dict):
+            return None
+        leaves = document.get(node.get('Names'))
+        if isinstance(leaves, list):
+            for i in xrange(0, len(leaves) - 1, 2):
+                if document.get(leaves[i]) == name:
+                    return document.get(leaves[i + 1])
+            return None
+        following = None
+        for kid in document.get(node.get('Kids')) or []:
+            kid = document.get(kid)
+            limits = isinstance(kid, dict) and document.get(kid.get('Limits'))
+            if not limits or document.get(limits[0]) <= name <= document.get(limits[1]):
+                following = kid
+                break
+        node = following
+    return None
+
+def _text(value):
+    """
+    Decodes a PDF text string, UTF-16 with a byte order mark or else
+    PDFDocEncoding, which is Latin-1 for everything that shows up in titles.
+    """
+    if not isinstance(value, str):
+        return u''
+    if value.startswith('\xfe\xff'):
+        return value[2:].decode('utf-16-be', 'replace')
+    if value.startswith('\xff\xfe'):
+        return value[2:].decode('utf-16-le', 'replace')
+    return value.decode('latin-1')
+
+def dumps(manifest):
+    return json.dumps(manifest, separators=(',', ':'))
+
+class ManifestCache(object):
+
+    def __init__(self, namespace='manifest', local_entries=config.MANIFEST_CACHE_LOCAL_ENTRIES):
+        self.namespace = namespace
+        self.local = lru.LRUCache(local_entries)
+
+    def get(self, owner, path, rev):
+        """
+        Returns the manifest of `path` at `rev` as a JSON string, or None.
+        """
+        key = self._key(owner, path, rev)
+        manifest = self.local.get(key)
+        if manifest is None:
+            manifest = memcache.get(key, namespace=self.namespace)
+            if manifest is not None:
+                self.local.set(key, manifest)
+        return manifest
+
+    def set(self, owner, path, rev, manifest):
+        key = self._key(owner, path, rev)
+        self.local.set(key, manifest)
+        memcache.set(key, manifest, namespace=self.namespace)
+
+    def _key(self, owner, path, rev):
+        if isinstance(path, unicode):
+            path = path.encode('utf8')
+        return hashlib.sha1('%s:%s:%s:%d' % (owner, path, rev, VERSION)).hexdigest()
+
+manifest_cache = ManifestCache()
+
+def load(client, dropbox_credentials, owner, path, metadata=None):
+    """
+    Returns a (metadata, manifest) tuple for the current rev of `path`, the
+    manifest as a JSON string. Decks too big for the content cache have no
+    manifest, fetching all of them at once would run into the fetch size
+    and deadline limits.
+    """
+    if metadata is None:
+        metadata = files.current_metadata(client, dropbox_credentials, owner, path)
+    manifest = manifest_cache.get(owner, path, metadata.get('rev'))
+    if manifest is not None:
+        return (metadata, manifest)
+    metadata, body = files.load(client, dropbox_credentials, owner, path, metadata)
+    if body is None:
+        raise ManifestException('%d bytes are too many to extract a manifest from' % metadata.get('bytes', 0))
+    manifest = dumps(extract(body, metadata.get('rev')))
+    manifest_cache.set(owner, path, metadata.get('rev'), manifest)
+    return (metadata, manifest)
+
+def cached(owner, path):
+    """
+    The manifest of the rev of `path` seen last as a JSON string, if the
+    caches have both, None otherwise.
+    """
+    metadata = content.file_cache.get_revision(owner, path)
+    if metadata is None:
+        return None
+    return manifest_cache.get(owner, path, metadata.get('rev'))
@@ -0,0 +1,457 @@
+"""
+A minimal PDF object reader.
+
+Just enough of the file structure to walk the document catalog: the cross
+reference table (classic tables as well as the compressed streams of PDF
+1.5), indirect objects, object streams and Flate encoded streams with PNG
+predictors. Page contents are never decoded. Files whose cross reference
+data is broken are read by scanning for `n g obj` headers instead, the way
+viewers recover them.
+
+Names are returned as `Name`, strings as plain str, references as `Ref`
+and streams as `Stream`, a dictionary with the raw data attached.
+"""
+
+import re
+import zlib
+
+WHITESPACE = '\x00\t\n\x0c\r '
+
+_NUMBER = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)')
+_REGULAR = re.compile(r'[^\x00\t\n\x0c\r ()<>\[\]{}/%]+')
+_OBJECT_HEADER = re.compile(r'(\d+)\s+(\d+)\s+obj\b')
+_STARTXREF = re.compile(r'startxref\s+(\d+)')
+_REFERENCE = re.compile(r'(\d+)\s+R\b')
+_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', 'b': '\b', 'f': '\f',
+            '(': '(', ')': ')', '\\': '\\'}
+
+# how deep references are followed before giving up on a cycle
+MAX_DEPTH = 32
+
+class PDFException(Exception):
+    pass
+
+class Name(str):
+    pass
+
+class Keyword(str):
+    pass
+
+class Ref(object):
+
+    def __init__(self, num, gen):
+        self.num = num
+        self.gen = gen
+
+    def __eq__(self, other):
+        return isinstance(other, Ref) and self.num == other.num and self.gen == other.gen
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.num, self.gen))
+
+    def __repr__(self):
+        return '%d %d R' % (self.num, self.gen)
+
+class Stream(dict):
+
+    def __init__(self, attributes, raw):
+        dict.__init__(self, attributes)
+        self.raw = raw
+
+class Lexer(object):
+    """
+    Reads objects from `data`, starting at `pos`.
+    """
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def skip_whitespace(self):
+        data = self.data
+        length = len(data)
+        while self.pos < length:
+            char = data[self.pos]
+            if char in WHITESPACE:
+                self.pos += 1
+            elif char == '%':
+                while self.pos < length and data[self.pos] not in '\r\n':
+                    self.pos += 1
+            else:
+                break
+
+    def read_object(self):
+        self.skip_whitespace()
+        data = self.data
+        if self.pos >= len(data):
+            raise PDFException('Unexpected end of file')
+        char = data[self.pos]
+        if data.startswith('<<', self.pos):
+            return self._read_dictionary()
+        if char == '[':
+            self.pos += 1
+            items = []
+            while True:
+                self.skip_whitespace()
+                if data.startswith(']', self.pos):
+                    self.pos += 1
+                    return items
+                items.append(self.read_object())
+        if char == '(':
+            return self._read_literal_string()
+        if char == '<':
+            end = data.find('>', self.pos)
+            if end < 0:
+                raise PDFException('Unterminated hex string at %d' % self.pos)
+            digits = re.sub(r'[^0-9A-Fa-f]', '', data[self.pos + 1:end])
+            self.pos = end + 1
+            if len(digits) % 2:
+                digits += '0'
+            return digits.decode('hex')
+        if char == '/':
+            self.pos += 1
+            match = _REGULAR.match(data, self.pos)
+            if match is None:
+                return Name('')
+            self.pos = match.end()
+            return Name(re.sub(r'#([0-9A-Fa-f]{2})', lambda m: chr(int(m.group(1), 16)), match.group(0)))
+        match = _NUMBER.match(data, self.pos)
+        if match:
+            self.pos = match.end()
+            text = match.group(0)
+            if '.' in text:
+                return float(text)
+            number = int(text)
+            # `n g R` is a reference, look ahead without consuming otherwise
+            start = self.pos
+            self.skip_whitespace()
+            generation = _REFERENCE.match(data, self.pos)
+            if generation and number >= 0:
+                self.pos = generation.end()
+                return Ref(number, int(generation.group(1)))
+            self.pos = start
+            return number
+        match = _REGULAR.match(data, self.pos)
+        if match is None:
+            raise PDFException('Unexpected %r at %d' % (char, self.pos))
+        self.pos = match.end()
+        word = match.group(0)
+        if word == 'true':
+            return True
+        if word == 'false':
+            return False
+        if word == 'null':
+            return None
+        return Keyword(word)
+
+    def _read_dictionary(self):
+        self.pos += 2
+        attributes = {}
+        data = self.data
+        while True:
+            self.skip_whitespace()
+            if data.startswith('>>', self.pos):
+                self.pos += 2
+                return attributes
+            key = self.read_object()
+            value = self.read_object()
+            if isinstance(key, Name):
+                attributes[key] = value
+
+    def _read_literal_string(self):
+        data = self.data
+        pos = self.pos + 1
+        depth = 1
+        parts = []
+        while pos < len(data):
+            char = data[pos]
+            if char == '\\':
+                following = data[pos + 1:pos + 2]
+                if following in _ESCAPES:
+                    parts.append(_ESCAPES[following])
+                    pos += 2
+                elif following in '01234567' and following:
+                    digits = re.match(r'[0-7]{1,3}', data[pos + 1:pos + 4]).group(0)
+                    parts.append(chr(int(digits, 8) & 0xff))
+                    pos += 1 + len(digits)
+                elif following == '\r':
+                    pos += data.startswith('\r\n', pos + 1) and 3 or 2
+                else:
+                    # a line continuation, or a backslash before a plain char
+                    pos += 2
+                    if following != '\n':
+                        parts.append(following)
+                continue
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth == 0:
+                    self.pos = pos + 1
+                    return ''.join(parts)
+            parts.append(char)
+            pos += 1
+        raise PDFException('Unterminated string at %d' % self.pos)
+
+class Document(object):
+    """
+    The objects of a PDF file held in `data`.
+    """
+
+    def __init__(self, data):
+        if not data.startswith('%PDF-') and data.find('%PDF-', 0, 1024) < 0:
+            raise PDFException('Not a PDF file')
+        self.data = data
+        # object number -> byte offset, or (object stream number, index)
+        self.offsets = {}
+        self.compressed = {}
+        self.trailer = {}
+        self._cache = {}
+        self._object_streams = {}
+        try:
+            self._read_xref()
+        except (PDFException, ValueError, TypeError, IndexError, zlib.error):
+            self._scan()
+        if 'Root' not in self.trailer:
+            self._scan()
+
+    def get(self, value, depth=0):
+        """
+        Follows `value` if it is a reference, returns it unchanged otherwise.
+        Unknown or broken objects resolve to None.
+        """
+        while isinstance(value, Ref):
+            if depth > MAX_DEPTH:
+                return None
+            value = self.object(value.num)
+            depth += 1
+        return value
+
+    def object(self, num):
+        if num in self._cache:
+            return self._cache[num]
+        value = None
+        try:
+            if num in self.offsets:
+                value = self._read_indirect(self.offsets[num], num)
+            elif num in self.compressed:
+                value = self._read_compressed(*self.compressed[num])
+        except (PDFException, ValueError, TypeError, IndexError, zlib.error):
+            value = None
+        self._cache[num] = value
+        return value
+
+    def offset(self, ref):
+        """
+        The byte offset of the object `ref` points at, None for objects in
+        object streams.
+        """
+        return self.offsets.get(ref.num)
+
+    def decode(self, stream):
+        """
+        Returns the decoded data of `stream`, for the filters cross reference
+        and object streams use.
+        """
+        filters = self.get(stream.get('Filter'))
+        params = self.get(stream.get('DecodeParms'))
+        if not isinstance(filters, list):
+            filters = filters and [filters] or []
+            params = [params]
+        elif not isinstance(params, list):
+            params = [params] * len(filters)
+        data = stream.raw
+        for name, param in zip(filters, params):
+            name = self.get(name)
+            param = self.get(param) or {}
+            if name != 'FlateDecode':
+                raise PDFException('Unsupported filter %s' % name)
+            data = zlib.decompress(data)
+            predictor = self.get(param.get('Predictor')) or 1
+            if predictor >= 10:
+                data = _png_unpredict(data, self.get(param.get('Columns')) or 1,
+                                      self.get(param.get('Colors')) or 1,
+                                      self.get(param.get('BitsPerComponent')) or 8)
+            elif predictor != 1:
+                raise PDFException('Unsupported predictor %s' % predictor)
+        return data
+
+    def _read_xref(self):
+        matches = list(_STARTXREF.finditer(self.data, max(len(self.data) - 2048, 0)))
+        if not matches:
+            raise PDFException('No startxref')
+        pos = int(matches[-1].group(1))
+        seen = set()
+        while pos is not None and pos not in seen:
+            seen.add(pos)
+            if self.data.startswith('xref', pos):
+                trailer = self._read_xref_table(pos + 4)
+            else:
+                trailer = self._read_xref_stream(pos)
+            for key, value in trailer.items():
+                # the newest section wins, and it comes first
+                self.trailer.setdefault(key, value)
+            if 'XRefStm' in trailer:
+                self._read_xref_stream(trailer['XRefStm'])
+            pos = trailer.get('Prev')
+
+    def _read_xref_table(self, pos):
+        lexer = Lexer(self.data, pos)
+        while True:
+            lexer.skip_whitespace()
+            if self.data.startswith('trailer', lexer.pos):
+                lexer.pos += len('trailer')
+                return lexer.read_object()
+            first = lexer.read_object()
+            count = lexer.read_object()
+            lexer.skip_whitespace()
+            for i in xrange(count):
+                entry = self.data[lexer.pos:lexer.pos + 20]
+                offset, generation, kind = entry[:10], entry[11:16], entry[17:18]
+                if kind == 'n':
+                    self.offsets.setdefault(first + i, int(offset))
+                elif kind != 'f':
+                    raise PDFException('Bad xref entry %r' % entry)
+                lexer.pos += 20
+                lexer.skip_whitespace()
+
+    def _read_xref_stream(self, pos):
+        stream = self._read_indirect(pos)
+        if not isinstance(stream, Stream) or stream.get('Type') != 'XRef':
+            raise PDFException('No cross reference stream at %d' % pos)
+        widths = stream['W']
+        size = stream['Size']
+        index = stream.get('Index') or [0, size]
+        data = self.decode(stream)
+        row = sum(widths)
+        pos = 0
+        for start, count in zip(index[::2], index[1::2]):
+            for num in xrange(start, start + count):
+                fields = []
+                for width in widths:
+                    value = 0
+                    for char in data[pos:pos + width]:
+                        value = (value << 8) | ord(char)
+                    fields.append(value)
+                    pos += width
+                kind = 1
+                if widths[0]:
+                    kind = fields[0]
+                if num in self.offsets or num in self.compressed:
+                    continue
+                if kind == 1:
+                    self.offsets[num] = fields[1]
+                elif kind == 2:
+                    self.compressed[num] = (fields[1], fields[2])
+        return stream
+
+    def _scan(self):
+        self.offsets = {}
+        self.compressed = {}
+        self._cache = {}
+        for match in _OBJECT_HEADER.finditer(self.data):
+            self.offsets[int(match.group(1))] = match.start()
+        for num in self.offsets.keys():
+            value = self.object(num)
+            if isinstance(value, Stream):
+                if value.get('Type') == 'ObjStm':
+                    try:
+                        for index, inner in enumerate(self._object_stream(num)[0]):
+                            self.compressed.setdefault(inner, (num, index))
+                    except (PDFException, ValueError, TypeError, IndexError, zlib.error):
+                        pass
+                elif value.get('Type') == 'XRef' and 'Root' in value:
+                    self.trailer.update(value)
+        trailer = self.data.rfind('trailer')
+        if trailer >= 0 and 'Root' not in self.trailer:
+            try:
+                self.trailer.update(Lexer(self.data, trailer + len('trailer')).read_object())
+            except PDFException:
+                pass
+        if 'Root' not in self.trailer:
+            for num in sorted(self.offsets):
+                value = self.object(num)
+                if isinstance(value, dict) and value.get('Type') == 'Catalog':
+                    self.trailer['Root'] = Ref(num, 0)
+                    break
+        self._cache = {}
+
+    def _read_indirect(self, pos, num=None):
+        match = _OBJECT_HEADER.match(self.data, pos)
+        if match is None or (num is not None and int(match.group(1)) != num):
+            raise PDFException('No object %s at %d' % (num, pos))
+        lexer = Lexer(self.data, match.end())
+        value = lexer.read_object()
+        lexer.skip_whitespace()
+        if isinstance(value, dict) and self.data.startswith('stream', lexer.pos):
+            start = lexer.pos + len('stream')
+            if self.data.startswith('\r\n', start):
+                start += 2
+            elif self.data[start:start + 1] in '\r\n':
+                start += 1
+            length = value.get('Length')
+            if isinstance(length, Ref):
+                length = self.object(length.num)
+            end = isinstance(length, int) and start + length or -1
+            if end < 0 or self.data.find('endstream', end, end + 32) < 0:
+                # a wrong or missing /Length, trust the keyword instead
+                end = self.data.find('endstream', start)
+                if end < 0:
+                    raise PDFException('Unterminated stream at %d' % pos)
+            value = Stream(value, self.data[start:end])
+        return value
+
+    def _object_stream(self, num):
+        if num not in self._object_streams:
+            stream = self.object(num)
+            if not isinstance(stream, Stream):
+                raise PDFException('No object stream %d' % num)
+            data = self.decode(stream)
+            first = self.get(stream['First'])
+            lexer = Lexer(data[:first])
+            numbers = []
+            offsets = []
+            for i in xrange(self.get(stream['N'])):
+                numbers.append(lexer.read_object())
+                offsets.append(first + lexer.read_object())
+            self._object_streams[num] = (numbers, offsets, data)
+        return self._object_streams[num]
+
+    def _read_compressed(self, stream_num, index):
+        numbers, offsets, data = self._object_stream(stream_num)
+        return Lexer(data, offsets[index]).read_object()
+
+def _png_unpredict(data, columns, colors, bits):
+    pixel = max(colors * bits / 8, 1)
+    row_length = (columns * colors * bits + 7) / 8
+    previous = [0] * row_length
+    rows = []
+    for pos in xrange(0, len(data), row_length + 1):
+        kind = ord(data[pos])
+        row = [ord(char) for char in data[pos + 1:pos + 1 + row_length]]
+        row.extend([0] * (row_length - len(row)))
+        for i in xrange(row_length):
+            left = i >= pixel and row[i - pixel] or 0
+            up = previous[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xff
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xff
+            elif kind == 3:
+                row[i] = (row[i] + (left + up) / 2) & 0xff
+            elif kind == 4:
+                upper_left = i >= pixel and previous[i - pixel] or 0
+                estimate = left + up - upper_left
+                distances = (abs(estimate - left), abs(estimate - up), abs(estimate - upper_left))
+                if distances[0] <= distances[1] and distances[0] <= distances[2]:
+                    row[i] = (row[i] + left) & 0xff
+                elif distances[1] <= distances[2]:
+                    row[i] = (row[i] + up) & 0xff
+                else:
+                    row[i] = (row[i] + upper_left) & 0xff
+        rows.append(''.join([chr(value) for value in row]))
+        previous = row
+    return ''.join(rows)
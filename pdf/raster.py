@@ -0,0 +1,212 @@
+"""
+Server side rendering of deck pages to images.
+
+Pages are rasterized with poppler's `pdftoppm` in a pool of worker processes,
+at the widths of a fixed ladder (RASTER_WIDTHS) so every client size maps
+onto a handful of cacheable images. Rendered images are kept in a byte
+bounded in-process LRU and in memcache, keyed by (owner, path, rev, page,
+width, format).
+
+This needs `multiprocessing`, `subprocess` and a pdftoppm binary, none of
+which exist on the App Engine python runtime, so it is only switched on with
+IMAGE_MODE on hosts that have them. WebP output additionally needs PIL built
+with WebP support, PNG is used otherwise.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import logging
+_logger = logging.getLogger(__name__)
+
+try:
+    import multiprocessing
+    import subprocess
+except ImportError:
+    multiprocessing = None
+    subprocess = None
+
+from google.appengine.api import memcache
+
+import config
+from cache import lru
+
+MIME_TYPES = {'png': 'image/png',
+              'webp': 'image/webp'}
+
+# memcache refuses items of 1 MB and more
+_MEMCACHE_MAX_ITEM = 1000 * 1000
+
+class RasterException(Exception):
+    pass
+class PageNotFoundException(RasterException):
+    pass
+
+def available():
+    return bool(config.IMAGE_MODE and multiprocessing is not None)
+
+# PIL's Image module once imported, None if there is no PIL
+_Image = False
+
+def _image():
+    """
+    PIL's Image module or None. PIL takes a while to import and is only
+    needed for WebP, so that waits until the first WebP request.
+    """
+    global _Image
+    if _Image is False:
+        try:
+            from PIL import Image
+        except ImportError:
+            Image = None
+        _Image = Image
+    return _Image
+
+def webp_available():
+    if _image() is None:
+        return False
+    try:
+        from PIL import features
+        return features.check('webp')
+    except ImportError:
+        return False
+
+def nearest_width(width):
+    """
+    Picks the smallest ladder width not narrower than `width`, or the widest
+    one if `width` is larger than all of them.
+    """
+    ladder = sorted(config.RASTER_WIDTHS)
+    for candidate in ladder:
+        if candidate >= width:
+            return candidate
+    return ladder[-1]
+
+def rasterize(pdf_file, page, width, fmt):
+    """
+    Renders one page of `pdf_file`. Runs in a worker process.
+    """
+    workdir = tempfile.mkdtemp(prefix='raster')
+    try:
+        root = os.path.join(workdir, 'page')
+        code = subprocess.call([config.RASTER_PDFTOPPM,
+                                '-f', str(page), '-l', str(page),
+                                '-singlefile', '-png',
+                                '-scale-to-x', str(width), '-scale-to-y', '-1',
+                                pdf_file, root])
+        output = root + '.png'
+        if code != 0 or not os.path.exists(output):
+            # pdftoppm exits with 99 for pages beyond the end of the deck
+            return None
+        if fmt == 'webp':
+            image = _image().open(output)
+            output = root + '.webp'
+            image.save(output, 'WEBP', quality=config.RASTER_WEBP_QUALITY)
+        f = open(output, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+    finally:
+        shutil.rmtree(workdir, True)
+
+class Renderer(object):
+
+    def __init__(self, workers=config.RASTER_WORKERS,
+                 cache_bytes=config.RASTER_CACHE_BYTES,
+                 spool_bytes=config.RASTER_SPOOL_BYTES,
+                 namespace='raster'):
+        self.workers = workers
+        self.namespace = namespace
+        self.images = lru.LRUCache(cache_bytes, sizeof=len)
+        # decks handed to the workers live on disk, the oldest get removed
+        self.spooled = lru.LRUCache(spool_bytes, sizeof=os.path.getsize,
+                                    on_evict=_remove_spooled)
+        self.spool_dir = None
+        self._pool = None
+
+    def render(self, owner, path, rev, body, page, width, fmt='png'):
+        """
+        Returns the image bytes for `page` of the deck at `path`/`rev`, whose
+        content is `body`. `width` is snapped to the ladder first.
+        """
+        width = nearest_width(width)
+        key = self._key(owner, path, rev, page, width, fmt)
+        image = self.get(key)
+        if image is not None:
+            return image
+        pdf_file, spooled = self._spool(owner, path, rev, body)
+        try:
+            pending = self._get_pool().apply_async(rasterize, (pdf_file, page, width, fmt))
+            try:
+                image = pending.get(config.RASTER_TIMEOUT)
+            except multiprocessing.TimeoutError:
+                raise RasterException('Rendering page %d of %s timed out' % (page, path))
+        finally:
+            if not spooled:
+                _remove_spooled(pdf_file, pdf_file)
+        if image is None:
+            raise PageNotFoundException('No page %d in %s' % (page, path))
+        self.images.set(key, image)
+        if len(image) < _MEMCACHE_MAX_ITEM:
+            memcache.set(key, image, namespace=self.namespace)
+        return image
+
+    def get(self, key):
+        image = self.images.get(key)
+        if image is None:
+            image = memcache.get(key, namespace=self.namespace)
+            if image is not None:
+                self.images.set(key, image)
+        return image
+
+    def _key(self, owner, path, rev, page, width, fmt):
+        if isinstance(path, unicode):
+            path = path.encode('utf8')
+        return hashlib.sha1('%s:%s:%s:%d:%d:%s' % (owner, path, rev, page, width, fmt)).hexdigest()
+
+    def _spool(self, owner, path, rev, body):
+        """
+        Writes `body` to a file for the workers. Returns its name and whether
+        it is kept in the spool, a deck too big for RASTER_SPOOL_BYTES gets a
+        file of its own that the caller removes.
+        """
+        if self.spool_dir is None:
+            self.spool_dir = tempfile.mkdtemp(prefix='spool')
+        if len(body) > self.spooled.max_size:
+            fd, pdf_file = tempfile.mkstemp(suffix='.pdf', dir=self.spool_dir)
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(body)
+            finally:
+                f.close()
+            return (pdf_file, False)
+        if isinstance(path, unicode):
+            path = path.encode('utf8')
+        name = hashlib.sha1('%s:%s:%s' % (owner, path, rev)).hexdigest() + '.pdf'
+        pdf_file = os.path.join(self.spool_dir, name)
+        if self.spooled.get(pdf_file) is None or not os.path.exists(pdf_file):
+            partial = pdf_file + '.part'
+            f = open(partial, 'wb')
+            try:
+                f.write(body)
+            finally:
+                f.close()
+            os.rename(partial, pdf_file)
+            self.spooled.set(pdf_file, pdf_file)
+        return (pdf_file, True)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+        return self._pool
+
+def _remove_spooled(key, pdf_file):
+    try:
+        os.remove(pdf_file)
+    except OSError:
+        pass
+
+renderer = Renderer()
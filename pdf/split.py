@@ -0,0 +1,288 @@
+"""
+Single page PDFs cut out of a deck, so the presenter can show the first
+slide without waiting for the whole file.
+
+A deck is parsed once per (owner, path, rev): the cross reference data, the
+page tree and, as pages get cut, the objects they are made of. Decks are
+kept in an in-process LRU bounded by SPLIT_DECK_BYTES. A page PDF holds the
+page with its inherited attributes, a new catalog and page tree, and every
+object the page refers to directly or indirectly. References to other
+pages, e.g. from link annotations, become null, so nothing of the rest of
+the deck comes along.
+
+Objects keep their numbers, so an object shared by many pages, like a font
+or a logo, is serialized once per deck and the bytes are reused for every
+page that needs it. Stream data is copied unchanged and never decoded.
+
+The cut pages are kept in a byte bounded LRU and memcache, keyed by (owner,
+path, rev, page), so the deck only has to be loaded for pages no instance
+has cut yet.
+
+Only decks that files.load fetches whole, up to
+CONTENT_CACHE_MAX_ITEM_BYTES, can be split. Bigger ones have no manifest
+either, so the presenter loads them from /file as before.
+"""
+
+import hashlib
+import threading
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import memcache
+
+import config
+from cache import lru
+from pdf import manifest
+from pdf import parser
+
+NAMESPACE = 'split'
+
+# memcache refuses items of 1 MB and more
+_MEMCACHE_MAX_ITEM = 1000 * 1000
+
+_HEADER = '%PDF-1.7\n%\xe2\xe3\xcf\xd3\n'
+_INHERITED = ('Resources', 'MediaBox', 'CropBox', 'Rotate')
+# characters that have to be written as #xx in names
+_NAME_ESCAPES = frozenset('()<>[]{}/%#')
+
+class SplitException(Exception):
+    pass
+class PageNotFoundException(SplitException):
+    pass
+
+class Deck(object):
+    """
+    A parsed deck that pages are cut out of.
+    """
+
+    def __init__(self, data):
+        try:
+            self.document = parser.Document(data)
+            if 'Encrypt' in self.document.trailer:
+                raise SplitException('Encrypted documents cannot be split')
+            catalog = self.document.get(self.document.trailer.get('Root'))
+            if not isinstance(catalog, dict):
+                raise SplitException('No document catalog')
+            self.refs, sizes = manifest.pages(self.document, catalog)
+        except parser.PDFException, e:
+            raise SplitException(str(e))
+        numbers = self.document.offsets.keys() + self.document.compressed.keys()
+        # the new catalog and page tree go after all objects of the deck
+        self._catalog = max(numbers) + 1
+        self._tree = self._catalog + 1
+        # object number -> serialized object, for those that do not refer to
+        # pages and so come out the same for every page
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def page(self, n):
+        """
+        The single page PDF of page `n`, 1 based.
+        """
+        if not 1 <= n <= len(self.refs):
+            raise PageNotFoundException('No page %d' % n)
+        ref = self.refs[n - 1]
+        page = self.document.get(ref)
+        if not isinstance(page, dict):
+            raise PageNotFoundException('Page %d cannot be read' % n)
+        attributes = dict(page)
+        for key in _INHERITED:
+            if key not in attributes:
+                value = self._inherited(page, key)
+                if value is not None:
+                    attributes[key] = value
+        attributes['Parent'] = parser.Ref(self._tree, 0)
+
+        objects = self._objects_of(ref, attributes)
+        kept = dict([(num, gen) for num, gen, value in objects])
+        kept[ref.num] = ref.gen
+        out = [_HEADER]
+        # (number, generation, offset)
+        entries = []
+        position = len(_HEADER)
+        for num, gen, value in [(ref.num, ref.gen, None)] + objects:
+            if num == ref.num:
+                body = self._serialize_object(attributes, kept)
+            else:
+                body = self._cached_object(num, value, kept)
+            text = '%d %d obj\n%s\nendobj\n' % (num, gen, body)
+            entries.append((num, gen, position))
+            out.append(text)
+            position += len(text)
+        for num, body in ((self._catalog, '<</Type/Catalog/Pages %d 0 R>>' % self._tree),
+                          (self._tree, '<</Type/Pages/Kids[%d %d R]/Count 1>>' % (ref.num, ref.gen))):
+            text = '%d 0 obj\n%s\nendobj\n' % (num, body)
+            entries.append((num, 0, position))
+            out.append(text)
+            position += len(text)
+        out.append(_xref(entries))
+        out.append('trailer\n<</Size %d/Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n'
+                   % (self._tree + 1, self._catalog, position))
+        return ''.join(out)
+
+    def _inherited(self, page, key):
+        node = self.document.get(page.get('Parent'))
+        for depth in xrange(parser.MAX_DEPTH):
+            if not isinstance(node, dict):
+                return None
+            if key in node:
+                return node[key]
+            node = self.document.get(node.get('Parent'))
+        return None
+
+    def _objects_of(self, ref, attributes):
+        """
+        The objects the page needs, as (number, generation, value), leaving
+        out other pages and the page tree.
+        """
+        found = []
+        seen = set([ref.num])
+        pending = list(_references(attributes))
+        while pending:
+            target = pending.pop()
+            if target.num in seen:
+                continue
+            seen.add(target.num)
+            value = self.document.object(target.num)
+            if value is None or _is_page_node(value):
+                continue
+            found.append((target.num, target.gen, value))
+            pending.extend(_references(value))
+        found.sort()
+        return found
+
+    def _cached_object(self, num, value, kept):
+        self._lock.acquire()
+        try:
+            body = self._objects.get(num)
+        finally:
+            self._lock.release()
+        if body is None:
+            pages = []
+            body = self._serialize_object(value, kept, pages)
+            if not pages:
+                self._lock.acquire()
+                try:
+                    self._objects[num] = body
+                finally:
+                    self._lock.release()
+        return body
+
+    def _serialize_object(self, value, kept, pages=None):
+        """
+        Serializes an object, references to objects not in `kept` become
+        null. References to page tree nodes are added to `pages`.
+        """
+        def reference(target):
+            if pages is not None and _is_page_node(self.document.object(target.num)):
+                pages.append(target)
+            if target.num in kept:
+                return '%d %d R' % (target.num, target.gen)
+            return 'null'
+        if isinstance(value, parser.Stream):
+            attributes = dict(value)
+            attributes['Length'] = len(value.raw)
+            return '%s\nstream\n%s\nendstream' % (_serialize(attributes, reference), value.raw)
+        return _serialize(value, reference)
+
+def _is_page_node(value):
+    return isinstance(value, dict) and value.get('Type') in ('Page', 'Pages')
+
+def _references(value):
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, parser.Ref):
+            yield value
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+def _serialize(value, reference):
+    if isinstance(value, parser.Ref):
+        return reference(value)
+    if isinstance(value, parser.Name):
+        return '/' + _name(value)
+    if isinstance(value, parser.Keyword):
+        return str(value)
+    if isinstance(value, str):
+        return '<%s>' % value.encode('hex')
+    if isinstance(value, bool):
+        return value and 'true' or 'false'
+    if isinstance(value, (int, long)):
+        return str(value)
+    if isinstance(value, float):
+        return ('%.6f' % value).rstrip('0').rstrip('.')
+    if isinstance(value, list):
+        return '[%s]' % ' '.join([_serialize(item, reference) for item in value])
+    if isinstance(value, dict):
+        return '<<%s>>' % ''.join(['/%s %s' % (_name(key), _serialize(item, reference))
+                                   for key, item in value.items()])
+    return 'null'
+
+def _name(name):
+    return ''.join([(char in _NAME_ESCAPES or not '!' <= char <= '~') and '#%02X' % ord(char) or char
+                    for char in name])
+
+def _xref(entries):
+    """
+    A cross reference table with a subsection for every run of consecutive
+    object numbers.
+    """
+    entries = sorted(entries)
+    lines = ['xref\n0 1\n0000000000 65535 f \n']
+    start = 0
+    while start < len(entries):
+        end = start + 1
+        while end < len(entries) and entries[end][0] == entries[end - 1][0] + 1:
+            end += 1
+        lines.append('%d %d\n' % (entries[start][0], end - start))
+        for num, gen, offset in entries[start:end]:
+            lines.append('%010d %05d n \n' % (offset, gen))
+        start = end
+    return ''.join(lines)
+
+class Splitter(object):
+
+    def __init__(self, deck_bytes=config.SPLIT_DECK_BYTES, cache_bytes=config.SPLIT_CACHE_BYTES):
+        self.decks = lru.LRUCache(deck_bytes, sizeof=_size)
+        self.pages = lru.LRUCache(cache_bytes, sizeof=len)
+
+    def page(self, owner, path, rev, n, load):
+        """
+        The single page PDF of page `n` of the deck at `path`/`rev`. `load`
+        returns the content of the deck, it is only called if the page has
+        not been cut yet and the deck is not parsed already.
+        """
+        key = _key(owner, path, rev, n)
+        body = self.pages.get(key)
+        if body is not None:
+            return body
+        body = memcache.get(key, namespace=NAMESPACE)
+        if body is None:
+            body = self.deck(owner, path, rev, load).page(n)
+            if len(body) < _MEMCACHE_MAX_ITEM:
+                memcache.set(key, body, namespace=NAMESPACE)
+        self.pages.set(key, body)
+        return body
+
+    def deck(self, owner, path, rev, load):
+        key = (owner, path, rev)
+        deck = self.decks.get(key)
+        if deck is None:
+            deck = Deck(load())
+            self.decks.set(key, deck)
+        return deck
+
+def _size(deck):
+    # the file, and about as much again for the serialized objects
+    return 2 * len(deck.document.data)
+
+def _key(owner, path, rev, n):
+    if isinstance(path, unicode):
+        path = path.encode('utf8')
+    return hashlib.sha1('%s:%s:%s:%d' % (owner, path, rev, n)).hexdigest()
+
+splitter = Splitter()
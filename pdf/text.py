@@ -0,0 +1,213 @@
+"""
+The text of PDF pages, for the search index.
+
+Decodes the content streams of every page and collects the strings shown by
+the text operators (Tj, TJ, ' and "). Strings are mapped to Unicode through
+the ToUnicode CMap of their font where it has one, and read as Windows-1252
+otherwise, which is what simple fonts without one use in practice. Composite
+fonts without a ToUnicode map cannot be decoded and are skipped. Positions
+are not interpreted, every text move counts as a word break, which is enough
+to find words but not to reproduce the layout.
+"""
+
+import re
+import zlib
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from pdf import manifest
+from pdf import parser
+
+# kerning in TJ arrays wider than this (in thousandths of an em) is a space
+SPACE_KERNING = 200
+
+# how many codes of a bfrange are expanded at most
+MAX_RANGE = 0x10000
+
+_MOVES = frozenset(['Td', 'TD', 'Tm', 'T*', 'ET', "'", '"'])
+_CMAP_SECTION = re.compile(r'begin(bfchar|bfrange)(.*?)end\1', re.S)
+_CMAP_TOKEN = re.compile(r'<([0-9A-Fa-f\s]*)>|\[|\]')
+_INLINE_IMAGE_END = re.compile(r'\sEI\b')
+
+class TextException(Exception):
+    pass
+
+def extract(data):
+    """
+    The text of every page of the PDF in `data`, a list of unicode strings.
+    Pages whose content cannot be read come back empty.
+    """
+    try:
+        document = parser.Document(data)
+        catalog = document.get(document.trailer.get('Root'))
+        if not isinstance(catalog, dict):
+            raise TextException('No document catalog')
+        refs, sizes = manifest.pages(document, catalog)
+    except parser.PDFException, e:
+        raise TextException(str(e))
+    fonts = {}
+    texts = []
+    for ref in refs:
+        try:
+            texts.append(_page_text(document, document.get(ref), fonts))
+        except (parser.PDFException, ValueError, TypeError, KeyError, IndexError, zlib.error), e:
+            _logger.debug('No text on page %d: %s' % (len(texts) + 1, e))
+            texts.append(u'')
+    return texts
+
+def _page_text(document, page, fonts):
+    if not isinstance(page, dict):
+        return u''
+    resources = _inherited(document, page, 'Resources') or {}
+    font_resources = document.get(resources.get('Font')) or {}
+    contents = document.get(page.get('Contents'))
+    if not isinstance(contents, list):
+        contents = [contents]
+    data = []
+    for stream in contents:
+        stream = document.get(stream)
+        if isinstance(stream, parser.Stream):
+            data.append(document.decode(stream))
+    # a content stream may stop in the middle of an operation that the
+    # next one continues
+    lexer = parser.Lexer('\n'.join(data))
+    parts = []
+    operands = []
+    font = None
+    length = len(lexer.data)
+    while True:
+        lexer.skip_whitespace()
+        if lexer.pos >= length:
+            break
+        try:
+            value = lexer.read_object()
+        except parser.PDFException:
+            # a stray delimiter, drop what was read of the operation
+            lexer.pos += 1
+            operands = []
+            continue
+        if not isinstance(value, parser.Keyword):
+            operands.append(value)
+            continue
+        if value == 'Tf' and operands and isinstance(operands[0], parser.Name):
+            font = _font(document, font_resources.get(operands[0]), fonts)
+        elif value == 'BI':
+            _skip_inline_image(lexer)
+        elif value in _MOVES:
+            parts.append(u' ')
+        if value in ('Tj', "'", '"') and operands and isinstance(operands[-1], str) and font:
+            parts.append(font(operands[-1]))
+        elif value == 'TJ' and operands and isinstance(operands[-1], list) and font:
+            for item in operands[-1]:
+                if isinstance(item, str):
+                    parts.append(font(item))
+                elif isinstance(item, (int, float)) and item < -SPACE_KERNING:
+                    parts.append(u' ')
+        operands = []
+    return u''.join(parts)
+
+def _inherited(document, node, key):
+    seen = 0
+    while isinstance(node, dict) and seen < parser.MAX_DEPTH:
+        if key in node:
+            return document.get(node[key])
+        node = document.get(node.get('Parent'))
+        seen += 1
+    return None
+
+def _skip_inline_image(lexer):
+    """
+    Moves past the binary data of an inline image, which the lexer cannot
+    read.
+    """
+    start = lexer.data.find('ID', lexer.pos)
+    end = start >= 0 and _INLINE_IMAGE_END.search(lexer.data, start + 3)
+    lexer.pos = end and end.end() or len(lexer.data)
+
+def _font(document, ref, fonts):
+    """
+    A function decoding the strings shown in the font `ref` points at, or
+    None if they cannot be decoded.
+    """
+    key = isinstance(ref, parser.Ref) and ref or id(ref)
+    if key not in fonts:
+        fonts[key] = _decoder(document, document.get(ref))
+    return fonts[key]
+
+def _decoder(document, font):
+    if not isinstance(font, dict):
+        return None
+    to_unicode = document.get(font.get('ToUnicode'))
+    if isinstance(to_unicode, parser.Stream):
+        try:
+            mapping, width = _cmap(document.decode(to_unicode))
+        except (parser.PDFException, ValueError, zlib.error), e:
+            _logger.debug('Unreadable ToUnicode map: %s' % e)
+        else:
+            if mapping:
+                return lambda value: u''.join([mapping.get(value[i:i + width], u'')
+                                               for i in xrange(0, len(value), width)])
+    if font.get('Subtype') == 'Type0':
+        return None
+    return lambda value: value.decode('cp1252', 'replace')
+
+def _cmap(data):
+    """
+    The mappings of a ToUnicode CMap, from codes to unicode strings, and the
+    width of the codes in bytes.
+    """
+    mapping = {}
+    width = 1
+    for kind, body in _CMAP_SECTION.findall(data):
+        tokens = []
+        for match in _CMAP_TOKEN.finditer(body):
+            if match.group(1) is not None:
+                tokens.append(_hex(match.group(1)))
+            else:
+                tokens.append(match.group(0))
+        if kind == 'bfchar':
+            for source, target in zip(tokens[0::2], tokens[1::2]):
+                if source not in ('[', ']') and target not in ('[', ']'):
+                    mapping[source] = _utf16(target)
+                    width = max(width, len(source))
+            continue
+        position = 0
+        while position + 2 < len(tokens):
+            low, high, target = tokens[position:position + 3]
+            position += 3
+            targets = None
+            if target == '[':
+                end = tokens.index(']', position)
+                targets = tokens[position:end]
+                position = end + 1
+            if len(low) != len(high) or low in ('[', ']'):
+                continue
+            width = max(width, len(low))
+            first, last = _number(low), _number(high)
+            for offset in xrange(min(last - first + 1, MAX_RANGE)):
+                code = _code(first + offset, len(low))
+                if targets is not None:
+                    if offset < len(targets):
+                        mapping[code] = _utf16(targets[offset])
+                elif target:
+                    # the last byte of the target counts up
+                    mapping[code] = _utf16(target[:-1] + chr((ord(target[-1]) + offset) % 256))
+    return mapping, width
+
+def _hex(digits):
+    digits = re.sub(r'\s', '', digits)
+    if len(digits) % 2:
+        digits += '0'
+    return digits.decode('hex')
+
+def _number(code):
+    return int(code.encode('hex') or '0', 16)
+
+def _code(number, width):
+    return ('%0*x' % (width * 2, number)).decode('hex')
+
+def _utf16(value):
+    if len(value) % 2:
+        return value.decode('latin-1')
+    return value.decode('utf-16-be', 'replace')
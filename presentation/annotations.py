@@ -0,0 +1,271 @@
+"""
+Slide annotations, drawn by the presenter and shown to the audience.
+
+Annotations belong to one page of one rev of a deck, (owner, path, rev,
+page), and every such page has an append-only log. The presenter posts
+batches of operations
+
+    {'op': 'stroke', 'id': ..., 'color': '#f00', 'width': 3, 'points': [[x, y], ...]}
+    {'op': 'erase', 'id': ...}
+    {'op': 'clear'}
+
+with coordinates as fractions of the page size. A batch becomes one
+AnnotationDelta with the next sequence number, written in a transaction
+with the head of the log on its AnnotationPage.
+
+Clients remember the last seq they have applied and ask for what came
+after it. The state of a page is kept in memcache as a snapshot, the strokes
+up to seq `base`, and the deltas after it, so a client gets just the deltas
+it misses, or the snapshot and all deltas if it is behind the snapshot, from
+a single read. Appends update that entry in place instead of dropping it,
+so a batch does not send every viewer to the datastore. The entry expires
+after ANNOTATION_STATE_TTL seconds, so one that was loaded before a delta
+was written but stored after it is not served for long.
+
+Once a page has ANNOTATION_COMPACT_DELTAS deltas or ANNOTATION_COMPACT_BYTES
+of them past its snapshot, a task folds them into the snapshot and deletes
+them. Clears and erases drop strokes and the snapshot keeps only the
+ANNOTATION_MAX_STROKES newest, so what a page stores and sends stays bounded
+however long the talk goes on.
+"""
+
+import hashlib
+import re
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from django.utils import simplejson as json
+
+import config
+
+NAMESPACE = 'annotations'
+
+_COLOR = re.compile(r'^#[0-9a-fA-F]{3}([0-9a-fA-F]{3})?$')
+
+class AnnotationException(Exception):
+    pass
+
+class AnnotationPage(db.Model):
+    """
+    Keyed by `page_id`, the parent of the deltas of the page.
+    """
+    seq = db.IntegerProperty(default=0)
+    # the seq the snapshot is at, deltas up to it are deleted
+    base = db.IntegerProperty(default=0)
+    snapshot = db.TextProperty()
+    # size of the deltas after the snapshot
+    pending_bytes = db.IntegerProperty(default=0)
+    updated = db.DateTimeProperty(auto_now=True)
+
+class AnnotationDelta(db.Model):
+    """
+    One batch of operations, keyed by 'd<seq>'.
+    """
+    seq = db.IntegerProperty(required=True)
+    ops = db.TextProperty(required=True)
+
+def page_id(owner, path, rev, page):
+    if isinstance(path, unicode):
+        path = path.encode('utf8')
+    return hashlib.sha1('%s:%s:%s:%d' % (owner, path, rev, page)).hexdigest()
+
+def changes(page_id, since=None):
+    """
+    What a client that has applied the log up to `since` is missing, None
+    if nothing. Otherwise {'seq': ..., 'deltas': [[seq, ops], ...]}, plus
+    the 'snapshot' to start over from if `since` is before it.
+    """
+    state = _state(page_id)
+    if since is not None and since >= state['seq']:
+        return None
+    if since is None or since < state['base']:
+        return {'seq': state['seq'],
+                'snapshot': state['snapshot'],
+                'deltas': state['deltas']}
+    return {'seq': state['seq'],
+            'deltas': [delta for delta in state['deltas'] if delta[0] > since]}
+
+def append(page_id, ops):
+    """
+    Appends a batch of operations to the log of a page and returns its seq.
+    Raises AnnotationException if they are not valid.
+    """
+    ops = _validate(ops)
+    data = json.dumps(ops, separators=(',', ':'))
+    def append_delta():
+        page = AnnotationPage.get_by_key_name(page_id)
+        if page is None:
+            page = AnnotationPage(key_name=page_id)
+        page.seq += 1
+        page.pending_bytes += len(data)
+        delta = AnnotationDelta(parent=page, key_name=_delta_key_name(page.seq),
+                                seq=page.seq, ops=db.Text(data))
+        db.put([page, delta])
+        return page
+    page = db.run_in_transaction(append_delta)
+    _cache_delta(page_id, page.seq, ops)
+    if (page.seq - page.base >= config.ANNOTATION_COMPACT_DELTAS
+        or page.pending_bytes >= config.ANNOTATION_COMPACT_BYTES):
+        if memcache.add(_pending_key(page_id), True, time=config.ANNOTATION_COMPACT_LEASE,
+                        namespace=NAMESPACE):
+            taskqueue.add(url='/tasks/annotations', params={'page': page_id})
+    return page.seq
+
+def compact(page_id):
+    """
+    Runs from the task queue: folds the deltas of a page into its snapshot
+    and deletes them.
+    """
+    def fold_deltas():
+        page = AnnotationPage.get_by_key_name(page_id)
+        if page is None or page.seq == page.base:
+            return False
+        deltas = [delta for delta in _deltas(page) if delta is not None]
+        strokes = _snapshot(page)
+        for delta in deltas:
+            strokes = fold(strokes, json.loads(delta.ops))
+        page.snapshot = db.Text(json.dumps(strokes, separators=(',', ':')))
+        page.base = page.seq
+        page.pending_bytes = 0
+        db.delete(deltas)
+        page.put()
+        return True
+    try:
+        if db.run_in_transaction(fold_deltas):
+            # the next read loads the compacted page
+            memcache.delete(_state_key(page_id), namespace=NAMESPACE)
+    finally:
+        memcache.delete(_pending_key(page_id), namespace=NAMESPACE)
+
+def fold(strokes, ops):
+    """
+    The strokes left after applying `ops` to `strokes`, at most the
+    ANNOTATION_MAX_STROKES newest. The client in annotations.js does the
+    same.
+    """
+    strokes = list(strokes)
+    for op in ops:
+        if op['op'] == 'clear':
+            strokes = []
+        elif op['op'] == 'erase':
+            strokes = [stroke for stroke in strokes if stroke['id'] != op['id']]
+        else:
+            strokes.append(op)
+    return strokes[-config.ANNOTATION_MAX_STROKES:]
+
+def _state(page_id):
+    state = memcache.get(_state_key(page_id), namespace=NAMESPACE)
+    if state is None:
+        state = _load(page_id)
+        memcache.add(_state_key(page_id), state, time=config.ANNOTATION_STATE_TTL,
+                     namespace=NAMESPACE)
+    return state
+
+def _load(page_id):
+    page = AnnotationPage.get_by_key_name(page_id)
+    if page is None:
+        return {'seq': 0, 'base': 0, 'snapshot': [], 'deltas': []}
+    # deltas and head are written together, a get of all of them is
+    # consistent with the head
+    return {'seq': page.seq,
+            'base': page.base,
+            'snapshot': _snapshot(page),
+            'deltas': [[delta.seq, json.loads(delta.ops)]
+                       for delta in _deltas(page) if delta is not None]}
+
+def _cache_delta(page_id, seq, ops):
+    """
+    Adds a new delta to the cached state, unless there is none or it missed
+    an earlier one, which leaves the next read to load it.
+    """
+    client = memcache.Client()
+    key = _state_key(page_id)
+    for attempt in xrange(config.ANNOTATION_CACHE_RETRIES):
+        state = client.gets(key, namespace=NAMESPACE)
+        if state is None or state['seq'] >= seq:
+            return
+        if state['seq'] != seq - 1:
+            break
+        state = dict(state, seq=seq, deltas=state['deltas'] + [[seq, ops]])
+        if client.cas(key, state, time=config.ANNOTATION_STATE_TTL, namespace=NAMESPACE):
+            return
+    memcache.delete(key, namespace=NAMESPACE)
+
+def _deltas(page):
+    """
+    The deltas after the snapshot, by key, so this needs no index and
+    works in transactions. Missing ones come back as None.
+    """
+    if page.seq == page.base:
+        return []
+    return AnnotationDelta.get_by_key_name([_delta_key_name(seq) for seq in xrange(page.base + 1, page.seq + 1)],
+                                           parent=page)
+
+def _snapshot(page):
+    if not page.snapshot:
+        return []
+    return json.loads(page.snapshot)
+
+def _validate(ops):
+    if not isinstance(ops, list) or not ops:
+        raise AnnotationException('Expected a list of operations')
+    if len(ops) > config.ANNOTATION_BATCH_OPS:
+        raise AnnotationException('More than %d operations' % config.ANNOTATION_BATCH_OPS)
+    valid = []
+    for op in ops:
+        if not isinstance(op, dict):
+            raise AnnotationException('Expected an operation')
+        kind = op.get('op')
+        if kind == 'clear':
+            valid.append({'op': 'clear'})
+        elif kind == 'erase':
+            valid.append({'op': 'erase', 'id': _stroke_id(op.get('id'))})
+        elif kind == 'stroke':
+            valid.append({'op': 'stroke',
+                          'id': _stroke_id(op.get('id')),
+                          'color': _color(op.get('color')),
+                          'width': _number(op.get('width'), 0.5, config.ANNOTATION_MAX_WIDTH),
+                          'points': _points(op.get('points'))})
+        else:
+            raise AnnotationException('Unknown operation %r' % kind)
+    return valid
+
+def _stroke_id(value):
+    if not isinstance(value, basestring) or not 0 < len(value) <= 32:
+        raise AnnotationException('Invalid stroke id')
+    return value
+
+def _color(value):
+    if not isinstance(value, basestring) or not _COLOR.match(value):
+        raise AnnotationException('Invalid color')
+    return str(value)
+
+def _number(value, low, high):
+    if isinstance(value, bool) or not isinstance(value, (int, long, float)) or not low <= value <= high:
+        raise AnnotationException('Expected a number from %s to %s' % (low, high))
+    # three decimals are plenty for a fraction of a page, and shorter
+    return round(value, 3)
+
+def _points(value):
+    if not isinstance(value, list) or not 0 < len(value) <= config.ANNOTATION_MAX_POINTS:
+        raise AnnotationException('Expected 1 to %d points' % config.ANNOTATION_MAX_POINTS)
+    points = []
+    for point in value:
+        if not isinstance(point, list) or len(point) != 2:
+            raise AnnotationException('Expected [x, y] points')
+        points.append([_number(point[0], 0, 1), _number(point[1], 0, 1)])
+    return points
+
+def _delta_key_name(seq):
+    # key names must not start with a digit
+    return 'd%d' % seq
+
+def _state_key(page_id):
+    return 'state:%s' % page_id
+
+def _pending_key(page_id):
+    return 'pending:%s' % page_id
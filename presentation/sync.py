@@ -0,0 +1,188 @@
+"""
+Presenter to audience page sync.
+
+A presentation is a deck shown by its owner to any number of viewers. The
+presenter publishes the current page, which bumps the presentation's sequence
+number. Viewers learn about it in one of two ways:
+
+- pushed over the Channel API. Viewers are spread over SYNC_BUCKETS buckets
+  of at most SYNC_BUCKET_SIZE channels each, and a broadcast fans out one
+  task queue task per bucket, so no request holds a connection open.
+- polling /presentation/<id>/state?since=<seq>, which is a single memcache
+  read and the fallback for viewers that did not get a channel.
+
+Publishing only schedules a broadcast if none is pending yet. The broadcast
+reads the latest state when it runs, so a burst of page flips is coalesced
+into a single message. Messages carry the absolute state (page and sequence
+number) rather than deltas, so a viewer never needs to buffer more than the
+newest one and can simply drop anything older than what it has shown.
+"""
+
+import binascii
+import os
+import random
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import channel
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from django.utils import simplejson as json
+
+import config
+
+NAMESPACE = 'presentation'
+
+class PresentationNotFoundException(Exception):
+    pass
+
+class Presentation(db.Model):
+    """
+    Keyed by the presentation id. Holds the presenter's credentials so the
+    deck can be proxied to viewers who have no access to that Dropbox.
+    """
+    owner = db.StringProperty(required=True)
+    path = db.StringProperty(required=True)
+    token = db.StringProperty(required=True)
+    secret = db.StringProperty(required=True)
+    page = db.IntegerProperty(default=1)
+    seq = db.IntegerProperty(default=0)
+    created = db.DateTimeProperty(auto_now_add=True)
+
+    def credentials(self):
+        return {'token': self.token,
+                'secret': self.secret}
+
+def create(owner, path, dropbox_credentials):
+    presentation_id = binascii.hexlify(os.urandom(8))
+    presentation = Presentation(key_name=presentation_id,
+                                owner=str(owner),
+                                path=path,
+                                token=dropbox_credentials.get('token'),
+                                secret=dropbox_credentials.get('secret'))
+    presentation.put()
+    memcache.set(_presentation_key(presentation_id), presentation, namespace=NAMESPACE)
+    return presentation_id
+
+def get(presentation_id):
+    presentation = memcache.get(_presentation_key(presentation_id), namespace=NAMESPACE)
+    if presentation is None:
+        presentation = Presentation.get_by_key_name(presentation_id)
+        if presentation is None:
+            raise PresentationNotFoundException('No presentation %s' % presentation_id)
+        memcache.set(_presentation_key(presentation_id), presentation, namespace=NAMESPACE)
+    return presentation
+
+def deck(presentation_id):
+    """
+    Returns the (owner, credentials, path) tuple needed to load the deck of
+    a presentation on behalf of its viewers.
+    """
+    presentation = get(presentation_id)
+    return (presentation.owner, presentation.credentials(), presentation.path)
+
+def get_state(presentation_id):
+    """
+    Returns the current {'page': ..., 'seq': ...} of a presentation.
+    """
+    state = memcache.get(_state_key(presentation_id), namespace=NAMESPACE)
+    if state is None:
+        presentation = get(presentation_id)
+        state = {'page': presentation.page, 'seq': presentation.seq}
+        memcache.add(_state_key(presentation_id), state, namespace=NAMESPACE)
+    return state
+
+def publish(presentation_id, page):
+    """
+    Makes `page` the current page and schedules a broadcast unless one is
+    already pending. Returns the new state.
+    """
+    current = get_state(presentation_id)
+    seq = memcache.incr(_seq_key(presentation_id), namespace=NAMESPACE,
+                        initial_value=current['seq'])
+    if seq is None:
+        seq = current['seq'] + 1
+    state = {'page': page, 'seq': seq}
+    memcache.set(_state_key(presentation_id), state, namespace=NAMESPACE)
+    if memcache.add(_pending_key(presentation_id), True,
+                    time=config.SYNC_COALESCE_DELAY + 10, namespace=NAMESPACE):
+        taskqueue.add(url='/tasks/presentation/broadcast',
+                      params={'presentation': presentation_id},
+                      countdown=config.SYNC_COALESCE_DELAY)
+    return state
+
+def broadcast(presentation_id):
+    """
+    Runs from the task queue: persists the latest state and queues one
+    fan-out task per viewer bucket.
+    """
+    memcache.delete(_pending_key(presentation_id), namespace=NAMESPACE)
+    state = get_state(presentation_id)
+    presentation = get(presentation_id)
+    if state['seq'] > presentation.seq:
+        presentation.page = state['page']
+        presentation.seq = state['seq']
+        presentation.put()
+        memcache.set(_presentation_key(presentation_id), presentation, namespace=NAMESPACE)
+    message = json.dumps(state)
+    buckets = memcache.get_multi([_bucket_key(presentation_id, i) for i in xrange(config.SYNC_BUCKETS)],
+                                 namespace=NAMESPACE)
+    for bucket_key in buckets:
+        if buckets[bucket_key]:
+            taskqueue.add(url='/tasks/presentation/fanout',
+                          params={'bucket': bucket_key, 'message': message})
+
+def fanout(bucket_key, message):
+    """
+    Runs from the task queue: sends `message` to every channel of a bucket.
+    """
+    now = time.time()
+    for client_id, expires in memcache.get(bucket_key, namespace=NAMESPACE) or []:
+        if expires > now:
+            channel.send_message(client_id, message)
+
+def join(presentation_id):
+    """
+    Registers a new viewer. Returns a channel token, or None if all buckets
+    the viewer could go to are full, in which case it has to poll.
+    """
+    get(presentation_id)
+    client = memcache.Client()
+    bucket = random.randrange(config.SYNC_BUCKETS)
+    client_id = '%s.%d.%s' % (presentation_id, bucket, binascii.hexlify(os.urandom(6)))
+    bucket_key = _bucket_key(presentation_id, bucket)
+    now = time.time()
+    entry = (client_id, now + config.SYNC_CHANNEL_LIFETIME * 60)
+    for attempt in xrange(config.SYNC_JOIN_RETRIES):
+        viewers = client.gets(bucket_key, namespace=NAMESPACE)
+        if viewers is None:
+            if client.add(bucket_key, [entry], namespace=NAMESPACE):
+                break
+            continue
+        viewers = [viewer for viewer in viewers if viewer[1] > now]
+        if len(viewers) >= config.SYNC_BUCKET_SIZE:
+            return None
+        viewers.append(entry)
+        if client.cas(bucket_key, viewers, namespace=NAMESPACE):
+            break
+    else:
+        return None
+    return channel.create_channel(client_id, duration_minutes=config.SYNC_CHANNEL_LIFETIME)
+
+def _presentation_key(presentation_id):
+    return 'presentation:%s' % presentation_id
+
+def _state_key(presentation_id):
+    return 'state:%s' % presentation_id
+
+def _seq_key(presentation_id):
+    return 'seq:%s' % presentation_id
+
+def _pending_key(presentation_id):
+    return 'pending:%s' % presentation_id
+
+def _bucket_key(presentation_id, bucket):
+    return 'viewers:%s:%d' % (presentation_id, bucket)
@@ -0,0 +1,192 @@
+"""
+Loading files from the app folder.
+
+Everything that needs the bytes or the metadata of a deck goes through here,
+so they all share the revision keyed content cache.
+"""
+
+import hashlib
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import urlfetch
+from django.utils import simplejson as json
+
+import config
+from cache import content
+from metrics.registry import registry
+from presentation import sync
+from proxy import flight
+from proxy import ranges
+
+FILES_URL = 'https://api-content.dropbox.com/1/files/sandbox'
+METADATA_URL = 'https://api.dropbox.com/1/metadata/sandbox'
+
+class FileException(Exception):
+
+    def __init__(self, status_code, message=''):
+        Exception.__init__(self, message or 'Dropbox answered %s' % status_code)
+        self.status_code = status_code
+
+def fetch(client, dropbox_credentials, path, byte_range=None):
+    """
+    Requests `path` (or the `byte_range` of it) from Dropbox and returns the
+    urlfetch result without looking at it.
+    """
+    headers = {}
+    if byte_range:
+        headers['Range'] = ranges.format_range_header(byte_range)
+    return client.make_request(FILES_URL + path, token=dropbox_credentials.get('token'), secret=dropbox_credentials.get('secret'), additional_params={}, headers=headers)
+
+def fetch_many(client, dropbox_credentials, paths):
+    """
+    Requests several whole files at once and returns the urlfetch results in
+    the order of `paths`.
+    """
+    requests = [{'url': FILES_URL + path,
+                 'token': dropbox_credentials.get('token'),
+                 'secret': dropbox_credentials.get('secret'),
+                 'additional_params': {}} for path in paths]
+    return client.make_requests(requests)
+
+def fetch_chunked(client, dropbox_credentials, path, rev, start, end):
+    """
+    Yields the bytes `start` to `end` (inclusive) of `path` at `rev` in
+    order, for files too big for a single fetch. They are requested in
+    CHUNKED_FETCH_BYTES pieces, CHUNKED_FETCH_CONCURRENCY at a time. Failed
+    pieces are retried by oauth/upstream.py like any other GET, a piece that
+    comes back short fails the fetch. Every piece asks for `rev`, so a deck
+    changing meanwhile cannot mix two revisions.
+    """
+    windows = [(offset, min(offset + config.CHUNKED_FETCH_BYTES - 1, end))
+               for offset in xrange(start, end + 1, config.CHUNKED_FETCH_BYTES)]
+    pending = {}
+    started = 0
+    for index, window in enumerate(windows):
+        while started < len(windows) and started < index + config.CHUNKED_FETCH_CONCURRENCY:
+            pending[started] = _fetch_piece(client, dropbox_credentials, path, rev, windows[started])
+            started += 1
+        yield _piece(client, dropbox_credentials, path, rev, window, pending.pop(index))
+
+def _fetch_piece(client, dropbox_credentials, path, rev, window):
+    return client.make_async_request(FILES_URL + path, token=dropbox_credentials.get('token'), secret=dropbox_credentials.get('secret'),
+                                     additional_params={'rev': rev}, headers={'Range': ranges.format_range_header(window)})
+
+def _piece(client, dropbox_credentials, path, rev, window, rpc):
+    start, end = window
+    try:
+        result = rpc.get_result()
+    except urlfetch.Error, e:
+        status_code, problem = 502, e
+    else:
+        status_code, problem = result.status_code, 'status %s' % result.status_code
+        if result.status_code == 206:
+            served = ranges.parse_content_range(result.headers.get('content-range'))
+            if served and served[:2] == window and len(result.content) == end - start + 1:
+                return result.content
+            status_code, problem = 502, 'got %s' % result.headers.get('content-range')
+        elif result.status_code == 200:
+            if len(result.content) > end:
+                # the range was ignored, the piece is in there anyway
+                return result.content[start:end + 1]
+            status_code, problem = 502, 'got %d bytes' % len(result.content)
+    _logger.warning('Could not fetch bytes %d-%d of %s: %s' % (start, end, path, problem))
+    raise FileException(status_code)
+
+def fetch_metadata(client, dropbox_credentials, path):
+    result = client.make_request(METADATA_URL + path, token=dropbox_credentials.get('token'), secret=dropbox_credentials.get('secret'), additional_params={'list': 'false'})
+    if result.status_code != 200:
+        raise FileException(result.status_code)
+    metadata = json.loads(result.content)
+    if metadata.get('is_deleted') or metadata.get('is_dir'):
+        raise FileException(404, 'Not a file: %s' % path)
+    return metadata
+
+def current_metadata(client, dropbox_credentials, owner, path):
+    """
+    Returns the metadata of the current revision of `path`, asking Dropbox
+    only if we have not seen it within CONTENT_CACHE_REVISION_TTL, and
+    falling back to the last one seen if Dropbox fails.
+    """
+    metadata = content.file_cache.get_revision(owner, path)
+    if metadata is None:
+        try:
+            metadata = fetch_metadata(client, dropbox_credentials, path)
+        except (FileException, urlfetch.Error), e:
+            # Dropbox is down, its circuit breaker open or we are over its
+            # quota, whatever rev was seen last is better than nothing
+            if isinstance(e, FileException) and e.status_code < 500 and e.status_code != 429:
+                raise
+            metadata = content.file_cache.get_revision(owner, path, stale=True)
+            if metadata is None:
+                raise
+            _logger.warning('Serving %s at the last known rev: %s' % (path, e))
+            return metadata
+        content.file_cache.set_revision(owner, path, metadata)
+    return metadata
+
+def load(client, dropbox_credentials, owner, path, metadata=None):
+    """
+    Returns a (metadata, body) tuple for the whole file, from the cache if
+    possible. The body is None if the file is too big to be cached, callers
+    then have to fall back to range requests.
+    """
+    if metadata is None:
+        metadata = current_metadata(client, dropbox_credentials, owner, path)
+    rev = metadata.get('rev')
+    body = content.file_cache.get(owner, path, rev)
+    if body is None and content.file_cache.cacheable(metadata.get('bytes', 0)):
+        # everybody else asking for this rev meanwhile waits for this fetch
+        def fetch_body():
+            if metadata.get('bytes', 0) > config.CHUNKED_FETCH_BYTES:
+                body = ''.join(fetch_chunked(client, dropbox_credentials, path, rev, 0, metadata['bytes'] - 1))
+                content.file_cache.set(owner, path, rev, body)
+                return (metadata, body)
+            result = fetch(client, dropbox_credentials, path)
+            if result.status_code != 200:
+                raise FileException(result.status_code)
+            fetched = json.loads(result.headers['x-dropbox-metadata'])
+            content.file_cache.set(owner, path, fetched.get('rev'), result.content)
+            content.file_cache.set_revision(owner, path, fetched)
+            return (fetched, result.content)
+        def cached_body():
+            cached = content.file_cache.get(owner, path, rev)
+            return cached is not None and (metadata, cached) or None
+        try:
+            metadata, body = flight.shared(_flight_key(owner, path, rev), fetch_body, cached_body)
+        except flight.FlightException, e:
+            raise FileException(e.status_code)
+    return (metadata, body)
+
+def _flight_key(owner, path, rev):
+    if isinstance(path, unicode):
+        path = path.encode('utf8')
+    return hashlib.sha1('%s:%s:%s' % (owner, path, rev)).hexdigest()
+
+def resolve(request, session):
+    """
+    Works out whose deck a request is for. Viewers of a presentation pass its
+    id and are served with the presenter's credentials, everybody else reads
+    from their own app folder. Returns an (owner, credentials, path) tuple,
+    or None if the user is not logged in.
+    """
+    presentation_id = request.get('presentation')
+    if presentation_id:
+        try:
+            return sync.deck(presentation_id)
+        except sync.PresentationNotFoundException:
+            raise FileException(404, 'No presentation %s' % presentation_id)
+    if session.get('dropbox_credentials'):
+        return (owner(session), session.get('dropbox_credentials'), request.get('path'))
+    return None
+
+def owner(session):
+    """
+    The key under which per user data is cached: the Dropbox uid if we know
+    it, the access token otherwise.
+    """
+    current_user = session.get('current_user')
+    if current_user and current_user.get('id'):
+        return current_user['id']
+    return session.get('dropbox_credentials').get('token')
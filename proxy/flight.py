@@ -0,0 +1,143 @@
+"""
+Single-flight coalescing of identical upstream fetches.
+
+When a presentation starts, dozens of viewers ask for the same deck within a
+second. Only one of them should download it from Dropbox, the others wait
+for that download and are served the same bytes from the content cache.
+
+Two levels of coalescing:
+
+- within a process, concurrent callers of `SingleFlight.do` with the same
+  key share one call, waiting on an event and getting its result or its
+  exception.
+- across instances, the caller that wins a memcache lease fetches, everybody
+  else polls `ready` (the content cache) until it has the bytes. A leader
+  that fails leaves its error behind for FLIGHT_ERROR_TTL seconds, so
+  waiters and callers right after fail the same way instead of piling onto
+  Dropbox. Waiters give up after FLIGHT_WAIT seconds, or as soon as the
+  lease is gone without a result, and fetch on their own.
+
+App Engine cannot hand a response over while it is still arriving, so
+waiters get the whole file once it is cached rather than a stream.
+"""
+
+import threading
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import memcache
+
+import config
+
+NAMESPACE = 'flight'
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, timeout=None):
+        """
+        Runs `function` unless a call for `key` is in flight already, in
+        which case its outcome is shared. A waiter that times out runs
+        `function` itself.
+        """
+        self._lock.acquire()
+        try:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        finally:
+            self._lock.release()
+        if not leader:
+            call.done.wait(timeout)
+            if call.done.isSet():
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            _logger.info('Gave up waiting for %s' % (key,))
+            return function()
+        try:
+            call.result = function()
+            return call.result
+        except Exception, e:
+            call.error = e
+            raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._calls[key]
+            finally:
+                self._lock.release()
+            call.done.set()
+
+flights = SingleFlight()
+
+class FlightException(Exception):
+    """
+    The leader of a shared fetch failed with `status_code`.
+    """
+
+    def __init__(self, status_code):
+        Exception.__init__(self, 'Shared fetch failed with %s' % status_code)
+        self.status_code = status_code
+
+def shared(key, fetch, ready, wait=None):
+    """
+    Runs `fetch` once for `key` across instances. `fetch` is expected to
+    fill the cache `ready` reads from, `ready` returns the cached result or
+    None. Either returns what `fetch` or `ready` returned, or raises the
+    leader's FlightException.
+    """
+    if wait is None:
+        wait = config.FLIGHT_WAIT
+    return flights.do(key, lambda: _shared(key, fetch, ready, wait), wait)
+
+def _shared(key, fetch, ready, wait):
+    lease_key = 'lease:%s' % key
+    error_key = 'error:%s' % key
+    status_code = memcache.get(error_key, namespace=NAMESPACE)
+    if status_code is not None:
+        raise FlightException(status_code)
+    if memcache.add(lease_key, True, time=config.FLIGHT_LEASE, namespace=NAMESPACE):
+        return _lead(lease_key, error_key, fetch)
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        time.sleep(config.FLIGHT_POLL_INTERVAL)
+        result = ready()
+        if result is not None:
+            return result
+        state = memcache.get_multi([lease_key, error_key], namespace=NAMESPACE)
+        if error_key in state:
+            raise FlightException(state[error_key])
+        if lease_key not in state:
+            # the leader is done but its result did not make it into the
+            # cache (evicted or too big), or it died: try to take over
+            result = ready()
+            if result is not None:
+                return result
+            if memcache.add(lease_key, True, time=config.FLIGHT_LEASE, namespace=NAMESPACE):
+                return _lead(lease_key, error_key, fetch)
+    _logger.info('Gave up waiting for the shared fetch of %s' % key)
+    return fetch()
+
+def _lead(lease_key, error_key, fetch):
+    try:
+        return fetch()
+    except Exception, e:
+        memcache.set(error_key, getattr(e, 'status_code', 502),
+                     time=config.FLIGHT_ERROR_TTL, namespace=NAMESPACE)
+        raise
+    finally:
+        memcache.delete(lease_key, namespace=NAMESPACE)
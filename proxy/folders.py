@@ -0,0 +1,226 @@
+"""
+Per user index of every file in the app folder, kept current through /delta.
+
+Instead of listing the app folder on every view, the index remembers the
+/delta cursor and only applies what changed since. It covers the whole
+folder tree, so nested decks show up as well, and /slides pages, sorts and
+filters it without asking Dropbox.
+
+The index is stored in the datastore (the source of truth), in memcache and
+in an in-process LRU. A view syncs at most once every
+FOLDER_INDEX_SYNC_INTERVAL seconds per user, whoever wins the memcache add
+of the sync key does it, everybody else checks their local copy against the
+version in memcache. The first sync of a large folder takes several pages of
+/delta, at most FOLDER_INDEX_DELTA_PAGES of them per view, until then the
+index is marked incomplete.
+"""
+
+import email.utils
+import zlib
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+from google.appengine.ext import db
+from django.utils import simplejson as json
+
+import config
+from cache import lru
+from cache.listing import LISTING_FIELDS
+
+DELTA_URL = 'https://api.dropbox.com/1/delta'
+NAMESPACE = 'folders'
+
+SORTS = ('name', 'modified', 'size')
+
+class FolderIndexException(Exception):
+
+    def __init__(self, status_code, message=''):
+        Exception.__init__(self, message or 'Dropbox answered %s' % status_code)
+        self.status_code = status_code
+
+class FolderIndex(db.Model):
+    """
+    Keyed by 'index:<owner>'. `entries` is the zlib compressed JSON of the
+    index.
+    """
+    entries = db.BlobProperty()
+    updated = db.DateTimeProperty(auto_now=True)
+
+class Index(object):
+    """
+    The files of one app folder by lower cased path, as Dropbox keys them in
+    /delta. `version` changes whenever the entries do.
+    """
+
+    def __init__(self, cursor=None, version='', complete=False, entries=None):
+        self.cursor = cursor
+        self.version = version
+        self.complete = complete
+        self.entries = entries or {}
+        self._sorted = {}
+
+    def apply(self, delta):
+        """
+        Applies one page of /delta and returns the new or changed file
+        entries.
+        """
+        if delta.get('reset'):
+            self.entries = {}
+        changed = []
+        for path, metadata in delta.get('entries', []):
+            path = path.lower()
+            if metadata is None or not metadata.get('is_dir'):
+                # something at `path` went away or turned into a file, either
+                # way nothing can be left below it
+                self._remove(path)
+            if metadata is not None and not metadata.get('is_dir'):
+                entry = {}
+                for field in LISTING_FIELDS:
+                    if field in metadata:
+                        entry[field] = metadata[field]
+                self.entries[path] = entry
+                changed.append(entry)
+        self.cursor = delta.get('cursor')
+        self.complete = not delta.get('has_more')
+        if changed or delta.get('reset') or delta.get('entries'):
+            self.version = self.cursor
+            self._sorted = {}
+        return changed
+
+    def _remove(self, path):
+        self.entries.pop(path, None)
+        prefix = path + '/'
+        for key in [key for key in self.entries if key.startswith(prefix)]:
+            del self.entries[key]
+
+    def files(self, sort='name', reverse=False, query=None):
+        """
+        The entries sorted by `sort`, filtered to paths containing `query`
+        if it is given. Sorted lists are kept with the index, so paging
+        through them does not sort again.
+        """
+        if sort not in SORTS:
+            sort = 'name'
+        key = (sort, reverse)
+        ordered = self._sorted.get(key)
+        if ordered is None:
+            ordered = self.entries.items()
+            ordered.sort(key=_SORT_KEYS[sort], reverse=reverse)
+            ordered = self._sorted[key] = [entry for path, entry in ordered]
+        if query:
+            query = query.lower()
+            ordered = [entry for entry in ordered if query in entry['path'].lower()]
+        return ordered
+
+    def dumps(self):
+        return zlib.compress(json.dumps({'cursor': self.cursor,
+                                         'version': self.version,
+                                         'complete': self.complete,
+                                         'entries': self.entries}, separators=(',', ':')))
+
+    @classmethod
+    def loads(cls, data):
+        value = json.loads(zlib.decompress(data))
+        return cls(value['cursor'], value['version'], value['complete'], value['entries'])
+
+def _modified(item):
+    parsed = email.utils.parsedate_tz(item[1].get('modified', ''))
+    if parsed is None:
+        return 0
+    return email.utils.mktime_tz(parsed)
+
+_SORT_KEYS = {'name': lambda item: item[0],
+              'modified': _modified,
+              'size': lambda item: item[1].get('bytes', 0)}
+
+_local = lru.LRUCache(config.FOLDER_INDEX_LOCAL_ENTRIES)
+
+def load(owner):
+    """
+    The stored index of `owner`, empty if there is none yet.
+    """
+    index = _local.get(owner)
+    version = memcache.get(_version_key(owner), namespace=NAMESPACE)
+    if index is not None and index.version == version:
+        return index
+    data = memcache.get(_key(owner), namespace=NAMESPACE)
+    if data is None:
+        stored = FolderIndex.get_by_key_name(_key(owner))
+        if stored is None:
+            return Index()
+        index = Index.loads(stored.entries)
+        memcache.set_multi({_key(owner): stored.entries,
+                            _version_key(owner): index.version}, namespace=NAMESPACE)
+    else:
+        index = Index.loads(data)
+    _local.set(owner, index)
+    return index
+
+def save(owner, index):
+    data = index.dumps()
+    FolderIndex(key_name=_key(owner), entries=db.Blob(data)).put()
+    _local.set(owner, index)
+    memcache.set_multi({_key(owner): data,
+                        _version_key(owner): index.version}, namespace=NAMESPACE)
+
+def current(client, dropbox_credentials, owner):
+    """
+    Returns the index of `owner`, synced first unless that happened within
+    FOLDER_INDEX_SYNC_INTERVAL seconds. Also returns the file entries that
+    changed, as an (index, changed) tuple.
+    """
+    index = load(owner)
+    # an incomplete index is synced on every view until it has caught up
+    if index.complete and not memcache.add(_sync_key(owner), True,
+                                           time=config.FOLDER_INDEX_SYNC_INTERVAL, namespace=NAMESPACE):
+        return (index, [])
+    # other requests may be reading the shared copy meanwhile
+    index = Index(index.cursor, index.version, index.complete, dict(index.entries))
+    try:
+        changed = sync(client, dropbox_credentials, owner, index)
+    except FolderIndexException:
+        memcache.delete(_sync_key(owner), namespace=NAMESPACE)
+        if index.cursor is None:
+            raise
+        _logger.warning('Could not sync the folder index of %s, serving it as it is' % owner)
+        return (index, [])
+    return (index, changed)
+
+def sync(client, dropbox_credentials, owner, index):
+    """
+    Applies the pending pages of /delta to `index` and stores it if that
+    changed anything.
+    """
+    changed = []
+    version, complete = index.version, index.complete
+    for page in xrange(config.FOLDER_INDEX_DELTA_PAGES):
+        additional_params = {}
+        if index.cursor:
+            additional_params['cursor'] = index.cursor
+        result = client.make_request(DELTA_URL, token=dropbox_credentials.get('token'), secret=dropbox_credentials.get('secret'),
+                                     additional_params=additional_params, method=urlfetch.POST)
+        if result.status_code != 200:
+            raise FolderIndexException(result.status_code)
+        delta = json.loads(result.content)
+        changed.extend(index.apply(delta))
+        if not delta.get('has_more'):
+            break
+    # Dropbox hands out a new cursor every time, storing it alone is not
+    # worth a datastore write, the old one gives the same (empty) delta
+    if index.version != version or index.complete != complete:
+        save(owner, index)
+    else:
+        _local.set(owner, index)
+    return changed
+
+def _key(owner):
+    return 'index:%s' % owner
+
+def _version_key(owner):
+    return 'version:%s' % owner
+
+def _sync_key(owner):
+    return 'sync:%s' % owner
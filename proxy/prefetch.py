@@ -0,0 +1,146 @@
+"""
+Background prefetch of the decks a user is likely to open next.
+
+After /slides has been shown, the top PREFETCH_DECKS candidates are loaded
+into the content cache by a task, so the first /file of the deck the user
+picks is a cache hit. Candidates are the decks the user opened last, then
+the most recently modified ones, leaving out what is cached already or too
+big to be.
+
+Per user there is at most one prefetch task, fetching PREFETCH_CONCURRENCY
+files at a time and no more than PREFETCH_BYTES within PREFETCH_WINDOW
+seconds. Every schedule gets a new generation, and opening a deck drops the
+current one, so a task that finds its generation gone stops before its next
+batch instead of competing with the deck that is actually being loaded.
+"""
+
+import binascii
+import os
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from django.utils import simplejson as json
+
+import config
+from cache import content
+from proxy import files
+
+NAMESPACE = 'prefetch'
+
+# how many opened decks are remembered per user
+RECENT_OPENS = 20
+
+def record_open(owner, path):
+    """
+    Remembers that `owner` opened `path` and cancels any prefetch of theirs,
+    the user has moved on from the listing.
+    """
+    if not config.PREFETCH:
+        return
+    opened = memcache.get(_opens_key(owner), namespace=NAMESPACE) or []
+    opened = [path] + [other for other in opened if other != path][:RECENT_OPENS - 1]
+    memcache.set(_opens_key(owner), opened, namespace=NAMESPACE)
+    memcache.delete(_generation_key(owner), namespace=NAMESPACE)
+
+def candidates(owner, index):
+    """
+    The decks worth prefetching for `owner`, best first.
+    """
+    opened = memcache.get(_opens_key(owner), namespace=NAMESPACE) or []
+    entries = index.entries
+    ranked = []
+    seen = set()
+    for path in opened:
+        entry = entries.get(path.lower())
+        if entry is not None:
+            ranked.append(entry)
+            seen.add(entry['path'])
+    for entry in index.files('modified', True)[:config.PREFETCH_DECKS * 4]:
+        if entry['path'] not in seen:
+            ranked.append(entry)
+    ranked = [entry for entry in ranked
+              if entry.get('mime_type') == 'application/pdf'
+              and content.file_cache.cacheable(entry.get('bytes', 0))
+              and entry.get('bytes', 0) <= config.PREFETCH_BYTES]
+    return content.file_cache.missing(owner, ranked[:config.PREFETCH_DECKS * 2])[:config.PREFETCH_DECKS]
+
+def schedule(owner, dropbox_credentials, index):
+    """
+    Queues a prefetch task for `owner` unless one was queued within
+    PREFETCH_INTERVAL seconds.
+    """
+    if not config.PREFETCH:
+        return
+    if not memcache.add(_scheduled_key(owner), True, time=config.PREFETCH_INTERVAL, namespace=NAMESPACE):
+        return
+    entries = candidates(owner, index)
+    if not entries:
+        return
+    generation = binascii.hexlify(os.urandom(8))
+    memcache.set(_generation_key(owner), generation, time=config.PREFETCH_WINDOW, namespace=NAMESPACE)
+    taskqueue.add(url='/tasks/prefetch',
+                  params={'owner': owner,
+                          'token': dropbox_credentials.get('token'),
+                          'secret': dropbox_credentials.get('secret'),
+                          'generation': generation,
+                          'entries': json.dumps(entries)})
+
+def run(client, dropbox_credentials, owner, generation, entries):
+    """
+    Loads `entries` into the content cache, PREFETCH_CONCURRENCY at a time,
+    while the generation is current and the byte budget lasts. Returns the
+    number of files fetched.
+    """
+    fetched = 0
+    while entries:
+        if memcache.get(_generation_key(owner), namespace=NAMESPACE) != generation:
+            _logger.info('Prefetch for %s cancelled after %d files' % (owner, fetched))
+            break
+        batch = []
+        for entry in entries[:config.PREFETCH_CONCURRENCY]:
+            if _spend(owner, entry.get('bytes', 0)):
+                batch.append(entry)
+        entries = entries[config.PREFETCH_CONCURRENCY:]
+        if not batch:
+            _logger.info('Prefetch budget of %s used up' % owner)
+            break
+        results = files.fetch_many(client, dropbox_credentials, [entry['path'] for entry in batch])
+        for entry, result in zip(batch, results):
+            if result.status_code != 200:
+                _logger.info('Could not prefetch %s: %s' % (entry['path'], result.status_code))
+                continue
+            metadata = json.loads(result.headers['x-dropbox-metadata'])
+            content.file_cache.set(owner, metadata['path'], metadata.get('rev'), result.content)
+            content.file_cache.set_revision(owner, metadata['path'], metadata)
+            fetched += 1
+    return fetched
+
+def _spend(owner, size):
+    """
+    Takes `size` bytes from the budget of `owner`, False if it would be
+    exceeded.
+    """
+    key = _bytes_key(owner)
+    memcache.add(key, 0, time=config.PREFETCH_WINDOW, namespace=NAMESPACE)
+    used = memcache.incr(key, size, namespace=NAMESPACE)
+    if used is None:
+        return False
+    if used > config.PREFETCH_BYTES:
+        memcache.decr(key, size, namespace=NAMESPACE)
+        return False
+    return True
+
+def _opens_key(owner):
+    return 'opens:%s' % owner
+
+def _generation_key(owner):
+    return 'generation:%s' % owner
+
+def _scheduled_key(owner):
+    return 'scheduled:%s' % owner
+
+def _bytes_key(owner):
+    return 'bytes:%s' % owner
@@ -0,0 +1,111 @@
+"""
+HTTP Range helpers for the /file proxy.
+
+Only single byte ranges are supported. Anything else (multiple ranges, other
+units, garbage) is treated as if no Range header had been sent, which is what
+RFC 2616 allows a server to do.
+"""
+
+import logging
+_logger = logging.getLogger(__name__)
+
+class UnsatisfiableRangeException(Exception):
+    pass
+
+def parse_range_header(value):
+    """
+    Parses a `Range` header into a (start, end) tuple.
+
+    Either side may be None: (500, None) is "bytes=500-" and (None, 500) is
+    the suffix form "bytes=-500". Returns None if the header is missing or
+    not something we are willing to serve as a partial response.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if not value.startswith('bytes='):
+        return None
+    spec = value[len('bytes='):].strip()
+    if ',' in spec or '-' not in spec:
+        return None
+    first, last = spec.split('-', 1)
+    first = first.strip()
+    last = last.strip()
+    start = None
+    end = None
+    try:
+        if first:
+            start = int(first)
+        if last:
+            end = int(last)
+    except ValueError:
+        return None
+    if start is None and end is None:
+        return None
+    if start is not None and end is not None and end < start:
+        return None
+    return (start, end)
+
+def resolve_range(byte_range, total):
+    """
+    Turns a parsed range into absolute, inclusive (start, end) offsets for a
+    resource of `total` bytes. Raises UnsatisfiableRangeException if the
+    range does not overlap the resource.
+    """
+    start, end = byte_range
+    if start is None:
+        if not end:
+            raise UnsatisfiableRangeException('Empty suffix range')
+        start = max(total - end, 0)
+        end = total - 1
+    elif end is None or end >= total:
+        end = total - 1
+    if start >= total:
+        raise UnsatisfiableRangeException('Range starts beyond %d bytes' % total)
+    return (start, end)
+
+def format_range_header(byte_range):
+    """
+    Serializes a parsed range back into a `Range` header value, e.g. for
+    forwarding it upstream.
+    """
+    start, end = byte_range
+    if start is None:
+        return 'bytes=-%d' % end
+    if end is None:
+        return 'bytes=%d-' % start
+    return 'bytes=%d-%d' % (start, end)
+
+def content_range(start, end, total):
+    return 'bytes %d-%d/%d' % (start, end, total)
+
+def parse_content_range(value):
+    """
+    Parses a `Content-Range` response header ("bytes 0-99/1234") into a
+    (start, end, total) tuple, or None.
+    """
+    if not value or not value.startswith('bytes '):
+        return None
+    try:
+        span, total = value[len('bytes '):].split('/', 1)
+        start, end = span.split('-', 1)
+        return (int(start), int(end), int(total))
+    except ValueError:
+        return None
+
+def if_range_matches(if_range, etag):
+    """
+    Checks an `If-Range` header against the current entity tag. A date
+    validator never matches, since we only know revisions, which means the
+    client gets the full entity as the spec requires.
+    """
+    if not if_range:
+        return True
+    return if_range.strip() == etag
+
+def iter_chunks(data, chunk_size):
+    """
+    Yields `data` in pieces of at most `chunk_size` bytes.
+    """
+    for offset in xrange(0, len(data), chunk_size):
+        yield data[offset:offset + chunk_size]
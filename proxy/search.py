@@ -0,0 +1,433 @@
+"""
+Per user full text index of the decks in the app folder.
+
+Maps every word on every page of every PDF to where it occurs, so a search
+can link straight to the slide. Queries match pages that have all of their
+words, the last one also as a prefix, and rank decks by how many of their
+pages match.
+
+The index is kept packed: the sorted terms, an array of offsets into a
+string of varint encoded (deck, page) postings, and the decks. Queries
+bisect the terms and decode only the postings they need, so a loaded index
+costs a few objects per term instead of one per posting. It is stored zlib
+compressed in the datastore, split over as many entities as the size limit
+requires, and kept in an in-process LRU checked against a version in
+memcache.
+
+Updates are incremental. Whenever the folder index has a version the search
+index has not caught up with, /slides queues a task that compares the revs
+of both and extracts the text of the decks that are new or changed,
+SEARCH_BATCH of them per task with up to SEARCH_BATCH_BYTES of downloads in
+flight together, queueing the next task until none are left. Decks that are
+gone or changed are dropped from the postings when the index is repacked.
+"""
+
+import array
+import binascii
+import bisect
+import os
+import re
+import struct
+import sys
+import unicodedata
+import zlib
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from django.utils import simplejson as json
+
+import config
+from cache import content
+from cache import lru
+from pdf import text
+from proxy import files
+from proxy import folders
+
+NAMESPACE = 'search'
+
+# what the datastore takes per entity, with room for the rest of it
+PART_BYTES = 900 * 1000
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+MIN_WORD = 2
+MAX_WORD = 40
+
+class SearchIndex(db.Model):
+    """
+    Keyed by 'search:<owner>:<part>'. `data` is a piece of the compressed
+    index, part 0 knows how many pieces there are.
+    """
+    data = db.BlobProperty()
+    parts = db.IntegerProperty(default=1)
+    updated = db.DateTimeProperty(auto_now=True)
+
+def words(value):
+    """
+    The index terms in `value`: lower cased words of MIN_WORD to MAX_WORD
+    characters, with ligatures and the like taken apart.
+    """
+    if isinstance(value, str):
+        value = value.decode('utf8', 'replace')
+    value = unicodedata.normalize('NFKC', value).lower()
+    return [word for word in _WORD.findall(value) if MIN_WORD <= len(word) <= MAX_WORD]
+
+def _encode(postings):
+    """
+    Varint encodes sorted (deck, page) pairs as the deck delta followed by
+    the page, or by the page delta if the deck did not change.
+    """
+    out = []
+    previous_deck = previous_page = 0
+    for deck, page in postings:
+        if deck != previous_deck:
+            values = (deck - previous_deck, page)
+        else:
+            values = (0, page - previous_page)
+        previous_deck, previous_page = deck, page
+        for value in values:
+            while value > 0x7f:
+                out.append(chr(0x80 | (value & 0x7f)))
+                value >>= 7
+            out.append(chr(value))
+    return ''.join(out)
+
+def _decode(data):
+    postings = []
+    values = []
+    value = shift = 0
+    for char in data:
+        byte = ord(char)
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        value = shift = 0
+    deck = page = 0
+    for index in xrange(0, len(values) - 1, 2):
+        if values[index]:
+            deck += values[index]
+            page = values[index + 1]
+        else:
+            page += values[index + 1]
+        postings.append((deck, page))
+    return postings
+
+class Index(object):
+    """
+    `decks` holds a [path, rev, page count] list per deck, the postings
+    refer to decks by their position in it.
+    """
+
+    def __init__(self, version='', folder_version=None, decks=None,
+                 terms=None, offsets=None, postings='', parts=0):
+        self.version = version
+        self.folder_version = folder_version
+        self.decks = decks or []
+        self.terms = terms or []
+        self.offsets = offsets or array.array('I', [0])
+        self.postings = postings
+        self.parts = parts
+
+    def revs(self):
+        """
+        The rev of every indexed deck, by lower cased path.
+        """
+        return dict([(path.lower(), rev) for path, rev, pages in self.decks])
+
+    def _postings(self, position):
+        return _decode(self.postings[self.offsets[position]:self.offsets[position + 1]])
+
+    def _matching(self, word, prefix):
+        position = bisect.bisect_left(self.terms, word)
+        if not prefix:
+            if position < len(self.terms) and self.terms[position] == word:
+                return set(self._postings(position))
+            return set()
+        found = set()
+        for position in xrange(position, min(position + config.SEARCH_PREFIX_TERMS, len(self.terms))):
+            if not self.terms[position].startswith(word):
+                break
+            found.update(self._postings(position))
+        return found
+
+    def search(self, query, limit=None):
+        """
+        Returns ([path, rev, page count], pages) tuples of the decks with
+        pages matching `query`, best first.
+        """
+        query = words(query)
+        if not query:
+            return []
+        matched = None
+        for position, word in enumerate(query):
+            found = self._matching(word, position == len(query) - 1)
+            if matched is None:
+                matched = found
+            else:
+                matched &= found
+            if not matched:
+                return []
+        pages = {}
+        for deck, page in matched:
+            pages.setdefault(deck, []).append(page)
+        results = [(self.decks[deck], sorted(found)) for deck, found in pages.items()]
+        results.sort(key=lambda result: (-len(result[1]), result[0][0].lower()))
+        return results[:limit or config.SEARCH_RESULTS]
+
+    def update(self, removed, added):
+        """
+        Returns a new index without the decks at the lower cased paths in
+        `removed` and with `added`, (metadata, page texts) tuples.
+        """
+        removed = set(removed)
+        decks = []
+        renumbered = {}
+        for deck, entry in enumerate(self.decks):
+            if entry[0].lower() not in removed:
+                renumbered[deck] = len(decks)
+                decks.append(entry)
+        postings = {}
+        for position, term in enumerate(self.terms):
+            kept = [(renumbered[deck], page) for deck, page in self._postings(position)
+                    if deck in renumbered]
+            if kept:
+                postings[term] = kept
+        for metadata, pages in added:
+            deck = len(decks)
+            decks.append([metadata['path'], metadata.get('rev'), len(pages)])
+            for page, page_text in enumerate(pages):
+                for word in set(words(page_text)):
+                    postings.setdefault(word, []).append((deck, page + 1))
+        terms = postings.keys()
+        terms.sort()
+        offsets = array.array('I', [0])
+        packed = []
+        size = 0
+        for term in terms:
+            encoded = _encode(postings[term])
+            packed.append(encoded)
+            size += len(encoded)
+            offsets.append(size)
+        return Index(binascii.hexlify(os.urandom(8)), self.folder_version, decks,
+                     terms, offsets, ''.join(packed), self.parts)
+
+    def dumps(self):
+        header = json.dumps({'version': self.version,
+                             'folder_version': self.folder_version,
+                             'decks': self.decks}, separators=(',', ':'))
+        terms = u'\n'.join(self.terms).encode('utf8')
+        offsets = array.array('I', self.offsets)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        offsets = offsets.tostring()
+        return zlib.compress(struct.pack('<III', len(header), len(terms), len(offsets))
+                             + header + terms + offsets + self.postings)
+
+    @classmethod
+    def loads(cls, data, parts=0):
+        data = zlib.decompress(data)
+        lengths = struct.unpack('<III', data[:12])
+        position = 12
+        header = json.loads(data[position:position + lengths[0]])
+        position += lengths[0]
+        terms = data[position:position + lengths[1]].decode('utf8')
+        terms = terms and terms.split(u'\n') or []
+        position += lengths[1]
+        offsets = array.array('I')
+        offsets.fromstring(data[position:position + lengths[2]])
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        position += lengths[2]
+        return cls(header['version'], header['folder_version'], header['decks'],
+                   terms, offsets, data[position:], parts)
+
+def _size(index):
+    return len(index.postings) + index.offsets.itemsize * len(index.offsets) + 64 * len(index.terms)
+
+_local = lru.LRUCache(config.SEARCH_LOCAL_BYTES, sizeof=_size)
+
+def load(owner):
+    """
+    The search index of `owner`, empty if there is none yet.
+    """
+    index = _local.get(owner)
+    version = memcache.get(_version_key(owner), namespace=NAMESPACE)
+    if index is not None and index.version == version:
+        return index
+    first = SearchIndex.get_by_key_name(_key(owner, 0))
+    if first is None:
+        return Index()
+    pieces = [first.data]
+    if first.parts > 1:
+        rest = SearchIndex.get_by_key_name([_key(owner, part) for part in xrange(1, first.parts)])
+        if None in rest:
+            _logger.warning('Parts of the search index of %s are missing' % owner)
+            return Index()
+        pieces.extend([part.data for part in rest])
+    try:
+        index = Index.loads(''.join(pieces), first.parts)
+    except (zlib.error, struct.error, ValueError), e:
+        # the parts of two saves, the next load gets them all from one
+        _logger.warning('Could not read the search index of %s: %s' % (owner, e))
+        return Index()
+    memcache.set(_version_key(owner), index.version, namespace=NAMESPACE)
+    _local.set(owner, index)
+    return index
+
+def save(owner, index):
+    data = index.dumps()
+    pieces = [data[offset:offset + PART_BYTES] for offset in xrange(0, len(data), PART_BYTES)]
+    entities = [SearchIndex(key_name=_key(owner, part), data=db.Blob(piece), parts=len(pieces))
+                for part, piece in enumerate(pieces)]
+    db.put(entities)
+    if index.parts > len(pieces):
+        db.delete([db.Key.from_path(SearchIndex.kind(), _key(owner, part))
+                   for part in xrange(len(pieces), index.parts)])
+    index.parts = len(pieces)
+    _local.set(owner, index)
+    memcache.set(_version_key(owner), index.version, namespace=NAMESPACE)
+
+def _searchable(entry):
+    return (entry.get('mime_type') == 'application/pdf'
+            and entry.get('bytes', 0) <= config.SEARCH_MAX_BYTES)
+
+def pending(index, folder_index):
+    """
+    Compares the revs of the search index with the folder index. Returns
+    the lower cased paths of the decks that are gone and the entries of
+    those that are new or changed.
+    """
+    known = index.revs()
+    wanted = set()
+    changed = []
+    # the newest first, they are the likeliest to be searched for
+    for entry in folder_index.files('modified', True):
+        if _searchable(entry):
+            path = entry['path'].lower()
+            wanted.add(path)
+            if known.get(path) != entry.get('rev'):
+                changed.append(entry)
+    gone = [path for path in known if path not in wanted]
+    return gone, changed
+
+def schedule(owner, dropbox_credentials, folder_index):
+    """
+    Queues an update task for `owner` if the search index is behind the
+    folder index and none was queued within SEARCH_INTERVAL seconds.
+    """
+    if not config.SEARCH:
+        return
+    if memcache.get(_folder_version_key(owner), namespace=NAMESPACE) == folder_index.version:
+        return
+    if not memcache.add(_scheduled_key(owner), True, time=config.SEARCH_INTERVAL, namespace=NAMESPACE):
+        return
+    _queue(owner, dropbox_credentials)
+
+def _queue(owner, dropbox_credentials):
+    taskqueue.add(url='/tasks/search',
+                  params={'owner': owner,
+                          'token': dropbox_credentials.get('token'),
+                          'secret': dropbox_credentials.get('secret')})
+
+def run(client, dropbox_credentials, owner):
+    """
+    Brings the index of `owner` up to date by one batch and queues the next
+    task if there is more to do. Only one task works on an index at a time.
+    Returns the number of decks extracted.
+    """
+    if not memcache.add(_lease_key(owner), True, time=config.SEARCH_LEASE, namespace=NAMESPACE):
+        _logger.info('The search index of %s is being updated already' % owner)
+        return 0
+    try:
+        folder_index = folders.load(owner)
+        index = load(owner)
+        gone, changed = pending(index, folder_index)
+        batch = changed[:config.SEARCH_BATCH]
+        added = _extract(client, dropbox_credentials, owner, batch)
+        if gone or added:
+            index = index.update(gone + [metadata['path'].lower() for metadata, pages in added], added)
+        # decks that could not be fetched keep the index behind the folder,
+        # so they are tried again
+        done = len(changed) == len(batch) == len(added) and folder_index.complete
+        if done:
+            index.folder_version = folder_index.version
+        if gone or added or done:
+            save(owner, index)
+        if done:
+            memcache.set(_folder_version_key(owner), folder_index.version, namespace=NAMESPACE)
+    finally:
+        memcache.delete(_lease_key(owner), namespace=NAMESPACE)
+    # a batch that got nowhere would only be tried again and again, /slides
+    # schedules it again after SEARCH_INTERVAL
+    if (len(changed) > len(batch) or len(added) < len(batch)) and added:
+        _queue(owner, dropbox_credentials)
+    return len(added)
+
+def _extract(client, dropbox_credentials, owner, entries):
+    """
+    Returns (metadata, page texts) tuples for `entries`. Decks that cannot
+    be read are indexed without pages, so they are not tried again until
+    their rev changes. Decks not cached are fetched in groups of at most
+    SEARCH_BATCH_BYTES, and every body is dropped once its text is out.
+    """
+    added = []
+    missing = []
+    for entry in entries:
+        body = content.file_cache.get(owner, entry['path'], entry.get('rev'))
+        if body is None:
+            missing.append(entry)
+        else:
+            added.append((entry, _pages(entry['path'], body)))
+    for group in _groups(missing):
+        results = files.fetch_many(client, dropbox_credentials, [entry['path'] for entry in group])
+        for position, entry in enumerate(group):
+            result = results[position]
+            results[position] = None
+            if result.status_code == 200:
+                added.append((json.loads(result.headers['x-dropbox-metadata']),
+                              _pages(entry['path'], result.content)))
+            else:
+                # not recorded, so the next task tries again
+                _logger.info('Could not fetch %s for the search index: %s' % (entry['path'], result.status_code))
+            result = None
+    return added
+
+def _groups(entries):
+    group = []
+    size = 0
+    for entry in entries:
+        if group and size + entry.get('bytes', 0) > config.SEARCH_BATCH_BYTES:
+            yield group
+            group = []
+            size = 0
+        group.append(entry)
+        size += entry.get('bytes', 0)
+    if group:
+        yield group
+
+def _pages(path, body):
+    try:
+        return text.extract(body)
+    except text.TextException, e:
+        _logger.info('No text in %s: %s' % (path, e))
+        return []
+
+def _key(owner, part):
+    return 'search:%s:%d' % (owner, part)
+
+def _version_key(owner):
+    return 'version:%s' % owner
+
+def _folder_version_key(owner):
+    return 'folder_version:%s' % owner
+
+def _scheduled_key(owner):
+    return 'scheduled:%s' % owner
+
+def _lease_key(owner):
+    return 'lease:%s' % owner
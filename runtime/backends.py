@@ -0,0 +1,95 @@
+"""
+Local stand-ins for the App Engine services the app uses.
+
+The App Engine SDK routes every API call (memcache, urlfetch, datastore, task
+queue, channel) through apiproxy_stub_map, which is also how the SDK runs the
+app locally. `install` registers backends that work in ordinary worker
+processes:
+
+- memcache: in-process (the SDK stub) or shared, against memcached servers
+- urlfetch: pooled keep-alive connections, async calls on threads
+- datastore: a local SQLite file, so AuthToken and Presentation rows survive
+  restarts and can be shared by the workers of one host
+- task queue: tasks run in the worker that queued them
+
+The SDK (and with it webapp, db and django) still has to be importable,
+`setup_paths` puts it on sys.path. Needs Python 2.6 or later.
+"""
+
+import os
+import sys
+import tempfile
+import urlparse
+
+import logging
+_logger = logging.getLogger(__name__)
+
+SDK_LOCATIONS = ('/usr/local/google_appengine',
+                 '/opt/google_appengine',
+                 os.path.expanduser('~/google_appengine'))
+
+def setup_paths(sdk_root=None):
+    """
+    Makes the App Engine SDK and its bundled libraries importable.
+    """
+    candidates = SDK_LOCATIONS
+    if sdk_root:
+        candidates = (sdk_root,)
+    for candidate in candidates:
+        if os.path.exists(os.path.join(candidate, 'dev_appserver.py')):
+            sys.path.insert(0, candidate)
+            import dev_appserver
+            dev_appserver.fix_sys_path()
+            return candidate
+    raise ImportError('App Engine SDK not found in %s, set GAE_SDK' % ', '.join(candidates))
+
+def install(app_id='slidecollab', memcache_servers=None, datastore_path=None,
+            fetch_pool_size=8, upstream_hosts=None):
+    """
+    Registers the local backends and returns the task queue stub, whose
+    `application` has to be set before queued tasks can run.
+    `upstream_hosts` maps host names to base URLs to send their requests to.
+    """
+    os.environ.setdefault('APPLICATION_ID', app_id)
+    os.environ.setdefault('AUTH_DOMAIN', 'gmail.com')
+    os.environ.setdefault('SERVER_SOFTWARE', 'Development/portable')
+    os.environ.setdefault('CURRENT_VERSION_ID', '1.1')
+    os.environ.setdefault('USER_EMAIL', '')
+
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.api.channel import channel_service_stub
+    from runtime import taskqueue_stub
+    from runtime import urlfetch_stub
+
+    apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+    apiproxy = apiproxy_stub_map.apiproxy
+
+    if memcache_servers:
+        from runtime import memcache_stub
+        apiproxy.RegisterStub('memcache', memcache_stub.SharedMemcacheStub(memcache_servers))
+    else:
+        from google.appengine.api.memcache import memcache_stub
+        apiproxy.RegisterStub('memcache', memcache_stub.MemcacheServiceStub())
+
+    rewrites = {}
+    for host, base_url in (upstream_hosts or {}).items():
+        target = urlparse.urlsplit(base_url)
+        rewrites[host] = (target.scheme, target.hostname,
+                          target.port or (target.scheme == 'https' and 443 or 80))
+    apiproxy.RegisterStub('urlfetch', urlfetch_stub.PooledURLFetchStub(fetch_pool_size, rewrites))
+
+    if datastore_path is None:
+        datastore_path = os.path.join(tempfile.gettempdir(), '%s.datastore' % app_id)
+    try:
+        from google.appengine.datastore import datastore_sqlite_stub
+        datastore = datastore_sqlite_stub.DatastoreSqliteStub(app_id, datastore_path)
+    except ImportError:
+        # older SDKs only have the file stub, which is not safe to share
+        from google.appengine.api import datastore_file_stub
+        datastore = datastore_file_stub.DatastoreFileStub(app_id, '%s.%d' % (datastore_path, os.getpid()), None)
+    apiproxy.RegisterStub('datastore_v3', datastore)
+
+    taskqueue = taskqueue_stub.LocalTaskQueueStub()
+    apiproxy.RegisterStub('taskqueue', taskqueue)
+    apiproxy.RegisterStub('channel', channel_service_stub.ChannelServiceStub())
+    return taskqueue
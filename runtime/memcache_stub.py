@@ -0,0 +1,128 @@
+"""
+memcache backend shared by all worker processes on a host (or several).
+
+Forwards the memcache API to one or more memcached servers through the
+python-memcached client. Keys are hashed together with their namespace, and
+the flags the App Engine API uses to tell pickled from plain values travel
+in front of each value, since memcached's own flags belong to the client.
+"""
+
+import hashlib
+import struct
+import time
+
+import memcache as memcached
+
+from google.appengine.api import apiproxy_stub
+from google.appengine.api import memcache
+from google.appengine.api.memcache import memcache_service_pb
+
+MemcacheSetRequest = memcache_service_pb.MemcacheSetRequest
+MemcacheSetResponse = memcache_service_pb.MemcacheSetResponse
+MemcacheDeleteResponse = memcache_service_pb.MemcacheDeleteResponse
+MemcacheIncrementRequest = memcache_service_pb.MemcacheIncrementRequest
+
+_FLAGS = struct.Struct('!I')
+
+# memcached reads expirations beyond 30 days as absolute timestamps
+_RELATIVE_LIMIT = 30 * 24 * 60 * 60
+
+class SharedMemcacheStub(apiproxy_stub.APIProxyStub):
+
+    def __init__(self, servers, service_name='memcache'):
+        apiproxy_stub.APIProxyStub.__init__(self, service_name)
+        self.client = memcached.Client(servers, cache_cas=True)
+        # memcached cas ids are only known to the client, hand out our own
+        self._cas_ids = {}
+
+    def _key(self, namespace, key):
+        return hashlib.sha1('%s\0%s' % (namespace, key)).hexdigest()
+
+    def _Dynamic_Get(self, request, response):
+        namespace = request.name_space()
+        keys = dict([(self._key(namespace, key), key) for key in request.key_list()])
+        if request.for_cas():
+            found = {}
+            for hashed in keys:
+                value = self.client.gets(hashed)
+                if value is not None:
+                    found[hashed] = value
+        else:
+            found = self.client.get_multi(keys.keys())
+        for hashed, value in found.iteritems():
+            item = response.add_item()
+            item.set_key(keys[hashed])
+            if value.isdigit():
+                # a counter written by incr, flagged values never start
+                # with a digit
+                item.set_flags(memcache.TYPE_INT)
+                item.set_value(value)
+            else:
+                item.set_flags(_FLAGS.unpack(value[:_FLAGS.size])[0])
+                item.set_value(value[_FLAGS.size:])
+            if request.for_cas():
+                cas_id = self._cas_ids[hashed] = self._cas_ids.get(hashed, 0) + 1
+                item.set_cas_id(cas_id)
+
+    def _Dynamic_Set(self, request, response):
+        namespace = request.name_space()
+        for item in request.item_list():
+            hashed = self._key(namespace, item.key())
+            if item.flags() in (memcache.TYPE_INT, memcache.TYPE_LONG) and item.value().isdigit():
+                # stored bare so incr keeps working on it
+                value = item.value()
+            else:
+                value = _FLAGS.pack(item.flags()) + item.value()
+            expires = int(item.expiration_time())
+            if expires > _RELATIVE_LIMIT and expires < time.time():
+                expires = 0
+            policy = item.set_policy()
+            if policy == MemcacheSetRequest.ADD:
+                stored = self.client.add(hashed, value, expires)
+            elif policy == MemcacheSetRequest.REPLACE:
+                stored = self.client.replace(hashed, value, expires)
+            elif policy == MemcacheSetRequest.CAS:
+                if self._cas_ids.pop(hashed, None) != item.cas_id():
+                    response.add_set_status(MemcacheSetResponse.EXISTS)
+                    continue
+                stored = self.client.cas(hashed, value, expires)
+            else:
+                stored = self.client.set(hashed, value, expires)
+            if stored:
+                response.add_set_status(MemcacheSetResponse.STORED)
+            else:
+                response.add_set_status(MemcacheSetResponse.NOT_STORED)
+
+    def _Dynamic_Delete(self, request, response):
+        namespace = request.name_space()
+        for item in request.item_list():
+            if self.client.delete(self._key(namespace, item.key())):
+                response.add_delete_status(MemcacheDeleteResponse.DELETED)
+            else:
+                response.add_delete_status(MemcacheDeleteResponse.NOT_FOUND)
+
+    def _Dynamic_Increment(self, request, response):
+        hashed = self._key(request.name_space(), request.key())
+        # counters are stored as plain numbers, like the App Engine stub does
+        if request.direction() == MemcacheIncrementRequest.DECREMENT:
+            value = self.client.decr(hashed, request.delta())
+        else:
+            value = self.client.incr(hashed, request.delta())
+        if value is None and request.has_initial_value():
+            initial = request.initial_value()
+            if request.direction() == MemcacheIncrementRequest.DECREMENT:
+                initial = max(initial - request.delta(), 0)
+            else:
+                initial = initial + request.delta()
+            if self.client.add(hashed, str(initial)):
+                value = initial
+            else:
+                value = self.client.incr(hashed, request.delta())
+        if value is not None:
+            response.set_new_value(int(value))
+
+    def _Dynamic_FlushAll(self, request, response):
+        self.client.flush_all()
+
+    def _Dynamic_Stats(self, request, response):
+        pass
@@ -0,0 +1,105 @@
+"""
+Task queue backend that runs tasks inside the worker that queued them.
+
+Each task becomes a timer that fires at its ETA and calls the WSGI
+application directly with a request marked as internal, which is what lets
+runtime.wsgi keep /tasks/ closed to the outside.
+"""
+
+import binascii
+import os
+import sys
+import threading
+import time
+from cStringIO import StringIO
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import apiproxy_stub
+from google.appengine.api.taskqueue import taskqueue_service_pb
+
+TaskQueueAddRequest = taskqueue_service_pb.TaskQueueAddRequest
+
+_METHODS = {
+    TaskQueueAddRequest.GET: 'GET',
+    TaskQueueAddRequest.POST: 'POST',
+    TaskQueueAddRequest.HEAD: 'HEAD',
+    TaskQueueAddRequest.PUT: 'PUT',
+    TaskQueueAddRequest.DELETE: 'DELETE',
+}
+
+INTERNAL = 'runtime.internal'
+
+class LocalTaskQueueStub(apiproxy_stub.APIProxyStub):
+
+    def __init__(self, service_name='taskqueue'):
+        apiproxy_stub.APIProxyStub.__init__(self, service_name)
+        self.application = None
+
+    def _Dynamic_Add(self, request, response):
+        response.set_chosen_task_name(self._schedule(request))
+
+    def _Dynamic_BulkAdd(self, request, response):
+        for add_request in request.add_request_list():
+            result = response.add_taskresult()
+            task_name = self._schedule(add_request)
+            result.set_result(taskqueue_service_pb.TaskQueueServiceError.OK)
+            result.set_chosen_task_name(task_name)
+
+    def _schedule(self, request):
+        task_name = request.task_name() or 'task-' + binascii.hexlify(os.urandom(8))
+        headers = [(header.key(), header.value()) for header in request.header_list()]
+        headers.append(('X-AppEngine-QueueName', request.queue_name() or 'default'))
+        headers.append(('X-AppEngine-TaskName', task_name))
+        delay = max(0.0, request.eta_usec() / 1e6 - time.time())
+        timer = threading.Timer(delay, self._run,
+                                (_METHODS.get(request.method(), 'POST'), request.url(),
+                                 headers, request.body()))
+        timer.setDaemon(True)
+        timer.start()
+        return task_name
+
+    def _run(self, method, url, headers, body):
+        if self.application is None:
+            _logger.error('Dropping task %s, no application to run it' % url)
+            return
+        path, _, query = url.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.0',
+            'CONTENT_LENGTH': str(len(body)),
+            'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': StringIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            INTERNAL: True,
+        }
+        for key, value in headers:
+            key = key.upper().replace('-', '_')
+            if key == 'CONTENT_TYPE':
+                environ[key] = value
+            else:
+                environ['HTTP_' + key] = value
+        if method == 'POST' and 'CONTENT_TYPE' not in environ:
+            environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+        status = []
+        def start_response(response_status, response_headers, exc_info=None):
+            status.append(response_status)
+        try:
+            for chunk in self.application(environ, start_response):
+                pass
+        except Exception:
+            _logger.exception('Task %s failed' % url)
+            return
+        if status and not status[0].startswith('2'):
+            _logger.warning('Task %s answered %s' % (url, status[0]))
@@ -0,0 +1,180 @@
+"""
+urlfetch backend for running outside of App Engine.
+
+Requests go out through httplib connections that are kept alive and pooled
+per (scheme, host, port) for the lifetime of the worker process. Async RPCs
+run on a thread of their own from the moment they are made, so
+OAuthClient.make_requests really has its requests in flight at the same time.
+
+Upstream hosts can be rewritten, e.g. to point api.dropbox.com at the fake
+Dropbox of the load test suite.
+"""
+
+import httplib
+import socket
+import sys
+import threading
+import urlparse
+
+import logging
+_logger = logging.getLogger(__name__)
+
+from google.appengine.api import apiproxy_rpc
+from google.appengine.api import apiproxy_stub
+from google.appengine.api import urlfetch_service_pb
+from google.appengine.runtime import apiproxy_errors
+
+_METHODS = {
+    urlfetch_service_pb.URLFetchRequest.GET: 'GET',
+    urlfetch_service_pb.URLFetchRequest.POST: 'POST',
+    urlfetch_service_pb.URLFetchRequest.HEAD: 'HEAD',
+    urlfetch_service_pb.URLFetchRequest.PUT: 'PUT',
+    urlfetch_service_pb.URLFetchRequest.DELETE: 'DELETE',
+}
+
+MAX_RESPONSE_SIZE = 32 * 1024 * 1024
+
+class ConnectionPool(object):
+    """
+    Idle keep-alive connections, at most `size` per host.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, host, port, timeout):
+        key = (scheme, host, port)
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                connection = idle.pop()
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection
+        finally:
+            self._lock.release()
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=timeout)
+        return httplib.HTTPConnection(host, port, timeout=timeout)
+
+    def put(self, scheme, host, port, connection):
+        key = (scheme, host, port)
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+class ThreadedRPC(apiproxy_rpc.RPC):
+    """
+    Starts the call on a thread when it is made and joins it on wait. The
+    state of a call is private to apiproxy_rpc.RPC, so _WaitImpl sets it,
+    and runs the callback, the way the base class does.
+    """
+
+    def _MakeCallImpl(self):
+        apiproxy_rpc.RPC._MakeCallImpl(self)
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self.stub.MakeSyncCall(self.package, self.call, self.request, self.response)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def _WaitImpl(self):
+        self._thread.join()
+        try:
+            if self._exc_info is not None:
+                _, self._RPC__exception, self._RPC__traceback = self._exc_info
+                self._exc_info = None
+        finally:
+            self._RPC__state = apiproxy_rpc.RPC.FINISHING
+            self._RPC__Callback()
+        return True
+
+class PooledURLFetchStub(apiproxy_stub.APIProxyStub):
+
+    def __init__(self, pool_size=8, rewrites=None, service_name='urlfetch'):
+        """
+        `rewrites` maps host names to the (scheme, host, port) requests for
+        them should be sent to instead.
+        """
+        apiproxy_stub.APIProxyStub.__init__(self, service_name)
+        self.pool = ConnectionPool(pool_size)
+        self.rewrites = rewrites or {}
+
+    def CreateRPC(self):
+        return ThreadedRPC(stub=self)
+
+    def _Dynamic_Fetch(self, request, response):
+        method = _METHODS.get(request.method())
+        if method is None:
+            raise apiproxy_errors.ApplicationError(
+                urlfetch_service_pb.URLFetchServiceError.INVALID_URL)
+        url = urlparse.urlsplit(request.url())
+        scheme = url[0]
+        if scheme not in ('http', 'https'):
+            raise apiproxy_errors.ApplicationError(
+                urlfetch_service_pb.URLFetchServiceError.INVALID_URL)
+        host = url.hostname
+        port = url.port or (scheme == 'https' and 443 or 80)
+        if host in self.rewrites:
+            scheme, host, port = self.rewrites[host]
+        path = url[2] or '/'
+        if url[3]:
+            path += '?' + url[3]
+        headers = {}
+        for header in request.header_list():
+            headers[header.key()] = header.value()
+        payload = None
+        if request.has_payload():
+            payload = request.payload()
+        timeout = 5.0
+        if request.has_deadline():
+            timeout = request.deadline()
+
+        # a pooled connection may have been closed by the server meanwhile,
+        # in which case the request is repeated once on a fresh one
+        for attempt in (0, 1):
+            connection = self.pool.get(scheme, host, port, timeout)
+            try:
+                connection.request(method, path, payload, headers)
+                result = connection.getresponse()
+                content = result.read(MAX_RESPONSE_SIZE + 1)
+                break
+            except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error), e:
+                connection.close()
+                if isinstance(e, socket.timeout):
+                    raise apiproxy_errors.ApplicationError(
+                        urlfetch_service_pb.URLFetchServiceError.DEADLINE_EXCEEDED, str(e))
+                if attempt:
+                    raise apiproxy_errors.ApplicationError(
+                        urlfetch_service_pb.URLFetchServiceError.FETCH_ERROR, str(e))
+
+        truncated = len(content) > MAX_RESPONSE_SIZE
+        if result.will_close or truncated:
+            # the rest of a truncated body is still on the wire
+            connection.close()
+        else:
+            self.pool.put(scheme, host, port, connection)
+
+        response.set_statuscode(result.status)
+        for key, value in result.getheaders():
+            header = response.add_header()
+            header.set_key(key)
+            header.set_value(value)
+        if truncated:
+            content = content[:MAX_RESPONSE_SIZE]
+            response.set_contentwastruncated(True)
+        response.set_content(content)
+        response.set_finalurl(request.url())
@@ -0,0 +1,79 @@
+"""
+The application as a plain WSGI callable, for any WSGI server:
+
+    GAE_SDK=/path/to/google_appengine gunicorn -w 4 runtime.wsgi:application
+
+or the pre-forking server in serve.py. Backends are picked from the
+environment:
+
+    GAE_SDK           location of the App Engine SDK
+    MEMCACHE_SERVERS  comma separated host:port list, in-process if unset
+    DATASTORE_PATH    SQLite file for the datastore
+    FETCH_POOL_SIZE   idle keep-alive connections per upstream host
+    UPSTREAM_HOSTS    comma separated host=base URL pairs to redirect
+                      upstream requests, e.g. to bench/fake_dropbox.py
+    ADMIN_TOKEN       what callers of /tasks/ and /metrics other than the
+                      task queue send as X-Admin-Token, e.g. a cron job or
+                      metrics scraper. Without it only the task queue gets in.
+
+Import this after forking, every worker needs backends of its own.
+"""
+
+import hmac
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runtime import backends
+
+backends.setup_paths(os.environ.get('GAE_SDK'))
+
+_memcache_servers = None
+if os.environ.get('MEMCACHE_SERVERS'):
+    _memcache_servers = os.environ['MEMCACHE_SERVERS'].split(',')
+
+_upstream_hosts = {}
+if os.environ.get('UPSTREAM_HOSTS'):
+    for _pair in os.environ['UPSTREAM_HOSTS'].split(','):
+        _host, _base_url = _pair.split('=', 1)
+        _upstream_hosts[_host] = _base_url
+
+_taskqueue = backends.install(memcache_servers=_memcache_servers,
+                              datastore_path=os.environ.get('DATASTORE_PATH'),
+                              fetch_pool_size=int(os.environ.get('FETCH_POOL_SIZE', '8')),
+                              upstream_hosts=_upstream_hosts)
+
+import config
+import main
+from handlers import lazy
+from runtime import taskqueue_stub
+
+if config.WARMUP_ON_START:
+    lazy.warmup()
+
+_ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# login: admin in app.yaml
+_ADMIN_PATHS = ('/tasks/', '/metrics')
+
+def application(environ, start_response):
+    """
+    main.application, with the admin paths reserved for queued tasks and
+    callers with the admin token. The peer address proves nothing, behind
+    a local reverse proxy every request comes from 127.0.0.1.
+    """
+    if environ.get('PATH_INFO', '').startswith(_ADMIN_PATHS):
+        if not environ.get(taskqueue_stub.INTERNAL) and not _admin(environ):
+            start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+            return ['Forbidden']
+    return main.application(environ, start_response)
+
+def _admin(environ):
+    token = environ.get('HTTP_X_ADMIN_TOKEN')
+    if not _ADMIN_TOKEN or not token:
+        return False
+    # compare digests, so the time taken says nothing about the token
+    return (hmac.new(_ADMIN_TOKEN, token).digest() ==
+            hmac.new(_ADMIN_TOKEN, _ADMIN_TOKEN).digest())
+
+_taskqueue.application = application
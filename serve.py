@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Runs the app on a pre-forking WSGI server, outside of App Engine.
+
+    GAE_SDK=/path/to/google_appengine python serve.py --port 8080 --workers 4
+
+All workers accept connections from one listening socket. Backends are
+configured through the environment, see runtime/wsgi.py. Use
+--memcache/MEMCACHE_SERVERS with more than one worker, otherwise every
+worker caches on its own.
+"""
+
+import optparse
+import os
+import signal
+import socket
+import sys
+import time
+from SocketServer import ThreadingMixIn
+from wsgiref import simple_server
+
+import logging
+_logger = logging.getLogger(__name__)
+
+class QuietHandler(simple_server.WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        _logger.debug(format % args)
+
+class Server(simple_server.WSGIServer):
+    pass
+
+class ThreadingServer(ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+
+def serve(listener, threads):
+    # backends are set up per worker, after the fork
+    from runtime import wsgi
+    server_class = threads and ThreadingServer or Server
+    server = server_class(listener.getsockname(), QuietHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    server.server_address = listener.getsockname()
+    server.server_name = socket.getfqdn(server.server_address[0])
+    server.server_port = server.server_address[1]
+    server.setup_environ()
+    server.set_app(wsgi.application)
+    server.serve_forever()
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--workers', type='int', default=2)
+    parser.add_option('--threads', action='store_true', default=False,
+                      help='serve requests on threads within each worker')
+    parser.add_option('--memcache', default=None,
+                      help='comma separated memcached servers shared by the workers')
+    parser.add_option('--datastore', default=None, help='SQLite file for the datastore')
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if options.memcache:
+        os.environ['MEMCACHE_SERVERS'] = options.memcache
+    if options.datastore:
+        os.environ['DATASTORE_PATH'] = options.datastore
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((options.host, options.port))
+    listener.listen(128)
+
+    workers = {}
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                serve(listener, options.threads)
+            finally:
+                os._exit(1)
+        workers[pid] = time.time()
+
+    def stop(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for i in xrange(options.workers):
+        spawn()
+    _logger.info('Serving on %s:%d with %d workers' % (options.host, options.port, options.workers))
+    while True:
+        pid, status = os.wait()
+        started = workers.pop(pid, None)
+        _logger.warning('Worker %d exited with status %d' % (pid, status))
+        if started is not None and time.time() - started < 1:
+            # do not spin if workers die right away, e.g. no SDK found
+            time.sleep(1)
+        spawn()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Encoding of session cookies.
+
+Current cookies look like `v1.<payload>.<signature>`: the payload is the
+session as compact JSON and the signature an HMAC-SHA256 over version and
+payload, both urlsafe base64 without padding. Cookies written before the
+version prefix existed are rejected, their owners have to log in again.
+"""
+
+import base64
+import hashlib
+import hmac
+
+from django.utils import simplejson as json
+
+VERSION = 'v1'
+
+class NoValidCookieRepresentationException(Exception):
+    pass
+class InvalidSignatireException(Exception):
+    pass
+
+def encode(data, secret):
+    payload = _b64encode(json.dumps(data, separators=(',', ':')))
+    return sign('%s.%s' % (VERSION, payload), secret)
+
+def decode(value, secret):
+    """
+    Returns the session stored in a cookie value. Raises
+    InvalidSignatireException if it has been tampered with and
+    NoValidCookieRepresentationException if it is not a session at all.
+    """
+    if value.startswith(VERSION + '.'):
+        payload = unsign(value, secret)[len(VERSION) + 1:]
+        try:
+            return json.loads(_b64decode(payload))
+        except ValueError:
+            raise NoValidCookieRepresentationException('Cookie payload is not JSON!')
+    raise NoValidCookieRepresentationException('Cookie not signed!')
+
+def sign(value, secret):
+    return '%s.%s' % (value, _signature(value, secret))
+
+def unsign(signed, secret):
+    """
+    Checks and strips the signature `sign` appended to a value.
+    """
+    value, _, signature = signed.rpartition('.')
+    if not value:
+        raise NoValidCookieRepresentationException('Cookie not signed!')
+    if not _equal(_signature(value, secret), signature):
+        raise InvalidSignatireException('Signature of cookie not valid!')
+    return value
+
+def parse_cookie(header, name):
+    """
+    Returns the value of cookie `name` from a `Cookie` request header, or
+    None if it is not there.
+    """
+    if not header:
+        return None
+    prefix = name + '='
+    for part in header.split(';'):
+        part = part.strip()
+        if part.startswith(prefix):
+            return part[len(prefix):]
+    return None
+
+def _signature(value, secret):
+    return _b64encode(hmac.new(secret, value, hashlib.sha256).digest())
+
+def _equal(a, b):
+    # compare in constant time, so signatures cannot be guessed bytewise
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+def _b64decode(data):
+    data = str(data)
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
@@ -1,61 +1,92 @@
-import time
-import base64
-import hashlib
+import copy
 import datetime
-import pickle
+import time
+
+import config
+from cache import lru
+from metrics.registry import registry
+from session import codec
+from session.store import session_store
+
+# kept importable from here, handlers catch them by these names
+NoValidCookieRepresentationException = codec.NoValidCookieRepresentationException
+InvalidSignatireException = codec.InvalidSignatireException
 
-class NoValidCookieRepresentationException(Exception):
-    pass
-class InvalidSignatireException(Exception):
-    pass
+# cookie value -> session, values are signed so a hit was verified before
+_decoded = lru.LRUCache(config.SESSION_DECODED_ENTRIES)
+
+STORE_VERSION = 's1'
 
 class SimpleCookieSessionMixin(object):
-    
-    def __init__(self, expires=3600, domain=None, path='/', coockie_name='data', salt='custom_salt'):
+
+    def __init__(self, expires=3600, domain=None, path='/', coockie_name='data',
+                 secret=config.SESSION_SECRET, store=config.SESSION_STORE):
         self.cookie_name = coockie_name
         self.expires = expires
         self.domain = domain
         self.path = path
-        self.salt = salt
-        
+        self.secret = secret
+        self.store = store
+        self._session = None
+
     def set_session(self, data):
-        json_data = pickle.dumps(data)
-        self.response.headers.add_header('Set-Cookie', self._get_coockie_strig(json_data))
-        
+        if self.store:
+            value = codec.sign('%s.%s' % (STORE_VERSION, session_store.save(data, self.expires)), self.secret)
+        else:
+            value = codec.encode(data, self.secret)
+        self._session = (value, data)
+        self.response.headers.add_header('Set-Cookie', self._get_coockie_strig(value))
+
     def get_session(self):
-        cookie = self.request.headers.get('Cookie')
-        if cookie:
-            cookie_data = cookie.replace(self.cookie_name+'=', '')
-            parts = cookie_data.split('|')
-            if len(parts) > 1:
-                json_string = base64.b64decode(parts[0])
-                signed = parts[1]
-                if str(hashlib.md5(str(json_string)+str(self.salt)).hexdigest()) == signed:
-                    return pickle.loads(json_string)
-                else:
-                    raise InvalidSignatireException('Signature of cookie not valid!')
-            else:
-                raise NoValidCookieRepresentationException('Cookie not signed!')
+        """
+        Returns the session of the current request. The cookie is parsed once
+        per request, and decoding it once per process.
+        """
+        value = codec.parse_cookie(self.request.headers.get('Cookie'), self.cookie_name)
+        if self._session is not None and self._session[0] == value:
+            return self._session[1]
+        if not value:
+            data = {}
         else:
-            return {}
-            
-    def _get_coockie_strig(self, json_data):
+            data = _decoded.get(value)
+            if data is None:
+                started = time.time()
+                try:
+                    data = self._decode(value)
+                except (codec.NoValidCookieRepresentationException, codec.InvalidSignatireException):
+                    # forged, or written before session.codec, either way
+                    # the user has to log in again
+                    data = {}
+                else:
+                    # an empty session from the store may be a memcache
+                    # miss, the next request should ask again
+                    if data:
+                        _decoded.set(value, data)
+                registry.observe('session', 'decode', time.time() - started)
+            # the cached session is shared by every request of the process
+            data = copy.deepcopy(data)
+        self._session = (value, data)
+        return data
+
+    def _decode(self, value):
+        if value.startswith(STORE_VERSION + '.'):
+            session_id = codec.unsign(value, self.secret)[len(STORE_VERSION) + 1:]
+            return session_store.load(session_id) or {}
+        return codec.decode(value, self.secret)
+
+    def _get_coockie_strig(self, encoded_data):
         cookie = {}
         cookie['domain'] = self.domain
         cookie['path'] = self.path
-        
-        encoded_data = base64.b64encode(json_data)
-        signed_data = str(hashlib.md5(str(json_data)+str(self.salt)).hexdigest())
-        
-        cookie_string = self.cookie_name + '=' + encoded_data + '|' + signed_data
+
+        cookie_string = self.cookie_name + '=' + encoded_data
         if self.expires:
             expires_date = datetime.datetime.utcnow() + datetime.timedelta(0, self.expires)
             expires_str = expires_date.strftime('%a, %d-%b-%Y %H:%M:%S GMT')
             cookie_string += '; ' + str('expires') + '=' + str(expires_str)
-        
+
         for key in cookie:
-            if cookie[key] != None: 
+            if cookie[key] != None:
                 cookie_string += '; ' + str(key) + '=' + str(cookie[key])
-                
+
         return cookie_string
-        
\ No newline at end of file
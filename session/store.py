@@ -0,0 +1,51 @@
+"""
+Optional server side session storage.
+
+With SESSION_STORE switched on, the cookie only carries a signed session id
+and the session itself lives in memcache, with an in-process LRU in front of
+it so most requests resolve their session with a dictionary lookup. A session
+that got evicted from memcache is simply empty again.
+
+Stored sessions are never changed: every save goes to a fresh id, which is
+what keeps the per instance LRUs from handing out stale sessions after
+another instance logged the user out.
+"""
+
+import binascii
+import copy
+import os
+
+from google.appengine.api import memcache
+
+import config
+from cache import lru
+
+class SessionStore(object):
+
+    def __init__(self, namespace='session',
+                 local_entries=config.SESSION_STORE_LOCAL_ENTRIES):
+        self.namespace = namespace
+        self.local = lru.LRUCache(local_entries)
+
+    def new_id(self):
+        return binascii.hexlify(os.urandom(16))
+
+    def load(self, session_id):
+        data = self.local.get(session_id)
+        if data is None:
+            data = memcache.get(session_id, namespace=self.namespace)
+            if data is not None:
+                self.local.set(session_id, data)
+        return data
+
+    def save(self, data, expires):
+        """
+        Stores `data` under a new id and returns that id.
+        """
+        session_id = self.new_id()
+        # the caller keeps its reference and may change it
+        self.local.set(session_id, copy.deepcopy(data))
+        memcache.set(session_id, data, time=expires or 0, namespace=self.namespace)
+        return session_id
+
+session_store = SessionStore()